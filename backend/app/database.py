@@ -30,6 +30,10 @@ SessionLocal = sessionmaker(
 )
 
 
+# Characters of content kept in document.preview
+PREVIEW_LENGTH = 200
+
+
 def init_db():
     """Initialize database tables using raw SQL"""
     try:
@@ -43,21 +47,203 @@ def init_db():
                     language VARCHAR(50) NOT NULL DEFAULT 'vi',
                     doc_metadata JSON,
                     embedding BLOB,
-                    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    preview TEXT,
+                    content_hash VARCHAR(64)
                 )
             """))
             
+            # Columns added after the first release:
+            # - preview: short excerpt written at ingest, so hydrating search
+            #   hits never reads the full content column
+            # - content_hash: hash of what the passages/vectors were built
+            #   from, to skip re-indexing unchanged content
+            columns = {row[1] for row in conn.execute(text("PRAGMA table_info(document)"))}
+            for column, column_type in (("preview", "TEXT"), ("content_hash", "VARCHAR(64)")):
+                if column not in columns:
+                    conn.execute(text(f"ALTER TABLE document ADD COLUMN {column} {column_type}"))
+            conn.execute(
+                text("UPDATE document SET preview = substr(content, 1, :length) WHERE preview IS NULL"),
+                {"length": PREVIEW_LENGTH}
+            )
+            
             # Create indexes
             conn.execute(text("CREATE INDEX IF NOT EXISTS idx_document_language ON document(language)"))
             conn.execute(text("CREATE INDEX IF NOT EXISTS idx_document_title ON document(title)"))
             conn.execute(text("CREATE INDEX IF NOT EXISTS idx_document_created_at ON document(created_at)"))
+            
+            # Passages of each document; one embedding per passage
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS document_chunk (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    document_id INTEGER NOT NULL REFERENCES document(id) ON DELETE CASCADE,
+                    chunk_index INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    start_char INTEGER NOT NULL DEFAULT 0,
+                    embedding BLOB
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_document_chunk_document_id ON document_chunk(document_id)"))
+            
+            # Passage embeddings by SHA-256 of the passage text, reused
+            # across documents and re-uploads
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    content_hash VARCHAR(64) NOT NULL,
+                    model VARCHAR(255) NOT NULL,
+                    embedding BLOB NOT NULL,
+                    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (content_hash, model)
+                )
+            """))
+            
+            # Translations by language pair and SHA-256 of the normalized
+            # source text (persistent tier of the translation cache)
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS translation_cache (
+                    source_lang VARCHAR(10) NOT NULL,
+                    target_lang VARCHAR(10) NOT NULL,
+                    text_hash VARCHAR(64) NOT NULL,
+                    source_text TEXT NOT NULL,
+                    translated_text TEXT NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (source_lang, target_lang, text_hash)
+                )
+            """))
+
+            # Change counters shared by all workers: corpus (search_cache)
+            # and document attributes (search_filters)
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS corpus_generation (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    generation INTEGER NOT NULL DEFAULT 0,
+                    attributes INTEGER NOT NULL DEFAULT 0
+                )
+            """))
+            columns = {row[1] for row in conn.execute(text("PRAGMA table_info(corpus_generation)"))}
+            if "attributes" not in columns:
+                conn.execute(text("ALTER TABLE corpus_generation ADD COLUMN attributes INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(text("INSERT OR IGNORE INTO corpus_generation (id) VALUES (1)"))
+
+            # Durable background jobs (embedding + indexing of uploads)
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS ingest_job (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind VARCHAR(50) NOT NULL,
+                    document_id INTEGER,
+                    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    result JSON,
+                    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    run_after DATETIME,  -- retry backoff
+                    started_at DATETIME,
+                    finished_at DATETIME,
+                    lease_owner VARCHAR(255),  -- host:pid of the worker running it
+                    lease_until DATETIME
+                )
+            """))
+            columns = {row[1] for row in conn.execute(text("PRAGMA table_info(ingest_job)"))}
+            for column, column_type in (("lease_owner", "VARCHAR(255)"), ("lease_until", "DATETIME")):
+                if column not in columns:
+                    conn.execute(text(f"ALTER TABLE ingest_job ADD COLUMN {column} {column_type}"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ingest_job_status ON ingest_job(status, id)"))
+            
+            # Documents embedded before chunking existed keep their single
+            # whole-document vector as passage 0
+            conn.execute(text("""
+                INSERT INTO document_chunk (document_id, chunk_index, content, start_char, embedding)
+                SELECT d.id, 0, substr(d.content, 1, 2000), 0, d.embedding
+                FROM document d
+                WHERE d.embedding IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM document_chunk c WHERE c.document_id = d.id)
+            """))
         
+        init_fts()
         logger.info(f"Database initialized at {DB_FILE}")
     except Exception as e:
         logger.error(f"Database initialization error: {e}")
         raise
 
 
+# Set by init_fts(); lexical search is disabled when SQLite lacks FTS5
+FTS_AVAILABLE = False
+
+
+def init_fts():
+    """
+    Create the FTS5 index over document title/content. It is an
+    external-content table kept in sync by triggers, so the text is not
+    stored twice.
+    """
+    global FTS_AVAILABLE
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_fts'")
+            ).fetchone()
+            
+            conn.execute(text("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS document_fts USING fts5(
+                    title, content,
+                    content='document', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            """))
+            conn.execute(text("""
+                CREATE TRIGGER IF NOT EXISTS document_fts_ai AFTER INSERT ON document BEGIN
+                    INSERT INTO document_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+                END
+            """))
+            conn.execute(text("""
+                CREATE TRIGGER IF NOT EXISTS document_fts_ad AFTER DELETE ON document BEGIN
+                    INSERT INTO document_fts(document_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+                END
+            """))
+            conn.execute(text("""
+                CREATE TRIGGER IF NOT EXISTS document_fts_au AFTER UPDATE OF title, content ON document BEGIN
+                    INSERT INTO document_fts(document_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+                    INSERT INTO document_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+                END
+            """))
+            
+            if not exists:
+                # Index documents that predate the FTS table
+                conn.execute(text("INSERT INTO document_fts(document_fts) VALUES ('rebuild')"))
+        
+        FTS_AVAILABLE = True
+    except Exception as e:
+        FTS_AVAILABLE = False
+        logger.warning(f"FTS5 not available, lexical search disabled: {e}")
+
+
+def reserve_ids(session: Session, table: str, count: int) -> int:
+    """
+    Reserve `count` consecutive AUTOINCREMENT ids of `table` and return the
+    first, so a batch of rows (and rows referencing them) can be inserted
+    with executemany. Bumping sqlite_sequence takes the write lock, so the
+    range can't be handed out again before the transaction ends.
+    """
+    session.execute(
+        text(f"""
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT :table, COALESCE((SELECT MAX(id) FROM {table}), 0)
+            WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :table)
+        """),
+        {"table": table}
+    )
+    session.execute(
+        text("UPDATE sqlite_sequence SET seq = seq + :count WHERE name = :table"),
+        {"table": table, "count": count}
+    )
+    last = session.execute(
+        text("SELECT seq FROM sqlite_sequence WHERE name = :table"),
+        {"table": table}
+    ).scalar()
+    return last - count + 1
+
+
 def get_session() -> Generator[Session, None, None]:
     """Dependency for FastAPI to inject session"""
     with SessionLocal() as session:
@@ -0,0 +1,3 @@
+"""
+Pydantic request/response models
+"""
@@ -0,0 +1,64 @@
+"""
+Document and search request/response models
+"""
+
+import re
+from datetime import datetime
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional, List, Dict, Any, Literal, Union
+
+
+class DocumentUpload(BaseModel):
+    """Model for document upload / update"""
+    title: str
+    content: str = Field(..., min_length=1)
+    language: str = "en"
+    metadata: Optional[Dict[str, Any]] = None
+
+
+class SearchFilters(BaseModel):
+    """Pre-filters applied before ranking"""
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    # doc_metadata key -> required value (top-level keys, exact match)
+    metadata: Optional[Dict[str, Union[str, int, float, bool]]] = None
+
+    @field_validator("metadata")
+    @classmethod
+    def check_metadata_keys(cls, value):
+        for key in value or {}:
+            if not re.match(r"^[\w\-. ]+$", key):
+                raise ValueError(f"Invalid metadata filter key: {key!r}")
+        return value
+
+
+class SearchRequest(BaseModel):
+    """Model for semantic search request"""
+    query: str = Field(..., min_length=1)
+    top_k: int = Field(5, ge=1, le=100)
+    # Only return documents in this language (None = all languages)
+    language: Optional[str] = None
+    filters: Optional[SearchFilters] = None
+    # Vector engine: "exact" (NumPy brute force), "ann" (configured
+    # VECTOR_INDEX_BACKEND; "annoy" is kept as an alias) or "auto" to pick
+    # by corpus size
+    engine: Literal["auto", "exact", "ann", "annoy"] = "auto"
+    # Retriever: "vector" (semantic), "lexical" (BM25 over FTS5, no model
+    # needed) or "hybrid" (both, fused with reciprocal rank fusion)
+    mode: Literal["vector", "lexical", "hybrid"] = "vector"
+
+
+class SearchResult(BaseModel):
+    """Model for a single search hit"""
+    doc_id: int
+    title: str
+    content: str
+    score: float
+
+
+class SearchResponse(BaseModel):
+    """Model for search response"""
+    query: str
+    results: List[SearchResult]
+    total_results: int
+    processing_time: float
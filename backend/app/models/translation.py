@@ -0,0 +1,41 @@
+"""
+Translation request/response models
+"""
+
+from typing import Annotated, List
+
+from pydantic import BaseModel, Field
+
+
+class TranslationRequest(BaseModel):
+    """Model for translation request"""
+    text: str = Field(..., min_length=1, max_length=5000)
+    source_lang: str = "en"
+    target_lang: str = "vi"
+
+
+class TranslationResponse(BaseModel):
+    """Model for translation response"""
+    original_text: str
+    translated_text: str
+    source_lang: str
+    target_lang: str
+    cached: bool = False  # Served from the translation cache
+
+
+class BatchTranslationRequest(BaseModel):
+    """Model for batch translation request"""
+    texts: List[Annotated[str, Field(max_length=5000)]] = Field(..., min_length=1, max_length=1000)
+    source_lang: str = "en"
+    target_lang: str = "vi"
+
+
+class BatchTranslationResponse(BaseModel):
+    """Model for batch translation response (translations in input order)"""
+    translations: List[TranslationResponse]
+    source_lang: str
+    target_lang: str
+    total: int
+    unique: int  # Distinct segments after normalization
+    cached: int  # Distinct segments served from the translation cache
+    upstream_requests: int
@@ -2,25 +2,37 @@
 Document management API routes
 """
 
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import logging
 from typing import List
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from app.models.document import DocumentUpload
-from app.database import get_session
+from app.database import PREVIEW_LENGTH, get_session
+from app.services.job_queue import QueueFullError, job_queue
+from app.utils.file_extraction import SUPPORTED_EXTENSIONS, extract_text
 import json
 import os
+import tempfile
 from pathlib import Path
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Bulk NDJSON bodies are spooled to disk above this size
+BULK_SPOOL_BYTES = int(os.environ.get("BULK_SPOOL_BYTES", str(8 * 1024 * 1024)))
 
-@router.post("/documents/upload")
+
+def _queue_full(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+
+@router.post("/documents/upload", status_code=202)
 async def upload_document(document: DocumentUpload, session: Session = Depends(get_session)):
     """
-    Upload and index a new document
+    Upload a new document; it is embedded and indexed by a background job
     
     ### Parameters:
     - **title**: Document title
@@ -29,57 +41,44 @@ async def upload_document(document: DocumentUpload, session: Session = Depends(g
     - **metadata**: Optional metadata dictionary
     
     ### Returns:
-    - Document ID and confirmation
+    - Document ID and the ingest job ID (poll GET /api/jobs/{job_id})
     """
-    # Lazy import to avoid loading transformers/torch at startup
-    from app.utils.embedding_utils import serialize_embedding
-    from app.services.embedding_service import get_embedding, add_to_index
-    
     try:
+        job_queue.check_capacity(session)
+        
         # Insert into database using raw SQL
         metadata_json = json.dumps(document.metadata or {})
         result = session.execute(
             text("""
-                INSERT INTO document (title, content, language, doc_metadata, created_at)
-                VALUES (:title, :content, :language, :doc_metadata, CURRENT_TIMESTAMP)
+                INSERT INTO document (title, content, language, doc_metadata, preview, created_at)
+                VALUES (:title, :content, :language, :doc_metadata, :preview, CURRENT_TIMESTAMP)
             """),
             {
                 "title": document.title,
                 "content": document.content,
                 "language": document.language,
-                "doc_metadata": metadata_json
+                "doc_metadata": metadata_json,
+                "preview": document.content[:PREVIEW_LENGTH]
             }
         )
-        session.commit()
         doc_id = result.lastrowid
+        # Split into passages, embed and index them off the request path
+        job_id = job_queue.enqueue(session, "index_document", doc_id)
+        session.commit()
+        job_queue.notify()
         
-        # Generate embedding and add to FAISS index
-        embedding = get_embedding(document.content)
-        if embedding is not None:
-            embedding_bytes = serialize_embedding(embedding)
-            
-            # Save embedding to database
-            session.execute(
-                text("UPDATE document SET embedding = :embedding WHERE id = :id"),
-                {"embedding": embedding_bytes, "id": doc_id}
-            )
-            session.commit()
-            
-            # Add to FAISS index
-            add_to_index(doc_id, embedding)
-            logger.info(f"✓ Embedding created and indexed for doc_id={doc_id}")
-        else:
-            logger.warning(f"Could not generate embedding for doc_id={doc_id}")
-        
-        logger.info(f"Document uploaded: id={doc_id} - {document.title}")
+        logger.info(f"Document uploaded: id={doc_id} - {document.title} (job {job_id})")
         
         return {
             "doc_id": doc_id,
+            "job_id": job_id,
             "title": document.title,
-            "status": "indexed",
-            "message": "Document successfully uploaded and indexed"
+            "status": "queued",
+            "message": "Document saved; indexing in the background"
         }
     
+    except QueueFullError as e:
+        raise _queue_full(e)
     except Exception as e:
         logger.error(f"Upload error: {e}")
         raise HTTPException(
@@ -88,7 +87,7 @@ async def upload_document(document: DocumentUpload, session: Session = Depends(g
         )
 
 
-@router.post("/documents/upload-file")
+@router.post("/documents/upload-file", status_code=202)
 async def upload_file(file: UploadFile = File(...), language: str = "en", session: Session = Depends(get_session)):
     """
     Upload document from file (PDF, TXT, DOCX)
@@ -98,44 +97,20 @@ async def upload_file(file: UploadFile = File(...), language: str = "en", sessio
     - **language**: Document language (en, vi)
     
     ### Returns:
-    - Document ID and confirmation
+    - Document ID and the ingest job ID (poll GET /api/jobs/{job_id})
     """
-    from app.utils.embedding_utils import serialize_embedding
-    from app.services.embedding_service import get_embedding, add_to_index
-    
     try:
         # Validate file type
-        allowed_extensions = {'.txt', '.pdf', '.docx'}
         file_ext = Path(file.filename).suffix.lower()
         
-        if file_ext not in allowed_extensions:
-            raise HTTPException(status_code=400, detail=f"File type {file_ext} not supported. Use: {allowed_extensions}")
+        if file_ext not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"File type {file_ext} not supported. Use: {SUPPORTED_EXTENSIONS}")
+        
+        job_queue.check_capacity(session)
         
         # Read file content
         content = await file.read()
-        
-        if file_ext == '.txt':
-            text_content = content.decode('utf-8', errors='ignore')
-        elif file_ext == '.pdf':
-            # Simple PDF extraction (install pypdf2)
-            try:
-                import pypdf
-                pdf_reader = pypdf.PdfReader(file.file)
-                text_content = "\n".join([page.extract_text() for page in pdf_reader.pages])
-            except:
-                logger.warning("pypdf not installed, saving raw file")
-                text_content = f"[PDF content - {len(content)} bytes]"
-        elif file_ext == '.docx':
-            # Simple DOCX extraction (install python-docx)
-            try:
-                from docx import Document
-                doc = Document(file.file)
-                text_content = "\n".join([para.text for para in doc.paragraphs])
-            except:
-                logger.warning("python-docx not installed, saving raw file")
-                text_content = f"[DOCX content - {len(content)} bytes]"
-        else:
-            text_content = content.decode('utf-8', errors='ignore')
+        text_content = extract_text(file.filename, content)
         
         # Extract title from filename
         title = Path(file.filename).stem
@@ -144,44 +119,39 @@ async def upload_file(file: UploadFile = File(...), language: str = "en", sessio
         metadata_json = json.dumps({"filename": file.filename, "file_type": file_ext})
         result = session.execute(
             text("""
-                INSERT INTO document (title, content, language, doc_metadata, created_at)
-                VALUES (:title, :content, :language, :doc_metadata, CURRENT_TIMESTAMP)
+                INSERT INTO document (title, content, language, doc_metadata, preview, created_at)
+                VALUES (:title, :content, :language, :doc_metadata, :preview, CURRENT_TIMESTAMP)
             """),
             {
                 "title": title,
                 "content": text_content,
                 "language": language,
-                "doc_metadata": metadata_json
+                "doc_metadata": metadata_json,
+                "preview": text_content[:PREVIEW_LENGTH]
             }
         )
-        session.commit()
         doc_id = result.lastrowid
+        # Split into passages, embed and index them off the request path
+        job_id = job_queue.enqueue(session, "index_document", doc_id)
+        session.commit()
+        job_queue.notify()
         
-        # Generate embedding
-        embedding = get_embedding(text_content)
-        if embedding is not None:
-            embedding_bytes = serialize_embedding(embedding)
-            session.execute(
-                text("UPDATE document SET embedding = :embedding WHERE id = :id"),
-                {"embedding": embedding_bytes, "id": doc_id}
-            )
-            session.commit()
-            add_to_index(doc_id, embedding)
-            logger.info(f"✓ Embedding created and indexed for doc_id={doc_id}")
-        
-        logger.info(f"File uploaded: id={doc_id} - {title} ({file_ext})")
+        logger.info(f"File uploaded: id={doc_id} - {title} ({file_ext}, job {job_id})")
         
         return {
             "doc_id": doc_id,
+            "job_id": job_id,
             "title": title,
             "filename": file.filename,
             "file_type": file_ext,
-            "status": "indexed",
-            "message": "File successfully uploaded and indexed"
+            "status": "queued",
+            "message": "File saved; indexing in the background"
         }
     
     except HTTPException:
         raise
+    except QueueFullError as e:
+        raise _queue_full(e)
     except Exception as e:
         logger.error(f"File upload error: {e}")
         raise HTTPException(
@@ -197,6 +167,45 @@ async def upload_file(file: UploadFile = File(...), language: str = "en", sessio
         )
 
 
+@router.post("/documents/bulk")
+async def bulk_upload(request: Request, language: str = "en"):
+    """
+    Load many documents in one request
+    
+    ### Body (one of):
+    - **application/x-ndjson**: one JSON document per line
+      (`title`, `content`, `language`, `metadata`, as for /documents/upload)
+    - **multipart/form-data**: `files` fields (PDF, TXT, DOCX); `language`
+      query parameter applies to all of them
+    
+    ### Returns:
+    - NDJSON stream: one status line per item (`doc_id`, `status`,
+      `passages` or `error`), then a summary line with `docs_per_second`
+    """
+    from app.services.bulk_ingest import iter_files, iter_ndjson, stream_bulk_ingest
+    
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        files = [value for value in form.getlist("files") if hasattr(value, "filename")]
+        if not files:
+            await form.close()
+            raise HTTPException(status_code=400, detail="No files in multipart body (field name: files)")
+        items = iter_files(files, language)
+        cleanup = BackgroundTask(form.close)
+    else:
+        # The body is spooled (not parsed) before the response starts: a
+        # streaming response can't read the request body while it runs
+        spool = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_BYTES)
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        items = iter_ndjson(spool)
+        cleanup = BackgroundTask(spool.close)
+    
+    return StreamingResponse(stream_bulk_ingest(items), media_type="application/x-ndjson", background=cleanup)
+
+
 @router.get("/documents/list")
 async def list_documents(session: Session = Depends(get_session)):
     """List all uploaded documents"""
@@ -260,11 +269,10 @@ async def get_document(doc_id: int, session: Session = Depends(get_session)):
         )
 
 
-@router.put("/documents/{doc_id}")
+@router.put("/documents/{doc_id}", status_code=202)
 async def update_document(doc_id: int, document: DocumentUpload, session: Session = Depends(get_session)):
-    """Edit/Update a document"""
-    from app.utils.embedding_utils import serialize_embedding
-    from app.services.embedding_service import get_embedding, add_to_index
+    """Edit/Update a document; it is re-indexed by a background job"""
+    from app.services.search_cache import bump_index_generation
     
     try:
         # Check if document exists
@@ -275,6 +283,8 @@ async def update_document(doc_id: int, document: DocumentUpload, session: Sessio
         if not check_result.fetchone():
             raise HTTPException(status_code=404, detail="Document not found")
         
+        job_queue.check_capacity(session)
+        
         # Update document
         metadata_json = json.dumps(document.metadata or {})
         session.execute(
@@ -291,31 +301,27 @@ async def update_document(doc_id: int, document: DocumentUpload, session: Sessio
                 "id": doc_id
             }
         )
+        # Re-chunk and re-embed off the request path (a no-op for the
+        # vectors when only title/metadata changed)
+        job_id = job_queue.enqueue(session, "index_document", doc_id)
         session.commit()
+        job_queue.notify()
+        bump_index_generation()  # New title in search results right away
         
-        # Re-generate embedding
-        embedding = get_embedding(document.content)
-        if embedding is not None:
-            embedding_bytes = serialize_embedding(embedding)
-            session.execute(
-                text("UPDATE document SET embedding = :embedding WHERE id = :id"),
-                {"embedding": embedding_bytes, "id": doc_id}
-            )
-            session.commit()
-            add_to_index(doc_id, embedding)
-            logger.info(f"✓ Embedding updated for doc_id={doc_id}")
-        
-        logger.info(f"Document updated: id={doc_id} - {document.title}")
+        logger.info(f"Document updated: id={doc_id} - {document.title} (job {job_id})")
         
         return {
             "doc_id": doc_id,
+            "job_id": job_id,
             "title": document.title,
-            "status": "updated",
-            "message": "Document successfully updated and re-indexed"
+            "status": "queued",
+            "message": "Document updated; re-indexing in the background"
         }
     
     except HTTPException:
         raise
+    except QueueFullError as e:
+        raise _queue_full(e)
     except Exception as e:
         logger.error(f"Update error: {e}")
         raise HTTPException(
@@ -327,6 +333,11 @@ async def update_document(doc_id: int, document: DocumentUpload, session: Sessio
 @router.delete("/documents/{doc_id}")
 async def delete_document(doc_id: int, session: Session = Depends(get_session)):
     """Delete a document"""
+    from app.services.embedding_service import remove_from_index
+    from app.services.indexing_service import delete_document_chunks
+    from app.services.search_cache import bump_index_generation
+    from app.services.search_filters import document_attributes
+    
     try:
         # Check if document exists
         check_result = session.execute(
@@ -336,13 +347,19 @@ async def delete_document(doc_id: int, session: Session = Depends(get_session)):
         if not check_result.fetchone():
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Delete document
+        # Delete document and its passages
+        delete_document_chunks(session, doc_id)
         session.execute(
             text("DELETE FROM document WHERE id = :id"),
             {"id": doc_id}
         )
         session.commit()
         
+        # Keep the embedding store and search caches in sync
+        remove_from_index(doc_id)
+        document_attributes.remove(doc_id)
+        bump_index_generation()
+        
         logger.info(f"Document deleted: id={doc_id}")
         
         return {
@@ -0,0 +1,43 @@
+"""
+Background ingest job API routes
+"""
+
+from fastapi import APIRouter, HTTPException, Depends, Query
+import logging
+from typing import Literal, Optional
+from sqlalchemy.orm import Session
+from app.database import get_session
+from app.services.job_queue import job_queue
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.get("/jobs")
+async def list_jobs(
+    status: Optional[Literal["queued", "running", "done", "failed"]] = None,
+    limit: int = Query(50, ge=1, le=500),
+    session: Session = Depends(get_session)
+):
+    """List recent ingest jobs (newest first) and queue statistics"""
+    return {
+        "jobs": job_queue.list_jobs(session, status, limit),
+        "queue": job_queue.stats(session)
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int, session: Session = Depends(get_session)):
+    """
+    Get an ingest job
+    
+    ### Returns:
+    - **status**: queued, running, done or failed
+    - **attempts** / **error**: retries so far and the last failure
+    - **result**: e.g. the number of passages indexed
+    - **queue_position**: for queued jobs, 1 = next to run
+    """
+    job = job_queue.get_job(session, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
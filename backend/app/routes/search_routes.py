@@ -3,29 +3,97 @@ Document search API routes
 """
 
 from fastapi import APIRouter, HTTPException, Depends
+import asyncio
 import logging
+import os
 import time
+from typing import List
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from app.models.document import SearchRequest, SearchResponse, SearchResult
 from app.database import get_session
+from app.services.lexical_search import SearchHit, search_lexical, reciprocal_rank_fusion
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Hybrid mode: each retriever contributes this many candidates per result
+HYBRID_DEPTH = int(os.environ.get("HYBRID_DEPTH", "3"))
+
+
+
+async def _vector_hits(request: SearchRequest) -> List[SearchHit]:
+    """Semantic retriever: embed the query and search passage vectors"""
+    # Lazy import to avoid loading transformers/torch at startup
+    from app.services.embedding_service import get_query_embedding, search_index
+    from app.services.search_filters import build_allowed_bitmap
+    
+    query_embedding = await get_query_embedding(request.query)
+    if query_embedding is None:
+        logger.warning("Could not generate query embedding")
+        return []
+    
+    # The filter query and the exact / ANN scan block; keep them off the
+    # event loop so the lexical retriever (and other requests) run meanwhile
+    allowed = await asyncio.to_thread(build_allowed_bitmap, request.filters)
+    hits = await asyncio.to_thread(
+        search_index, query_embedding, request.top_k, request.engine,
+        language=request.language, allowed=allowed
+    )
+    return [
+        SearchHit(doc_id=doc_id, score=score, chunk_id=chunk_id)
+        for doc_id, score, chunk_id in hits
+    ]
+
+
+def _hydrate(session: Session, hits: List[SearchHit]) -> List[SearchResult]:
+    """
+    Fetch titles and snippets for all hits in one query, keeping rank
+    order. Vector hits show their best passage; other hits show the
+    lexical snippet or the stored preview, so the full content is never read.
+    """
+    doc_ids = [hit.doc_id for hit in hits]
+    chunk_ids = [hit.chunk_id for hit in hits if hit.chunk_id is not None]
+    rows = session.execute(
+        text("""
+            SELECT d.id, d.title, d.preview, c.content
+            FROM document d
+            LEFT JOIN document_chunk c ON c.document_id = d.id AND c.id IN :chunk_ids
+            WHERE d.id IN :doc_ids
+        """).bindparams(bindparam("doc_ids", expanding=True), bindparam("chunk_ids", expanding=True)),
+        {"doc_ids": doc_ids, "chunk_ids": chunk_ids}
+    ).fetchall()
+    found = {row[0]: row for row in rows}
+    
+    results = []
+    for hit in hits:
+        row = found.get(hit.doc_id)
+        if row is None:
+            continue  # Deleted since the index was searched
+        _, title, preview, passage = row
+        results.append(
+            SearchResult(
+                doc_id=hit.doc_id,
+                title=title or "Untitled",
+                content=passage if passage is not None else (hit.snippet or preview or ""),
+                score=round(hit.score, 3)
+            )
+        )
+    return results
+
 
 @router.post("/search", response_model=SearchResponse)
 async def search_documents(request: SearchRequest, session: Session = Depends(get_session)):
-    # Lazy import to avoid loading transformers/torch at startup
-    from app.services.embedding_service import get_embedding, search_index
-    from app.utils.embedding_utils import deserialize_embedding
     """
-    Search documents using semantic similarity (FAISS)
+    Search documents by semantic similarity, BM25 keywords, or both
     
     ### Parameters:
     - **query**: Search query text
     - **top_k**: Number of results to return (default: 5)
-    - **language**: Search language (default: "en")
+    - **language**: Only return documents in this language (default: all)
+    - **filters**: Optional created_after / created_before / metadata pre-filters
+    - **engine**: "auto" (default), "exact" or "ann" (alias "annoy")
+    - **mode**: "vector" (default), "lexical" or "hybrid"
     
     ### Returns:
     - **query**: Original search query
@@ -33,63 +101,56 @@ async def search_documents(request: SearchRequest, session: Session = Depends(ge
     - **total_results**: Total number of results
     - **processing_time**: Time taken to process search
     """
+    from app.services import search_cache
+    from app.services.search_cache import search_result_cache
+    
     try:
         start_time = time.time()
-        logger.info(f"Searching for: {request.query}")
+        logger.info(f"Searching for: {request.query} (mode={request.mode})")
         
-        # Generate embedding for query
-        query_embedding = get_embedding(request.query)
-        if query_embedding is None:
-            logger.warning("Could not generate query embedding")
-            return SearchResponse(
-                query=request.query,
-                results=[],
-                total_results=0,
-                processing_time=time.time() - start_time
-            )
-        
-        # Search FAISS index
-        search_results = search_index(query_embedding, request.top_k)
+        # Serve hot queries from the result cache while the corpus is unchanged
+        generation = search_cache.current_index_generation()
+        cache_key = search_result_cache.make_key(
+            request.query, request.top_k, request.language, request.engine, request.mode,
+            request.filters.model_dump_json() if request.filters else None
+        )
+        cached = search_result_cache.get(cache_key, generation)
+        if cached is not None:
+            return cached.model_copy(update={
+                "query": request.query,
+                "processing_time": time.time() - start_time
+            })
         
-        if not search_results:
-            logger.info("No results found in FAISS index")
-            return SearchResponse(
-                query=request.query,
-                results=[],
-                total_results=0,
-                processing_time=time.time() - start_time
+        if request.mode == "lexical":
+            # No model needed
+            hits = await asyncio.to_thread(
+                search_lexical, request.query, request.top_k, request.language, request.filters
             )
+        elif request.mode == "hybrid":
+            # Run both retrievers concurrently, then fuse by rank
+            depth = request.top_k * HYBRID_DEPTH
+            deep_request = request.model_copy(update={"top_k": depth})
+            lexical_hits, vector_hits = await asyncio.gather(
+                asyncio.to_thread(search_lexical, request.query, depth, request.language, request.filters),
+                _vector_hits(deep_request)
+            )
+            hits = reciprocal_rank_fusion([vector_hits, lexical_hits], request.top_k)
+        else:
+            hits = await _vector_hits(request)
         
-        # Fetch document details from DB
-        results = []
-        for doc_id, similarity_score in search_results:
-            try:
-                result = session.execute(
-                    text("SELECT id, title, content FROM document WHERE id = :id"),
-                    {"id": doc_id}
-                )
-                row = result.fetchone()
-                if row:
-                    results.append(
-                        SearchResult(
-                            doc_id=row[0],
-                            title=row[1] or "Untitled",
-                            content=row[2][:200] + "..." if len(row[2]) > 200 else row[2],
-                            score=round(similarity_score, 3)
-                        )
-                    )
-            except Exception as e:
-                logger.error(f"Error fetching document {doc_id}: {e}")
+        results = _hydrate(session, hits) if hits else []
         
         processing_time = time.time() - start_time
         logger.info(f"✓ Search completed: {len(results)} results in {processing_time:.2f}s")
         
-        return SearchResponse(
+        response = SearchResponse(
             query=request.query,
             results=results,
             total_results=len(results),
             processing_time=processing_time
         )
+        search_result_cache.put(cache_key, generation, response, len(response.model_dump_json()))
+        return response
     
     except Exception as e:
         logger.error(f"Search error: {e}")
@@ -107,14 +168,31 @@ async def get_search_stats(session: Session = Depends(get_session)):
         total_docs = result.scalar()
         
         result = session.execute(
-            text("SELECT COUNT(*) FROM document WHERE embedding IS NOT NULL")
+            text("SELECT COUNT(DISTINCT document_id), COUNT(*) FROM document_chunk WHERE embedding IS NOT NULL")
         )
-        indexed_docs = result.scalar()
+        indexed_docs, indexed_passages = result.fetchone()
+        
+        from app.services.embedding_scheduler import get_scheduler
+        from app.services.inference import inference_executor
+        from app.services.embedding_pool import embedding_pool
+        from app.services.embedding_sidecar import sidecar_client
+        from app.services.embedding_service import index_stats, quantization_stats
+        from app.services.search_cache import query_embedding_cache, search_result_cache
         
         return {
             "total_documents": total_docs or 0,
             "indexed_documents": indexed_docs or 0,
-            "faiss_enabled": True
+            "indexed_passages": indexed_passages or 0,
+            "faiss_enabled": True,
+            "vector_index": index_stats(),
+            # Sampled recall runs full scans; cached until the store changes
+            "vector_precision": await asyncio.to_thread(quantization_stats),
+            "embedding_scheduler": get_scheduler().stats(),
+            "inference_executor": inference_executor.stats(),
+            "embedding_pool": embedding_pool.stats() if embedding_pool is not None else None,
+            "embedding_sidecar": sidecar_client.stats() if sidecar_client.enabled else None,
+            "query_embedding_cache": query_embedding_cache.stats(),
+            "result_cache": search_result_cache.stats()
         }
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
@@ -5,8 +5,8 @@ Web Search API routes - Free web search with fallback data
 from fastapi import APIRouter, HTTPException
 import logging
 from pydantic import BaseModel
-import requests
 from typing import Optional, List
+from app.services.http_client import http_client
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -213,7 +213,7 @@ async def search_web(request: WebSearchRequest):
                 "skip_disambig": 1
             }
             
-            response = requests.get("https://api.duckduckgo.com/", params=params, headers=headers, timeout=8)
+            response = await http_client.get("https://api.duckduckgo.com/", params=params, headers=headers, timeout=8)
             
             if response.status_code == 200:
                 data = response.json()
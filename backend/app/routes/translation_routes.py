@@ -3,10 +3,20 @@ Translation API routes using Google Translate API (Free, powerful, reliable)
 """
 
 from fastapi import APIRouter, HTTPException
+import asyncio
 import logging
-from app.models.translation import TranslationRequest, TranslationResponse
-import requests
-import json
+import os
+from typing import List
+from urllib.parse import quote_plus
+import httpx
+from app.models.translation import (
+    BatchTranslationRequest,
+    BatchTranslationResponse,
+    TranslationRequest,
+    TranslationResponse,
+)
+from app.services.http_client import http_client
+from app.services.translation_cache import normalize_text, translation_cache
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -20,6 +30,12 @@ LANGUAGE_MAP = {
     "vi": "vi",
 }
 
+# Batch translation: URL-encoded bytes of the packed q parameter of one
+# upstream GET (non-ASCII text grows up to 9x when percent-encoded, and
+# Google rejects long URLs), and concurrent upstream requests per batch
+TRANSLATE_BATCH_MAX_URL_BYTES = int(os.environ.get("TRANSLATE_BATCH_MAX_URL_BYTES", "2000"))
+TRANSLATE_BATCH_CONCURRENCY = int(os.environ.get("TRANSLATE_BATCH_CONCURRENCY", "4"))
+
 # Headers to mimic browser request
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
@@ -31,6 +47,44 @@ def load_translation_models():
     logger.info("✓ Google Translate API ready (online service - free & powerful)")
 
 
+async def fetch_translation(text: str, source_lang: str, target_lang: str) -> str:
+    """Translate text with the upstream Google endpoint (httpx errors propagate)"""
+    # Format: https://translate.googleapis.com/translate_a/single?client=gtx&sl=en&tl=vi&dt=t&q=hello
+    params = {
+        "client": "gtx",
+        "sl": LANGUAGE_MAP[source_lang],  # source language
+        "tl": LANGUAGE_MAP[target_lang],  # target language
+        "dt": "t",  # request type (t = translation)
+        "q": text  # text to translate
+    }
+    
+    response = await http_client.get(
+        GOOGLE_TRANSLATE_API,
+        params=params,
+        headers=HEADERS,
+        timeout=10
+    )
+    response.raise_for_status()
+    
+    # Google Translate returns nested array: [[[translated_text, original_text, ...]]]
+    result = response.json()
+    
+    if not result or len(result) == 0 or not result[0]:
+        logger.error(f"Unexpected response format: {result}")
+        raise ValueError("Invalid response format from Google Translate")
+    
+    # Collect all translated sentences (not just first one)
+    translated_parts = []
+    for translation_pair in result[0]:
+        if len(translation_pair) > 0 and translation_pair[0]:
+            translated_parts.append(translation_pair[0])
+    
+    translated_text = "".join(translated_parts)
+    if not translated_text:
+        raise ValueError("Empty translation returned")
+    return translated_text
+
+
 @router.post("/translate", response_model=TranslationResponse)
 async def translate_text(request: TranslationRequest):
     """
@@ -46,6 +100,7 @@ async def translate_text(request: TranslationRequest):
     - **translated_text**: Translated text
     - **source_lang**: Source language
     - **target_lang**: Target language
+    - **cached**: Whether the translation came from the translation cache
     """
     try:
         logger.info(f"Translating from {request.source_lang} to {request.target_lang}: {request.text[:50]}...")
@@ -66,56 +121,40 @@ async def translate_text(request: TranslationRequest):
                 target_lang=request.target_lang
             )
         
-        # Google Translate API call
-        # Format: https://translate.googleapis.com/translate_a/single?client=gtx&sl=en&tl=vi&dt=t&q=hello
-        params = {
-            "client": "gtx",
-            "sl": LANGUAGE_MAP[request.source_lang],  # source language
-            "tl": LANGUAGE_MAP[request.target_lang],  # target language
-            "dt": "t",  # request type (t = translation)
-            "q": request.text  # text to translate
-        }
-        
-        response = requests.get(
-            GOOGLE_TRANSLATE_API,
-            params=params,
-            headers=HEADERS,
-            timeout=10
+        key = normalize_text(request.text)
+        cached = await asyncio.to_thread(
+            translation_cache.lookup_many, request.source_lang, request.target_lang, [key]
         )
-        response.raise_for_status()
-        
-        # Google Translate returns nested array: [[[translated_text, original_text, ...]]]
-        result = response.json()
+        if key in cached:
+            return TranslationResponse(
+                original_text=request.text,
+                translated_text=cached[key],
+                source_lang=request.source_lang,
+                target_lang=request.target_lang,
+                cached=True
+            )
         
-        if result and len(result) > 0 and len(result[0]) > 0:
-            # Collect all translated sentences (not just first one)
-            translated_parts = []
-            for translation_pair in result[0]:
-                if len(translation_pair) > 0 and translation_pair[0]:
-                    translated_parts.append(translation_pair[0])
-            
-            translated_text = "".join(translated_parts)
-            
-            if translated_text:
-                logger.info(f"✓ Translation successful: '{request.text[:40]}...' -> '{translated_text[:40]}...'")
-                return TranslationResponse(
-                    original_text=request.text,
-                    translated_text=translated_text,
-                    source_lang=request.source_lang,
-                    target_lang=request.target_lang
-                )
-            else:
-                raise ValueError("Empty translation returned")
-        else:
-            logger.error(f"Unexpected response format: {result}")
-            raise ValueError("Invalid response format from Google Translate")
+        translated_text = await fetch_translation(key, request.source_lang, request.target_lang)
+        await asyncio.to_thread(
+            translation_cache.store_many, request.source_lang, request.target_lang, {key: translated_text}
+        )
+        logger.info(f"✓ Translation successful: '{request.text[:40]}...' -> '{translated_text[:40]}...'")
+        return TranslationResponse(
+            original_text=request.text,
+            translated_text=translated_text,
+            source_lang=request.source_lang,
+            target_lang=request.target_lang
+        )
             
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Google Translate request timeout (10s)")
         raise HTTPException(status_code=504, detail="Translation service timeout")
-    except requests.exceptions.ConnectionError as e:
+    except httpx.TransportError as e:
         logger.error(f"Connection error: {e}")
         raise HTTPException(status_code=503, detail="Cannot connect to translation service")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Google Translate returned HTTP {e.response.status_code}")
+        raise HTTPException(status_code=502, detail=f"Translation service error (HTTP {e.response.status_code})")
     except HTTPException:
         raise
     except Exception as e:
@@ -123,6 +162,139 @@ async def translate_text(request: TranslationRequest):
         raise HTTPException(status_code=500, detail=f"Translation failed: {str(e)}")
 
 
+def pack_segments(segments: List[str], max_bytes: int = TRANSLATE_BATCH_MAX_URL_BYTES) -> List[List[str]]:
+    """
+    Group segments, in order, into packs whose newline-joined text is at
+    most max_bytes once URL-encoded. A segment over the budget goes alone.
+    """
+    separator = len(quote_plus("\n"))
+    packs = []
+    current = []
+    size = 0
+    for segment in segments:
+        length = len(quote_plus(segment))
+        if current and size + separator + length > max_bytes:
+            packs.append(current)
+            current = []
+            size = 0
+        size += length + (separator if current else 0)
+        current.append(segment)
+    if current:
+        packs.append(current)
+    return packs
+
+
+@router.post("/translate/batch", response_model=BatchTranslationResponse)
+async def translate_batch(request: BatchTranslationRequest):
+    """
+    Translate a list of texts in one call
+    
+    Identical segments (after normalization) are translated once, cached
+    segments are not sent upstream, and the rest are joined by newlines into
+    as few upstream requests as TRANSLATE_BATCH_MAX_URL_BYTES allows, at most
+    TRANSLATE_BATCH_CONCURRENCY of them at a time. Translations come back in
+    input order.
+    """
+    source_lang, target_lang = request.source_lang, request.target_lang
+    try:
+        if source_lang not in LANGUAGE_MAP or target_lang not in LANGUAGE_MAP:
+            raise HTTPException(
+                status_code=400,
+                detail="Unsupported language pair. Supported: en, vi"
+            )
+        
+        keys = [normalize_text(value) for value in request.texts]
+        unique = [key for key in dict.fromkeys(keys) if key]
+        
+        if source_lang == target_lang:
+            # Returned as-is, like /translate
+            cached = {}
+            translations = {}
+            missing = []
+        else:
+            cached = await asyncio.to_thread(translation_cache.lookup_many, source_lang, target_lang, unique)
+            translations = dict(cached)
+            missing = [key for key in unique if key not in translations]
+        
+        upstream_requests = 0
+        semaphore = asyncio.Semaphore(max(1, TRANSLATE_BATCH_CONCURRENCY))
+        
+        async def upstream(text: str) -> str:
+            nonlocal upstream_requests
+            async with semaphore:
+                upstream_requests += 1
+                return await fetch_translation(text, source_lang, target_lang)
+        
+        async def translate_pack(pack: List[str]):
+            results = None
+            if len(pack) > 1:
+                try:
+                    lines = (await upstream("\n".join(pack))).split("\n")
+                except httpx.HTTPStatusError as e:
+                    # E.g. 413/414 for a pack Google finds too long; the
+                    # segments may still go through one by one
+                    logger.warning(f"Packed translation of {len(pack)} segments got HTTP {e.response.status_code}, retrying singly")
+                else:
+                    counts = [segment.count("\n") + 1 for segment in pack]
+                    if len(lines) == sum(counts):
+                        results = []
+                        start = 0
+                        for count in counts:
+                            results.append("\n".join(lines[start:start + count]).strip())
+                            start += count
+                    else:
+                        # Line breaks weren't kept, so the pack can't be split
+                        # back into segments; translate them one by one
+                        logger.warning(f"Packed translation of {len(pack)} segments lost line breaks, retrying singly")
+            if results is None:
+                results = await asyncio.gather(*(upstream(segment) for segment in pack))
+            # Cached per pack, so a retry after a failed pack only sends the rest
+            translated = dict(zip(pack, results))
+            await asyncio.to_thread(translation_cache.store_many, source_lang, target_lang, translated)
+            translations.update(translated)
+        
+        if missing:
+            await asyncio.gather(*(translate_pack(pack) for pack in pack_segments(missing)))
+            logger.info(
+                f"✓ Batch translated {len(missing)} segments in {upstream_requests} upstream requests "
+                f"({len(request.texts)} texts, {len(cached)} cached)"
+            )
+        
+        return BatchTranslationResponse(
+            translations=[
+                TranslationResponse(
+                    original_text=original,
+                    translated_text=translations.get(key, original) if key else original,
+                    source_lang=source_lang,
+                    target_lang=target_lang,
+                    cached=key in cached
+                )
+                for original, key in zip(request.texts, keys)
+            ],
+            source_lang=source_lang,
+            target_lang=target_lang,
+            total=len(request.texts),
+            unique=len(unique),
+            cached=len(cached),
+            upstream_requests=upstream_requests
+        )
+    
+    except httpx.TimeoutException:
+        logger.error("Google Translate request timeout during batch")
+        raise HTTPException(status_code=504, detail="Translation service timeout")
+    except httpx.TransportError as e:
+        logger.error(f"Connection error: {e}")
+        raise HTTPException(status_code=503, detail="Cannot connect to translation service")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Google Translate returned HTTP {e.response.status_code} during batch")
+        raise HTTPException(status_code=502, detail=f"Translation service error (HTTP {e.response.status_code})")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"✗ Batch translation error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Batch translation failed: {str(e)}")
+
+
 @router.get("/translate/languages")
 async def get_supported_languages():
     """Get list of supported language pairs"""
@@ -133,3 +305,9 @@ async def get_supported_languages():
         ],
         "total": 2
     }
+
+
+@router.get("/translate/stats")
+async def get_translation_stats():
+    """Translation cache hit rates"""
+    return {"translation_cache": translation_cache.stats()}
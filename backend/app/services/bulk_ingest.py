@@ -0,0 +1,418 @@
+"""
+Bulk document ingest: batched inserts, large embedding batches and a single
+vector index rebuild at the end of the load. The same path re-embeds stored
+documents (e.g. after an embedding model change).
+
+Encoding goes to the multi-process embedding pool when EMBED_POOL_WORKERS
+is set, otherwise to the in-process inference executor.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import AsyncIterator, IO, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+from pydantic import ValidationError
+from sqlalchemy import bindparam, text
+
+from app.models.document import DocumentUpload
+from app.services.embedding_cache import collect_garbage, document_hash, embed_cached
+from app.services.embedding_pool import get_embedding_pool
+from app.services.inference import inference_executor
+from app.services.search_cache import bump_index_generation
+from app.utils.text_chunking import chunk_text
+
+logger = logging.getLogger(__name__)
+
+# Documents per database transaction / status flush
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "256"))
+# Passages per encode call (bypasses the request micro-batcher, which is
+# tuned for latency rather than throughput)
+BULK_EMBED_BATCH_SIZE = int(os.environ.get("BULK_EMBED_BATCH_SIZE", "256"))
+
+
+class BulkItem(NamedTuple):
+    """One input document, or the reason it could not be parsed"""
+    ref: dict  # Identifies the item in the status stream ({"line": n} or {"filename": ...})
+    document: Optional[DocumentUpload]
+    error: Optional[str] = None
+
+
+def iter_ndjson(stream: IO[bytes]) -> Iterator[BulkItem]:
+    """Parse an NDJSON body line by line; blank lines are skipped"""
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        ref = {"line": line_no}
+        try:
+            yield BulkItem(ref, DocumentUpload.model_validate(json.loads(line)))
+        except (ValueError, ValidationError) as e:
+            yield BulkItem(ref, None, str(e).splitlines()[0])
+
+
+def iter_files(files: list, language: str) -> Iterator[BulkItem]:
+    """Turn uploaded files (multipart) into documents titled by file name"""
+    from app.utils.file_extraction import SUPPORTED_EXTENSIONS, extract_text
+
+    for file in files:
+        ref = {"filename": file.filename}
+        file_ext = Path(file.filename).suffix.lower()
+        if file_ext not in SUPPORTED_EXTENSIONS:
+            yield BulkItem(ref, None, f"File type {file_ext} not supported")
+            continue
+        try:
+            document = DocumentUpload(
+                title=Path(file.filename).stem,
+                content=extract_text(file.filename, file.file.read()),
+                language=language,
+                metadata={"filename": file.filename, "file_type": file_ext}
+            )
+            yield BulkItem(ref, document)
+        except (ValueError, ValidationError) as e:
+            yield BulkItem(ref, None, str(e).splitlines()[0])
+
+
+def _batches(items: Iterator[BulkItem], size: int) -> Iterator[List[BulkItem]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _encode(texts: List[str]) -> Optional[np.ndarray]:
+    """Encode passages in BULK_EMBED_BATCH_SIZE slices (runs on the inference executor)"""
+    from app.services.embedding_service import get_embeddings
+
+    if not texts:
+        return None
+    parts = []
+    for start in range(0, len(texts), BULK_EMBED_BATCH_SIZE):
+        part = get_embeddings(texts[start:start + BULK_EMBED_BATCH_SIZE])
+        if part is None:
+            return None
+        parts.append(part)
+    return np.concatenate(parts)
+
+
+async def _encode_async(texts: List[str]) -> Optional[np.ndarray]:
+    from app.services.embedding_sidecar import EMBEDDING_SIDECAR_FALLBACK, sidecar_client
+
+    pool = get_embedding_pool()
+    if pool is not None:
+        # The pool call only waits on worker processes
+        return await asyncio.to_thread(pool.encode, texts)
+    if sidecar_client.enabled:
+        vectors = await sidecar_client.embed_many(texts)
+        if vectors is not None or not EMBEDDING_SIDECAR_FALLBACK:
+            return vectors
+    return await inference_executor.run(_encode, texts)
+
+
+class BulkIngestor:
+    """Ingests batches of documents and keeps load totals"""
+
+    def __init__(self, session):
+        self.session = session
+        self.started = time.perf_counter()
+        self.indexed = 0
+        self.failed = 0
+        self.passages = 0
+        self.vectors = 0
+        self.reused = 0
+        self.computed = 0
+
+    def _write_batch(self, documents: List[DocumentUpload], passages: list, embeddings: Optional[np.ndarray]) -> List[int]:
+        """Insert documents and passages in one transaction; returns the doc ids"""
+        from app.database import PREVIEW_LENGTH, reserve_ids
+        from app.utils.embedding_utils import serialize_embedding
+        from app.services.embedding_service import EMBEDDING_CACHE_KEY, add_many_to_store
+        from app.services.search_filters import document_attributes
+
+        session = self.session
+        n_passages = sum(len(doc_passages) for doc_passages in passages)
+        try:
+            first_doc = reserve_ids(session, "document", len(documents))
+            first_chunk = reserve_ids(session, "document_chunk", n_passages) if n_passages else 0
+            doc_ids = list(range(first_doc, first_doc + len(documents)))
+
+            session.execute(
+                text("""
+                    INSERT INTO document (id, title, content, language, doc_metadata, preview, content_hash, created_at)
+                    VALUES (:id, :title, :content, :language, :doc_metadata, :preview, :content_hash, CURRENT_TIMESTAMP)
+                """),
+                [
+                    {
+                        "id": doc_id,
+                        "title": document.title,
+                        "content": document.content,
+                        "language": document.language,
+                        "doc_metadata": json.dumps(document.metadata or {}),
+                        "preview": document.content[:PREVIEW_LENGTH],
+                        "content_hash": document_hash(
+                            document.content, document.language, EMBEDDING_CACHE_KEY
+                        ) if embeddings is not None else None
+                    }
+                    for doc_id, document in zip(doc_ids, documents)
+                ]
+            )
+
+            chunk_rows, entries = [], []
+            row = 0
+            for doc_id, doc_passages in zip(doc_ids, passages):
+                chunk_ids = list(range(first_chunk + row, first_chunk + row + len(doc_passages)))
+                for chunk_id, passage in zip(chunk_ids, doc_passages):
+                    chunk_rows.append({
+                        "id": chunk_id,
+                        "document_id": doc_id,
+                        "chunk_index": passage.index,
+                        "content": passage.text,
+                        "start_char": passage.start_char,
+                        "embedding": serialize_embedding(embeddings[row + passage.index]) if embeddings is not None else None
+                    })
+                if embeddings is not None:
+                    entries.append((doc_id, chunk_ids, embeddings[row:row + len(doc_passages)]))
+                row += len(doc_passages)
+            if chunk_rows:
+                session.execute(
+                    text("""
+                        INSERT INTO document_chunk (id, document_id, chunk_index, content, start_char, embedding)
+                        VALUES (:id, :document_id, :chunk_index, :content, :start_char, :embedding)
+                    """),
+                    chunk_rows
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        document_attributes.set_languages(
+            (doc_id, document.language) for doc_id, document in zip(doc_ids, documents)
+        )
+        self.vectors += add_many_to_store(entries)
+        bump_index_generation()
+        return doc_ids
+
+    async def ingest(self, batch: List[BulkItem]) -> List[dict]:
+        """Ingest one batch; returns a status per input item"""
+        valid = [item for item in batch if item.document is not None]
+        passages = [chunk_text(item.document.content) for item in valid]
+        from app.services.embedding_service import EMBEDDING_CACHE_KEY
+
+        # Passages seen before (re-uploads, shared boilerplate) come from the cache
+        embeddings, reused, computed = await embed_cached(
+            self.session,
+            [p.text for doc_passages in passages for p in doc_passages],
+            _encode_async,
+            EMBEDDING_CACHE_KEY
+        )
+
+        statuses = {}
+        if valid:
+            try:
+                doc_ids = await asyncio.to_thread(
+                    self._write_batch, [item.document for item in valid], passages, embeddings
+                )
+                for item, doc_id, doc_passages in zip(valid, doc_ids, passages):
+                    statuses[id(item)] = {
+                        "doc_id": doc_id,
+                        "status": "indexed" if embeddings is not None else "stored",
+                        "passages": len(doc_passages)
+                    }
+                self.indexed += len(valid)
+                self.reused += reused
+                self.computed += computed
+                self.passages += sum(len(doc_passages) for doc_passages in passages)
+            except Exception as e:
+                logger.error(f"Bulk batch failed: {e}")
+                for item in valid:
+                    statuses[id(item)] = {"status": "error", "error": f"Batch failed: {e}"}
+                self.failed += len(valid)
+
+        results = []
+        for item in batch:
+            if item.document is None:
+                self.failed += 1
+                results.append({**item.ref, "status": "error", "error": item.error})
+            else:
+                results.append({**item.ref, **statuses[id(item)]})
+        return results
+
+    def _rewrite_batch(self, rows: List[tuple], passages: list, embeddings: np.ndarray):
+        """Replace the passages and vectors of stored documents in one transaction"""
+        from app.database import reserve_ids
+        from app.utils.embedding_utils import serialize_embedding
+        from app.services.embedding_service import EMBEDDING_CACHE_KEY, add_many_to_store, remove_many_from_index
+
+        session = self.session
+        doc_ids = [row[0] for row in rows]
+        n_passages = sum(len(doc_passages) for doc_passages in passages)
+        try:
+            session.execute(
+                text("DELETE FROM document_chunk WHERE document_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": doc_ids}
+            )
+            first_chunk = reserve_ids(session, "document_chunk", n_passages) if n_passages else 0
+            chunk_rows, entries = [], []
+            offset = 0
+            for doc_id, doc_passages in zip(doc_ids, passages):
+                chunk_ids = list(range(first_chunk + offset, first_chunk + offset + len(doc_passages)))
+                for chunk_id, passage in zip(chunk_ids, doc_passages):
+                    chunk_rows.append({
+                        "id": chunk_id,
+                        "document_id": doc_id,
+                        "chunk_index": passage.index,
+                        "content": passage.text,
+                        "start_char": passage.start_char,
+                        "embedding": serialize_embedding(embeddings[offset + passage.index])
+                    })
+                if doc_passages:
+                    entries.append((doc_id, chunk_ids, embeddings[offset:offset + len(doc_passages)]))
+                offset += len(doc_passages)
+            if chunk_rows:
+                session.execute(
+                    text("""
+                        INSERT INTO document_chunk (id, document_id, chunk_index, content, start_char, embedding)
+                        VALUES (:id, :document_id, :chunk_index, :content, :start_char, :embedding)
+                    """),
+                    chunk_rows
+                )
+            session.execute(
+                text("UPDATE document SET embedding = NULL, content_hash = :content_hash WHERE id = :id"),
+                [
+                    {"id": doc_id, "content_hash": document_hash(content, language, EMBEDDING_CACHE_KEY)}
+                    for doc_id, content, language in rows
+                ]
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        # Like a delete: the old vectors are also tombstoned in the index
+        # segments and dropped from the delta, so searches before the final
+        # rebuild don't return them
+        if not remove_many_from_index(doc_ids):
+            raise RuntimeError(f"Could not remove the old vectors of {len(doc_ids)} documents")
+        self.vectors += add_many_to_store(entries)
+        bump_index_generation()
+
+    async def reembed(self, rows: List[tuple]):
+        """Re-chunk and re-encode stored documents, rows of (doc_id, content, language)"""
+        from app.services.embedding_service import EMBEDDING_CACHE_KEY
+
+        passages = [chunk_text(content) for _, content, _ in rows]
+        embeddings, reused, computed = await embed_cached(
+            self.session,
+            [p.text for doc_passages in passages for p in doc_passages],
+            _encode_async,
+            EMBEDDING_CACHE_KEY
+        )
+        if embeddings is None and any(passages):
+            logger.error(f"Re-embedding failed for {len(rows)} documents")
+            self.failed += len(rows)
+            return
+        try:
+            await asyncio.to_thread(self._rewrite_batch, rows, passages, embeddings)
+            self.indexed += len(rows)
+            self.reused += reused
+            self.computed += computed
+            self.passages += sum(len(doc_passages) for doc_passages in passages)
+        except Exception as e:
+            logger.error(f"Re-embedding batch failed: {e}")
+            self.failed += len(rows)
+
+    async def finish(self) -> dict:
+        """Rebuild the vector index once and summarize the load"""
+        from app.services.embedding_service import rebuild_index_from_db
+
+        if self.vectors:
+            await asyncio.to_thread(rebuild_index_from_db, self.session)
+        elapsed = time.perf_counter() - self.started
+        pool = get_embedding_pool()
+        return {
+            "status": "done",
+            "indexed": self.indexed,
+            "failed": self.failed,
+            "passages": self.passages,
+            "vectors": self.vectors,
+            "embeddings_reused": self.reused,
+            "embeddings_computed": self.computed,
+            "index_rebuilt": bool(self.vectors),
+            "seconds": round(elapsed, 3),
+            "docs_per_second": round(self.indexed / elapsed, 1) if elapsed > 0 else 0.0,
+            "embedding_pool": pool.stats() if pool is not None else None
+        }
+
+
+async def stream_bulk_ingest(items: Iterator[BulkItem]) -> AsyncIterator[bytes]:
+    """Ingest items batch by batch, yielding one NDJSON status line per item and a summary line"""
+    from app.database import SessionLocal
+
+    with SessionLocal() as session:
+        ingestor = BulkIngestor(session)
+        for batch in _batches(items, max(1, BULK_BATCH_SIZE)):
+            for status in await ingestor.ingest(batch):
+                yield (json.dumps(status) + "\n").encode()
+        summary = await ingestor.finish()
+    logger.info(f"✓ Bulk ingest: {summary['indexed']} documents, {summary['failed']} failed, {summary['docs_per_second']} docs/s")
+    yield (json.dumps(summary) + "\n").encode()
+
+
+async def reembed_documents(only_stale: bool = True) -> dict:
+    """
+    Rebuild the passages and vectors of stored documents from their text,
+    then the vector index. only_stale: just documents whose content hash
+    doesn't match the current model / chunking (e.g. after EMBEDDING_MODEL
+    changed) or that were never embedded.
+    """
+    from app.database import SessionLocal
+    from app.services.embedding_service import EMBEDDING_CACHE_KEY
+
+    with SessionLocal() as session:
+        ingestor = BulkIngestor(session)
+        last_id = 0
+        while True:
+            rows = session.execute(
+                text("SELECT id, content, language, content_hash FROM document WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": max(1, BULK_BATCH_SIZE)}
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            stale = [
+                (doc_id, content, language)
+                for doc_id, content, language, content_hash in rows
+                if not only_stale or content_hash != document_hash(content, language, EMBEDDING_CACHE_KEY)
+            ]
+            if stale:
+                await ingestor.reembed(stale)
+        summary = await ingestor.finish()
+    try:
+        # Entries of the replaced passages (or of the previous model) are dead now
+        summary["cache_entries_deleted"] = await asyncio.to_thread(collect_garbage, EMBEDDING_CACHE_KEY)
+    except Exception as e:
+        logger.warning(f"Embedding cache garbage collection failed: {e}")
+    logger.info(f"✓ Re-embedded {summary['indexed']} documents, {summary['failed']} failed, {summary['docs_per_second']} docs/s")
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Re-embed stored documents and rebuild the vector index")
+    parser.add_argument("--all", action="store_true", help="Re-embed every document, not just stale ones")
+    args = parser.parse_args()
+    try:
+        print(json.dumps(asyncio.run(reembed_documents(only_stale=not args.all)), indent=2))
+    finally:
+        from app.services.embedding_pool import shutdown_embedding_pool
+        shutdown_embedding_pool()
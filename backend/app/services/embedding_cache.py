@@ -0,0 +1,138 @@
+"""
+Content-hash deduplication of embedding work
+
+Every embedded passage is cached in the embedding_cache table under the
+SHA-256 of its text and the model key (model name plus runtime), so
+re-uploads and edits only encode passages that are new. collect_garbage()
+drops entries no stored passage uses any more. Documents also carry a content_hash of everything
+that determines their passages and vectors; when it is unchanged, indexing
+is skipped altogether.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from app.utils.text_chunking import CHUNK_OVERLAP, CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Unused cache rows younger than this survive garbage collection: indexing
+# saves embeddings before it writes the passages that use them
+EMBEDDING_CACHE_GC_GRACE = float(os.environ.get("EMBEDDING_CACHE_GC_GRACE", "3600"))  # seconds
+
+
+class IndexResult(NamedTuple):
+    """Outcome of indexing one document"""
+    passages: int  # Passages with an embedding
+    reused: int  # Embeddings taken from the cache (or kept as is)
+    computed: int  # Embeddings encoded by the model
+    skipped: bool = False  # Content unchanged, nothing was rewritten
+
+
+def text_hash(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def document_hash(content: str, language: Optional[str], model: str) -> str:
+    """Hash of the inputs of a document's passages and vectors (not its title or metadata)"""
+    key = f"{model}\0{CHUNK_SIZE}:{CHUNK_OVERLAP}\0{language or ''}\0{content}"
+    return text_hash(key)
+
+
+def lookup(session, hashes: List[str], model: str) -> Dict[str, np.ndarray]:
+    """Cached embeddings for the given passage hashes"""
+    from app.utils.embedding_utils import deserialize_embedding
+
+    if not hashes:
+        return {}
+    rows = session.execute(
+        text("""
+            SELECT content_hash, embedding FROM embedding_cache
+            WHERE model = :model AND content_hash IN :hashes
+        """).bindparams(bindparam("hashes", expanding=True)),
+        {"model": model, "hashes": hashes}
+    ).fetchall()
+    return {row[0]: deserialize_embedding(row[1]) for row in rows}
+
+
+def save(session, embeddings: Dict[str, np.ndarray], model: str):
+    """Add embeddings to the cache (in the caller's transaction)"""
+    from app.utils.embedding_utils import serialize_embedding
+
+    if not embeddings:
+        return
+    session.execute(
+        text("""
+            INSERT OR IGNORE INTO embedding_cache (content_hash, model, embedding)
+            VALUES (:content_hash, :model, :embedding)
+        """),
+        [
+            {"content_hash": content_hash, "model": model, "embedding": serialize_embedding(vector)}
+            for content_hash, vector in embeddings.items()
+        ]
+    )
+
+
+def collect_garbage(model: str, grace: float = EMBEDDING_CACHE_GC_GRACE) -> int:
+    """
+    Delete cached embeddings of other model keys and of texts no stored
+    passage has any more (blocking). Returns the number of rows deleted.
+    """
+    from app.database import engine
+
+    with engine.begin() as conn:
+        # Passage hashes are computed in SQL, so the referenced set is never
+        # materialized in Python
+        conn.connection.driver_connection.create_function("sha256_hex", 1, text_hash, deterministic=True)
+        deleted = conn.execute(
+            text("""
+                DELETE FROM embedding_cache
+                WHERE created_at < datetime('now', :grace)
+                  AND (model != :model
+                       OR content_hash NOT IN (SELECT sha256_hex(content) FROM document_chunk))
+            """),
+            {"model": model, "grace": f"-{int(grace)} seconds"}
+        ).rowcount
+    if deleted:
+        logger.info(f"✓ Embedding cache: {deleted} unused entries deleted")
+    return deleted
+
+
+async def embed_cached(
+    session,
+    texts: List[str],
+    encode: Callable[[List[str]], Awaitable[Optional[np.ndarray]]],
+    model: str
+) -> Tuple[Optional[np.ndarray], int, int]:
+    """
+    Embed texts, encoding only those not in the cache (each distinct text
+    once). The cache is read and written in a worker thread. Returns
+    (embeddings or None, reused, computed).
+    """
+    if not texts:
+        return None, 0, 0
+
+    hashes = [text_hash(value) for value in texts]
+    cached = await asyncio.to_thread(lookup, session, list(set(hashes)), model)
+
+    missing = {}  # hash -> text, first occurrence
+    for content_hash, value in zip(hashes, texts):
+        if content_hash not in cached:
+            missing.setdefault(content_hash, value)
+
+    if missing:
+        vectors = await encode(list(missing.values()))
+        if vectors is None:
+            return None, 0, 0
+        computed = dict(zip(missing.keys(), vectors))
+        await asyncio.to_thread(save, session, computed, model)
+        cached.update(computed)
+
+    embeddings = np.stack([cached[content_hash] for content_hash in hashes]).astype(np.float32)
+    return embeddings, len(texts) - len(missing), len(missing)
@@ -0,0 +1,248 @@
+"""
+Multi-process embedding worker pool for throughput work (bulk ingest,
+re-embedding rebuilds)
+
+EMBED_POOL_WORKERS processes each hold the embedding model and encode
+slices of EMBED_POOL_BATCH texts. Texts go to a worker over a pipe; the
+float32 results come back through a per-worker shared-memory buffer, so
+embedding matrices are never pickled. Workers are spawned and each loads
+its own copy of the model. EMBED_POOL_START=fork loads the model once in
+the parent and shares its weights copy-on-write. That is only safe from a
+single-threaded process such as the CLI; forking the server after torch
+has started its OpenMP/MKL threads can deadlock the children.
+
+Interactive requests keep using the in-process model through the
+micro-batching scheduler.
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBED_POOL_WORKERS = int(os.environ.get("EMBED_POOL_WORKERS", "0"))  # 0 = no pool
+EMBED_POOL_BATCH = int(os.environ.get("EMBED_POOL_BATCH", "256"))  # texts per worker call
+# Intra-op threads per worker (default: the cores split between workers)
+EMBED_POOL_THREADS = int(os.environ.get("EMBED_POOL_THREADS", "0"))
+EMBED_POOL_START = os.environ.get("EMBED_POOL_START", "spawn")
+
+
+def _worker_main(conn, model_name: str, threads: int):
+    """Worker process: load (or inherit) the encoder, then serve encode requests"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent shuts us down
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    from app.services import embedding_service
+    from app.services.embedding_runtime import load_encoder
+
+    # Forked workers inherit the parent's loaded model
+    encoder = embedding_service.embedding_model or load_encoder(model_name)
+    conn.send(("ready", os.getpid(), encoder.dim))
+
+    shm_name, capacity = conn.recv()
+    shm = SharedMemory(name=shm_name)
+    out = np.ndarray((capacity, encoder.dim), dtype=np.float32, buffer=shm.buf)
+    try:
+        while True:
+            texts = conn.recv()
+            if texts is None:
+                break
+            started = time.perf_counter()
+            try:
+                out[:len(texts)] = encoder.encode(texts)
+                conn.send(("ok", len(texts), time.perf_counter() - started))
+            except Exception as e:
+                conn.send(("error", str(e), time.perf_counter() - started))
+    finally:
+        del out
+        shm.close()
+
+
+class PoolWorker:
+    """Parent-side handle of one worker process and its result buffer"""
+
+    def __init__(self, process, conn, pid: int, shm: SharedMemory, view: np.ndarray):
+        self.process = process
+        self.conn = conn
+        self.pid = pid
+        self.shm = shm
+        self.view = view
+
+        # Stats
+        self.batches = 0
+        self.texts = 0
+        self.busy_seconds = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "pid": self.pid,
+            "alive": self.process.is_alive(),
+            "batches": self.batches,
+            "texts": self.texts,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "texts_per_second": round(self.texts / self.busy_seconds, 1) if self.busy_seconds else 0.0
+        }
+
+
+class EmbeddingPool:
+    """Fans encode calls out to worker processes, one slice per idle worker"""
+
+    def __init__(self, workers: int = EMBED_POOL_WORKERS, batch_size: int = EMBED_POOL_BATCH):
+        self.n_workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.threads = EMBED_POOL_THREADS or max(1, (os.cpu_count() or 1) // self.n_workers)
+        self.workers: List[PoolWorker] = []
+        self.lock = threading.Lock()  # One encode fan-out at a time
+        self.dim = None
+        self.calls = 0
+        self.wall_seconds = 0.0
+
+    def _start(self):
+        from app.services.embedding_service import EMBEDDING_MODEL_NAME, init_embeddings
+
+        context = get_context(EMBED_POOL_START)
+        if EMBED_POOL_START == "fork":
+            init_embeddings()  # Loaded once here, shared copy-on-write
+
+        # Start every worker before waiting for any, so the model loads in
+        # parallel instead of one worker after the other
+        started = []
+        for i in range(self.n_workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(child_conn, EMBEDDING_MODEL_NAME, self.threads),
+                name=f"embed-worker-{i}",
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            started.append((process, parent_conn))
+
+        try:
+            for process, parent_conn in started:
+                _, pid, dim = parent_conn.recv()
+                shm = SharedMemory(create=True, size=self.batch_size * dim * 4)
+                parent_conn.send((shm.name, self.batch_size))
+                view = np.ndarray((self.batch_size, dim), dtype=np.float32, buffer=shm.buf)
+                self.workers.append(PoolWorker(process, parent_conn, pid, shm, view))
+                self.dim = dim
+        except Exception:
+            # Workers not handed a buffer yet aren't in self.workers, so
+            # _stop() wouldn't reach them
+            handed = {worker.process for worker in self.workers}
+            for process, _ in started:
+                if process not in handed:
+                    process.terminate()
+            raise
+        logger.info(f"✓ Embedding pool started: {self.n_workers} workers x {self.threads} threads ({EMBED_POOL_START})")
+
+    def encode(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Encode texts across the workers (blocking); None if a worker fails"""
+        if not texts:
+            return None
+        with self.lock:
+            try:
+                if not self.workers:
+                    self._start()
+                return self._encode(texts)
+            except Exception as e:
+                logger.error(f"Embedding pool error, restarting workers: {e}")
+                self._stop()
+                return None
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        started = time.perf_counter()
+        result = np.empty((len(texts), self.dim), dtype=np.float32)
+        slices = deque((start, min(start + self.batch_size, len(texts))) for start in range(0, len(texts), self.batch_size))
+        idle = list(self.workers)
+        pending = {}  # conn -> (worker, start, end)
+
+        while slices or pending:
+            while slices and idle:
+                worker = idle.pop()
+                start, end = slices.popleft()
+                worker.conn.send(texts[start:end])
+                pending[worker.conn] = (worker, start, end)
+            for conn in wait(list(pending)):
+                worker, start, end = pending.pop(conn)
+                status, value, seconds = conn.recv()
+                if status != "ok":
+                    raise RuntimeError(f"worker {worker.pid}: {value}")
+                result[start:end] = worker.view[:end - start]
+                worker.batches += 1
+                worker.texts += value
+                worker.busy_seconds += seconds
+                idle.append(worker)
+
+        self.calls += 1
+        self.wall_seconds += time.perf_counter() - started
+        return result
+
+    def _stop(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.view = None
+            worker.shm.close()
+            worker.shm.unlink()
+        self.workers = []
+
+    def stop(self):
+        with self.lock:
+            self._stop()
+
+    def stats(self) -> dict:
+        texts = sum(worker.texts for worker in self.workers)
+        return {
+            "workers": [worker.stats() for worker in self.workers],
+            "calls": self.calls,
+            "texts": texts,
+            "texts_per_second": round(texts / self.wall_seconds, 1) if self.wall_seconds else 0.0,
+            "config": {
+                "workers": self.n_workers,
+                "batch_size": self.batch_size,
+                "threads_per_worker": self.threads,
+                "start_method": EMBED_POOL_START
+            }
+        }
+
+
+# Process-wide pool (lazy; None when EMBED_POOL_WORKERS is 0)
+embedding_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_embedding_pool() -> Optional[EmbeddingPool]:
+    global embedding_pool
+    if EMBED_POOL_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if embedding_pool is None:
+            embedding_pool = EmbeddingPool()
+        return embedding_pool
+
+
+def shutdown_embedding_pool():
+    if embedding_pool is not None:
+        embedding_pool.stop()
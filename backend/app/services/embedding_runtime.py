@@ -0,0 +1,279 @@
+"""
+CPU inference runtimes for the sentence embedding model
+
+EMBEDDING_RUNTIME selects how passages are encoded:
+
+- torch: the SentenceTransformer model as is (fp32)
+- torch_int8: the same model with torch dynamic int8 quantization of its
+  Linear layers
+- onnx / onnx_int8: the transformer exported once to ONNX under
+  data/onnx/ and run with ONNX Runtime (onnx_int8 adds ONNX Runtime dynamic
+  quantization); pooling and normalization follow the SentenceTransformer
+  pipeline
+
+Every runtime encodes length-sorted buckets of EMBEDDING_BUCKET_SIZE
+texts, so short texts are not padded to the longest text of a large
+batch. EMBEDDING_THREADS sets the intra-op thread count.
+
+With EMBEDDING_RUNTIME_VERIFY=1 an optimized runtime is compared to the
+fp32 model on reference sentences at load time, and is only used when
+every cosine similarity reaches EMBEDDING_VERIFY_MIN_COSINE.
+"""
+
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_RUNTIME = os.environ.get("EMBEDDING_RUNTIME", "torch").lower()
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", "0"))  # 0 = library default
+# Texts per padded encode batch; batches are formed from length-sorted texts
+EMBEDDING_BUCKET_SIZE = int(os.environ.get("EMBEDDING_BUCKET_SIZE", "32"))
+# ONNX: pad each bucket up to a multiple of this many tokens
+ONNX_PAD_MULTIPLE = int(os.environ.get("ONNX_PAD_MULTIPLE", "8"))
+EMBEDDING_RUNTIME_VERIFY = os.environ.get("EMBEDDING_RUNTIME_VERIFY", "0") == "1"
+EMBEDDING_VERIFY_MIN_COSINE = float(os.environ.get("EMBEDDING_VERIFY_MIN_COSINE", "0.99"))
+
+ONNX_DIR = Path("data") / "onnx"
+
+RUNTIMES = ("torch", "torch_int8", "onnx", "onnx_int8")
+
+# Reference sentences for verification (mixed lengths and languages)
+VERIFY_TEXTS = [
+    "Machine learning models turn text into vectors.",
+    "Xin chào, hôm nay trời đẹp quá.",
+    "The quick brown fox jumps over the lazy dog.",
+    "Semantic search ranks documents by the meaning of the query rather than by exact keyword matches, "
+    "which helps when users phrase the same need in different words.",
+    "Học máy là một lĩnh vực của trí tuệ nhân tạo nghiên cứu các thuật toán cho phép máy tính học từ dữ liệu.",
+    "OK",
+    "Invoice #4471, due 2024-03-01, total 1,250.00 EUR",
+    "def encode(texts): return model(texts)",
+]
+
+
+def _set_threads():
+    if EMBEDDING_THREADS > 0:
+        import torch
+        torch.set_num_threads(EMBEDDING_THREADS)
+
+
+class TorchEncoder:
+    """SentenceTransformer encode with length bucketing (optionally int8-quantized)"""
+
+    def __init__(self, model, runtime: str = "torch"):
+        self.runtime = runtime
+        self.model = model
+        self.dim = model.get_sentence_embedding_dimension()
+
+    @classmethod
+    def load(cls, model_name: str, quantize: bool = False) -> "TorchEncoder":
+        from sentence_transformers import SentenceTransformer
+
+        _set_threads()
+        model = SentenceTransformer(model_name, device="cpu")
+        if not quantize:
+            return cls(model)
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return cls(model, "torch_int8")
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # encode() sorts texts by length before batching, so a small batch
+        # size is what limits padding
+        embeddings = self.model.encode(
+            texts, batch_size=max(1, EMBEDDING_BUCKET_SIZE), convert_to_numpy=True
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+class OnnxEncoder:
+    """ONNX Runtime session over the exported transformer, plus pooling"""
+
+    def __init__(self, session, tokenizer, config: dict, runtime: str):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.pooling = config["pooling"]
+        self.normalize = config["normalize"]
+        self.max_seq_length = config["max_seq_length"]
+        self.dim = config["dim"]
+        self.runtime = runtime
+        self.input_names = {node.name for node in session.get_inputs()}
+
+    @staticmethod
+    def export_dir(model_name: str) -> Path:
+        return ONNX_DIR / re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+
+    @classmethod
+    def export(cls, model_name: str, directory: Path):
+        """Export the transformer of a SentenceTransformer model to ONNX"""
+        import torch
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Normalize, Pooling
+
+        model = SentenceTransformer(model_name, device="cpu")
+        transformer = model[0].auto_model.eval()
+        pooling = next((module for module in model if isinstance(module, Pooling)), None)
+        if pooling is not None and pooling.pooling_mode_cls_token:
+            pooling_mode = "cls"
+        else:
+            pooling_mode = "mean"
+
+        directory.mkdir(parents=True, exist_ok=True)
+        model.tokenizer.save_pretrained(str(directory))
+        sample = model.tokenizer(["export sample"], return_tensors="pt")
+        names = ["input_ids", "attention_mask"] + (["token_type_ids"] if "token_type_ids" in sample else [])
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                tuple(sample[name] for name in names),
+                str(directory / "model.onnx"),
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]},
+                opset_version=14
+            )
+        with open(directory / "config.json", "w") as f:
+            json.dump({
+                "model": model_name,
+                "pooling": pooling_mode,
+                "normalize": any(isinstance(module, Normalize) for module in model),
+                "max_seq_length": model.max_seq_length,
+                "dim": model.get_sentence_embedding_dimension()
+            }, f)
+        logger.info(f"✓ Exported {model_name} to {directory / 'model.onnx'}")
+
+    @classmethod
+    def load(cls, model_name: str, quantize: bool = False) -> "OnnxEncoder":
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        directory = cls.export_dir(model_name)
+        if not (directory / "model.onnx").exists() or not (directory / "config.json").exists():
+            cls.export(model_name, directory)
+        model_path = directory / "model.onnx"
+        if quantize:
+            model_path = directory / "model.int8.onnx"
+            if not model_path.exists():
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(str(directory / "model.onnx"), str(model_path), weight_type=QuantType.QInt8)
+
+        with open(directory / "config.json") as f:
+            config = json.load(f)
+        options = ort.SessionOptions()
+        if EMBEDDING_THREADS > 0:
+            options.intra_op_num_threads = EMBEDDING_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        tokenizer = AutoTokenizer.from_pretrained(str(directory))
+        return cls(session, tokenizer, config, "onnx_int8" if quantize else "onnx")
+
+    def _encode_bucket(self, texts: List[str]) -> np.ndarray:
+        features = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            pad_to_multiple_of=ONNX_PAD_MULTIPLE if ONNX_PAD_MULTIPLE > 1 else None,
+            return_tensors="np"
+        )
+        inputs = {name: features[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(["last_hidden_state"], inputs)[0]
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = features["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # Length-sorted buckets: each pads only to its own longest text
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        bucket_size = max(1, EMBEDDING_BUCKET_SIZE)
+        for start in range(0, len(texts), bucket_size):
+            indices = order[start:start + bucket_size]
+            embeddings[indices] = self._encode_bucket([texts[i] for i in indices])
+        return embeddings
+
+
+def _cosines(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return (a * b).sum(axis=1)
+
+
+def verify(encoder, reference, texts: Optional[List[str]] = None) -> dict:
+    """Cosine similarity of an encoder's embeddings to the fp32 reference"""
+    texts = texts or VERIFY_TEXTS
+    cosines = _cosines(encoder.encode(texts), reference.encode(texts))
+    return {
+        "runtime": encoder.runtime,
+        "texts": len(texts),
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "threshold": EMBEDDING_VERIFY_MIN_COSINE,
+        "passed": bool(cosines.min() >= EMBEDDING_VERIFY_MIN_COSINE)
+    }
+
+
+def load_encoder(model_name: str, runtime: str = EMBEDDING_RUNTIME):
+    """
+    Encoder for the configured runtime, falling back to the fp32 model when
+    the optimized runtime can't be loaded or fails verification
+    """
+    if runtime not in RUNTIMES:
+        logger.warning(f"Unknown EMBEDDING_RUNTIME '{runtime}', using torch")
+        runtime = "torch"
+    if runtime == "torch":
+        return TorchEncoder.load(model_name)
+
+    try:
+        if runtime.startswith("onnx"):
+            encoder = OnnxEncoder.load(model_name, quantize=runtime == "onnx_int8")
+        else:
+            encoder = TorchEncoder.load(model_name, quantize=True)
+    except Exception as e:
+        logger.error(f"Could not load {runtime} embedding runtime, using torch fp32: {e}")
+        return TorchEncoder.load(model_name)
+
+    if EMBEDDING_RUNTIME_VERIFY:
+        reference = TorchEncoder.load(model_name)
+        report = verify(encoder, reference)
+        if not report["passed"]:
+            logger.error(f"{runtime} embeddings failed verification ({report}), using torch fp32")
+            return reference
+        logger.info(f"✓ {runtime} embeddings verified: {report}")
+    return encoder
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compare an optimized embedding runtime to fp32")
+    parser.add_argument("--model", default=os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    parser.add_argument("--runtime", default=EMBEDDING_RUNTIME if EMBEDDING_RUNTIME != "torch" else "onnx", choices=RUNTIMES)
+    parser.add_argument("--texts", help="File with one reference text per line")
+    args = parser.parse_args()
+
+    texts = None
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    reference = TorchEncoder.load(args.model)
+    candidate = reference if args.runtime == "torch" else (
+        OnnxEncoder.load(args.model, quantize=args.runtime == "onnx_int8")
+        if args.runtime.startswith("onnx") else TorchEncoder.load(args.model, quantize=True)
+    )
+    report = verify(candidate, reference, texts)
+    print(json.dumps(report, indent=2))
+    raise SystemExit(0 if report["passed"] else 1)
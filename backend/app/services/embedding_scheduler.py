@@ -0,0 +1,147 @@
+"""
+Cross-request micro-batching for sentence-transformer encoding
+
+Async routes enqueue texts; a single consumer task collects them for a few
+milliseconds (or until the batch is full), runs one batched encode on the
+shared inference executor and resolves each caller's future.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from app.services.inference import inference_executor
+
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "32"))
+EMBED_BATCH_WAIT_MS = float(os.environ.get("EMBED_BATCH_WAIT_MS", "5"))
+
+
+class EmbeddingScheduler:
+    """Collects single-text embedding requests into batched encode calls"""
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], Optional[np.ndarray]],
+        max_batch_size: int = EMBED_BATCH_SIZE,
+        max_wait_ms: float = EMBED_BATCH_WAIT_MS
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self.loop = None
+        self.queue = None
+        self.worker_task = None
+
+        # Stats
+        self.batches = 0
+        self.items = 0
+        self.max_seen_batch = 0
+        self.last_batch_size = 0
+        self.encode_seconds = 0.0
+
+    def _ensure_started(self):
+        """Start the consumer task on the current event loop"""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop or self.worker_task is None or self.worker_task.done():
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.worker_task = loop.create_task(self._run())
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed one text, batched together with concurrent callers"""
+        self._ensure_started()
+        future = self.loop.create_future()
+        self.queue.put_nowait((text, future))
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Embed several texts; they join the same batching queue"""
+        self._ensure_started()
+        futures = []
+        for text in texts:
+            future = self.loop.create_future()
+            self.queue.put_nowait((text, future))
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    async def _collect(self) -> list:
+        """Wait for the first request, then gather more until full or timed out"""
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _ in batch]
+
+            started = time.perf_counter()
+            try:
+                vectors = await inference_executor.run(self.encode_fn, texts)
+            except Exception as e:
+                logger.error(f"Batched embedding error: {e}")
+                vectors = None
+            self.encode_seconds += time.perf_counter() - started
+
+            self.batches += 1
+            self.items += len(batch)
+            self.last_batch_size = len(batch)
+            self.max_seen_batch = max(self.max_seen_batch, len(batch))
+
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(vectors[i] if vectors is not None else None)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size_seen": self.max_seen_batch,
+            "last_batch_size": self.last_batch_size,
+            "avg_encode_ms": round(1000 * self.encode_seconds / self.batches, 2) if self.batches else 0.0,
+            "config": {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0
+            }
+        }
+
+
+# Process-wide scheduler (lazy)
+scheduler = None
+
+
+def _encode(texts: List[str]) -> Optional[np.ndarray]:
+    # Lazy import so reading stats doesn't load torch
+    from app.services.embedding_service import get_embeddings
+    return get_embeddings(texts)
+
+
+def get_scheduler() -> EmbeddingScheduler:
+    global scheduler
+    if scheduler is None:
+        scheduler = EmbeddingScheduler(_encode)
+    return scheduler
@@ -1,49 +1,160 @@
 """
-Embedding and vector index management using Annoy
-Simpler alternative to FAISS for semantic search
+Embedding and vector index management
+
+The ANN index is partitioned by document language; each partition is a
+VectorIndex of the configured backend (Annoy, FAISS or NumPy, see
+vector_index).
 """
 
+import json
 import logging
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import Dict, List, NamedTuple, Tuple, Optional
 from pathlib import Path
-import json
+import re
 import threading
+import time
 import os
 
+from app.services.embedding_sidecar import EMBEDDING_SIDECAR_FALLBACK, sidecar_client
+from app.services.search_cache import bump_index_generation
+from app.services.vector_index import (
+    VECTOR_INDEX_BACKEND, VectorIndex, backend_available, create_index, index_files, load_index
+)
+
 logger = logging.getLogger(__name__)
 
-try:
-    # Try to import - if fails, embeddings disabled
-    from sentence_transformers import SentenceTransformer
-    import annoy
+
+def _encoder_installed() -> bool:
+    """
+    Whether a runtime for EMBEDDING_RUNTIME can be imported. Checked with
+    find_spec, so torch / sentence-transformers are only imported when the
+    model is actually loaded (and not at all by the ONNX runtimes once the
+    model is exported).
+    """
+    from importlib.util import find_spec
+    from app.services.embedding_runtime import EMBEDDING_RUNTIME
+
+    if EMBEDDING_RUNTIME.startswith("onnx") and all(
+        find_spec(module) is not None for module in ("onnxruntime", "transformers")
+    ):
+        return True
+    return find_spec("sentence_transformers") is not None
+
+
+if sidecar_client.enabled and not EMBEDDING_SIDECAR_FALLBACK:
+    # The sidecar holds the model; nothing is loaded in the workers
     EMBEDDINGS_AVAILABLE = True
-except ImportError as e:
-    EMBEDDINGS_AVAILABLE = False
-    logger.warning(f"Embeddings not available: {e}")
-except Exception as e:
-    # Catch any other import errors (e.g., torch issues)
+elif _encoder_installed():
+    EMBEDDINGS_AVAILABLE = True
+else:
     EMBEDDINGS_AVAILABLE = False
-    logger.warning(f"Could not load embeddings library: {e}")
+    logger.warning("Embeddings not available: neither sentence_transformers nor onnxruntime is installed")
+
+if not backend_available(VECTOR_INDEX_BACKEND):
+    logger.warning(f"Vector index backend {VECTOR_INDEX_BACKEND} is not installed, only exact search will work")
+
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+
+def _embedding_cache_key() -> str:
+    """
+    Model key of cached embeddings and document content hashes. The int8 /
+    ONNX runtimes produce slightly different vectors than fp32 torch, so each
+    runtime gets its own entries; torch keeps the bare model name used before
+    runtimes were selectable.
+    """
+    from app.services.embedding_runtime import EMBEDDING_RUNTIME, RUNTIMES
+
+    runtime = EMBEDDING_RUNTIME if EMBEDDING_RUNTIME in RUNTIMES else "torch"
+    return EMBEDDING_MODEL_NAME if runtime == "torch" else f"{EMBEDDING_MODEL_NAME}@{runtime}"
+
 
-# Global embedding model (lazy load)
+EMBEDDING_CACHE_KEY = _embedding_cache_key()
+
+# Global embedding encoder (lazy load; runtime chosen by EMBEDDING_RUNTIME,
+# see embedding_runtime)
 embedding_model = None
-annoy_index = None
-index_lock = threading.Lock()  # Thread safety for index updates
+embedding_model_name = None
+
+# Searches read the current IndexSnapshot without locking; writers build a
+# new snapshot under index_lock and publish it with a single assignment.
+current_snapshot = None
+index_lock = threading.Lock()  # Serializes snapshot writers
+build_lock = threading.Lock()  # One index build / merge at a time
 
 INDEX_DIR = Path("data")
-INDEX_PATH = INDEX_DIR / "annoy.index"
-MAPPING_PATH = INDEX_DIR / "doc_mapping.json"
+# One index segment per document language, listed in the partition manifest
+# ({"backend": ..., "partitions": {language: file stem}}). The files of a
+# partition depend on the backend (see VectorIndex.suffixes).
+PARTITIONS_PATH = INDEX_DIR / "index_partitions.json"
+MARKER_PATH = INDEX_DIR / "index.generation"
+# Append-only int64 log of tombstoned vector ids (see `tombstones`)
+TOMBSTONES_PATH = INDEX_DIR / "index.tombstones"
+# Annoy manifest (language -> stem) written before backends were pluggable
+LEGACY_PARTITIONS_PATH = INDEX_DIR / "annoy_partitions.json"
+# Single-segment files written before the index was partitioned
+LEGACY_INDEX_PATHS = (INDEX_DIR / "annoy.index", INDEX_DIR / "passage_mapping.npy")
+
+# Incremental indexing: new and updated vectors go into a small in-memory
+# "delta" segment that is searched by brute force next to the built index
+# segments. Once the delta passes the threshold it is merged on a background
+# thread: added in place for backends that take adds (FAISS, NumPy),
+# otherwise by a fresh build (Annoy).
+DELTA_MERGE_THRESHOLD = int(os.environ.get("INDEX_DELTA_THRESHOLD", "256"))
+delta_vectors = {}  # passage id -> float32 vector, newest version wins (writer side)
+merge_thread = None
+delta_recovered = False
+
+# Deletes: vectors removed from the store stay in the built segments until
+# the next merge. Their ids are tombstoned (in memory and appended to
+# TOMBSTONES_PATH, O(1) per deleted passage) and skipped by ANN searches;
+# once tombstones pass this fraction of the indexed vectors the segments are
+# compacted in the background (removed in place where the backend can).
+TOMBSTONE_COMPACT_RATIO = float(os.environ.get("INDEX_TOMBSTONE_RATIO", "0.2"))
+tombstones = set()  # Only mutated with index_lock held; searches just test membership
+
+# Passage search: fetch this many passages per requested document, then
+# aggregate passage scores per document ("max" or "sum")
+CHUNK_OVERFETCH = int(os.environ.get("CHUNK_OVERFETCH", "4"))
+CHUNK_AGGREGATION = os.environ.get("CHUNK_AGGREGATION", "max")
+
+# Exact search: below this corpus size one BLAS mat-vec over the normalized
+# store matrix is both faster than an ANN index and returns the true top-k
+EXACT_SEARCH_MAX_VECTORS = int(os.environ.get("EXACT_SEARCH_MAX_VECTORS", "50000"))
+
+# Quantized store (EMBEDDING_STORE_DTYPE=float16/int8): the scan over the
+# compact codes keeps this many candidates per requested passage, which are
+# then rescored against the float32 rows
+QUANT_RESCORE_FACTOR = int(os.environ.get("QUANT_RESCORE_FACTOR", "4"))
+# Sampled queries behind the recall estimate in the stats endpoint
+QUANT_RECALL_SAMPLES = int(os.environ.get("QUANT_RECALL_SAMPLES", "32"))
+quantization_report = None  # (store generation, report), recomputed when the store changes
+
+class IndexSnapshot(NamedTuple):
+    """Immutable view of the searchable index"""
+    segments: Dict[str, VectorIndex]  # Language -> built index partition
+    marker: Optional[str]  # On-disk generation marker of the index segments
+    delta_ids: np.ndarray  # Passage ids in the delta segment
+    delta_owners: np.ndarray  # Owning doc id of each delta passage, for filtering
+    delta_matrix: np.ndarray  # Normalized delta vectors, row-aligned with delta_ids
+    delta_set: frozenset  # delta_ids as a set, for shadowing segment hits
 
 
 def init_embeddings():
     """Initialize embedding model (lazy load on first use)"""
-    global embedding_model
+    global embedding_model, embedding_model_name
     if embedding_model is None and EMBEDDINGS_AVAILABLE:
         try:
+            from app.services.embedding_runtime import load_encoder
+            from app.services.search_cache import query_embedding_cache
+            
             logger.info("Loading sentence-transformers model...")
-            embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-            logger.info(f"✓ Embedding model loaded: {embedding_model.get_sentence_embedding_dimension()} dims")
+            embedding_model = load_encoder(EMBEDDING_MODEL_NAME)
+            if embedding_model_name != EMBEDDING_MODEL_NAME:
+                query_embedding_cache.clear()
+            embedding_model_name = EMBEDDING_MODEL_NAME
+            logger.info(f"✓ Embedding model loaded ({embedding_model.runtime}): {embedding_model.dim} dims")
         except Exception as e:
             logger.error(f"Failed to load embedding model: {e}")
             embedding_model = None
@@ -60,206 +171,849 @@ def get_embedding(text: str) -> Optional[np.ndarray]:
         return None
     
     try:
-        embedding = model.encode(text, convert_to_numpy=True)
-        return embedding.astype(np.float32)
+        return model.encode([text])[0]
     except Exception as e:
         logger.error(f"Embedding error: {e}")
         return None
 
 
+def get_embeddings(texts: List[str]) -> Optional[np.ndarray]:
+    """Get embeddings for a batch of texts in one encode call"""
+    if not EMBEDDINGS_AVAILABLE or not texts:
+        return None
+    
+    model = init_embeddings()
+    if model is None:
+        return None
+    
+    try:
+        return model.encode(texts)
+    except Exception as e:
+        logger.error(f"Batch embedding error: {e}")
+        return None
+
+
+async def get_embedding_async(text: str) -> Optional[np.ndarray]:
+    """
+    Get embedding for text from an async route. Served by the embedding
+    sidecar when one is configured; otherwise concurrent requests are
+    micro-batched into a single encode call on the inference executor.
+    """
+    if not EMBEDDINGS_AVAILABLE:
+        return None
+    
+    if sidecar_client.enabled:
+        vectors = await sidecar_client.embed_many([text])
+        if vectors is not None or not EMBEDDING_SIDECAR_FALLBACK:
+            return vectors[0] if vectors is not None else None
+    
+    from app.services.embedding_scheduler import get_scheduler
+    return await get_scheduler().embed(text)
+
+
+async def get_embeddings_async(texts: List[str]) -> Optional[np.ndarray]:
+    """Get embeddings for several texts (e.g. passages) through the batching scheduler"""
+    if not EMBEDDINGS_AVAILABLE or not texts:
+        return None
+    
+    if sidecar_client.enabled:
+        vectors = await sidecar_client.embed_many(texts)
+        if vectors is not None or not EMBEDDING_SIDECAR_FALLBACK:
+            return vectors
+    
+    from app.services.embedding_scheduler import get_scheduler
+    embeddings = await get_scheduler().embed_many(texts)
+    if any(embedding is None for embedding in embeddings):
+        return None
+    return np.stack(embeddings)
+
+
+async def get_query_embedding(query: str) -> Optional[np.ndarray]:
+    """Get a search query embedding, served from the LRU cache when possible"""
+    if not EMBEDDINGS_AVAILABLE:
+        return None
+    
+    from app.services.search_cache import query_embedding_cache
+    
+    embedding = query_embedding_cache.get(query, EMBEDDING_CACHE_KEY)
+    if embedding is not None:
+        return embedding
+    
+    embedding = await get_embedding_async(query)
+    query_embedding_cache.put(query, EMBEDDING_CACHE_KEY, embedding)
+    return embedding
+
+
 def init_index_dir():
     """Ensure data directory exists"""
     INDEX_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def load_or_create_index(embedding_dim: int = 384):
-    """Load existing index or create new one"""
-    global annoy_index
+def _read_marker() -> Optional[str]:
+    """Current on-disk index generation marker (changes on every save)"""
+    try:
+        return MARKER_PATH.read_text().strip()
+    except OSError:
+        return None
+
+
+def _partition_stem(language: str, backend: str) -> str:
+    """File stem of a language partition (language codes are user input)"""
+    return f"{backend}_" + re.sub(r"[^A-Za-z0-9_-]", "_", language)
+
+
+def _partition_paths(stem: str) -> List[Path]:
+    return index_files(INDEX_DIR / stem)
+
+
+def _read_partitions() -> Tuple[str, Dict[str, str]]:
+    """Partition manifest: (backend, {language: file stem})"""
+    try:
+        with open(PARTITIONS_PATH) as f:
+            manifest = json.load(f)
+        return manifest["backend"], manifest["partitions"]
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        with open(LEGACY_PARTITIONS_PATH) as f:
+            return "annoy", json.load(f)
+    except (OSError, ValueError):
+        return VECTOR_INDEX_BACKEND, {}
+
+
+def _load_segments(embedding_dim: int = 384) -> Tuple[Dict[str, VectorIndex], Optional[str]]:
+    """Load the saved index partitions: ({language: VectorIndex}, marker)"""
+    marker = _read_marker()
+    # A single-segment index from before partitioning is ignored; its
+    # vectors are recovered into the delta and merged into a new build
+    segments = {}
+    backend, partitions = _read_partitions()
+    for language, stem in partitions.items():
+        try:
+            segments[language] = load_index(INDEX_DIR / stem, embedding_dim, backend)
+        except Exception as e:
+            logger.error(f"Error loading index partition '{language}': {e}")
+    if segments:
+        total = sum(len(segment) for segment in segments.values())
+        logger.info(f"✓ Index loaded: {total} vectors in {len(segments)} {backend} partitions")
+        if backend != VECTOR_INDEX_BACKEND:
+            logger.warning(f"Saved index uses {backend}, configured backend is {VECTOR_INDEX_BACKEND}; "
+                           "it is converted on the next rebuild (python -m app.services.vector_index migrate)")
+    return segments, marker
+
+
+def _publish(segments: Dict[str, VectorIndex], marker: Optional[str]) -> IndexSnapshot:
+    """Publish a new snapshot from the segments and the current delta (call with index_lock held)"""
+    global current_snapshot
+    from app.services.embedding_store import get_embedding_store
     
-    if annoy_index is not None:
-        return annoy_index
+    store = get_embedding_store()
+    delta_ids = np.fromiter(delta_vectors.keys(), dtype=np.int64, count=len(delta_vectors))
+    delta_owners = np.fromiter(
+        (store.owner_of(vector_id) or -1 for vector_id in delta_ids.tolist()),
+        dtype=np.int64,
+        count=len(delta_ids)
+    )
+    if delta_vectors:
+        delta_matrix = np.stack(list(delta_vectors.values()))
+    else:
+        delta_matrix = np.empty((0, 0), dtype=np.float32)
     
+    current_snapshot = IndexSnapshot(
+        segments=segments,
+        marker=marker,
+        delta_ids=delta_ids,
+        delta_owners=delta_owners,
+        delta_matrix=delta_matrix,
+        delta_set=frozenset(delta_vectors.keys())
+    )
+    return current_snapshot
+
+
+def _republish_delta():
+    """Publish the current delta with the current segments (call with index_lock held)"""
+    snapshot = current_snapshot
+    _publish(snapshot.segments, snapshot.marker)
+
+
+def get_snapshot(embedding_dim: int = 384) -> IndexSnapshot:
+    """
+    Current index snapshot. Lock-free in the common case; the segment is
+    (re)loaded only on first use or when another process has saved a new
+    index (on-disk generation marker changed).
+    """
+    snapshot = current_snapshot
+    if snapshot is not None and snapshot.marker == _read_marker():
+        return snapshot
+    
+    with index_lock:
+        snapshot = current_snapshot
+        marker = _read_marker()
+        if snapshot is None or snapshot.marker != marker:
+            init_index_dir()
+            segments, marker = _load_segments(embedding_dim)
+            _load_tombstones()
+            _recover_delta(segments)
+            snapshot = _publish(segments, marker)
+            _maybe_schedule_merge()
+        return snapshot
+
+
+def load_or_create_index(embedding_dim: int = 384):
+    """Load the saved index partitions ({} if nothing has been built yet)"""
     if not EMBEDDINGS_AVAILABLE:
         logger.warning("Embeddings not available, skipping index load")
         return None
+    return get_snapshot(embedding_dim).segments
+
+
+def _build_segments(backend: Optional[str] = None, embedding_dim: int = 384) -> Dict[str, VectorIndex]:
+    """Build one index per document language from the memory-mapped embedding store"""
+    from app.services.embedding_store import get_embedding_store, FREE_ROW
+    from app.services.search_filters import document_attributes
+    
+    store = get_embedding_store()
+    ids, vectors = store.matrix()
+    owners = store.owner_rows()[:len(ids)]
+    live = ids != FREE_ROW
+    
+    languages = {}  # language -> owner doc ids
+    live_owners = np.unique(owners[live]).tolist()
+    for owner, language in zip(live_owners, document_attributes.languages_of(live_owners)):
+        languages.setdefault(language, []).append(owner)
+    
+    segments = {}
+    for language, language_owners in languages.items():
+        rows = np.flatnonzero(live & np.isin(owners, language_owners))
+        index = create_index(store.dim or embedding_dim, backend)
+        index.build(np.asarray(ids[rows]), vectors[rows])
+        segments[language] = index
+    return segments
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _save_index(segments: Dict[str, VectorIndex], backend: str) -> str:
+    """
+    Persist built partitions via temp files and renames, then the manifest,
+    then bump the marker. Searches still holding the old partitions keep
+    reading the old (unlinked) files. Returns the new marker.
+    """
+    init_index_dir()
+    
+    stems = {}
+    for language, segment in segments.items():
+        stem = _partition_stem(language, backend)
+        if stem in stems.values():  # e.g. "en-US" and "en_US"
+            stem += f"_{len(stems)}"
+        stems[language] = stem
+        segment.save(INDEX_DIR / stem)
     
+    _, previous = _read_partitions()
+    _write_atomic(PARTITIONS_PATH, json.dumps({"backend": backend, "partitions": stems}).encode())
+    
+    # Written last: other processes reload the partitions when this changes
+    marker = str(time.time_ns())
+    _write_atomic(MARKER_PATH, marker.encode())
+    
+    # Languages that no longer have documents
+    stale = [path for stem in set(previous.values()) - set(stems.values()) for path in _partition_paths(stem)]
+    for path in stale + [LEGACY_PARTITIONS_PATH, *LEGACY_INDEX_PATHS]:
+        if path.exists():
+            path.unlink()
+    return marker
+
+
+def _load_tombstones():
+    """Reload the tombstone set from disk (call with index_lock held)"""
+    try:
+        ids = np.fromfile(TOMBSTONES_PATH, dtype=np.int64)
+    except (OSError, ValueError):
+        ids = np.empty(0, dtype=np.int64)
+    tombstones.clear()
+    tombstones.update(ids.tolist())
+
+
+def _add_tombstones(vector_ids: List[int]):
+    """Tombstone vectors that may still be in a built segment (call with index_lock held)"""
+    if not vector_ids:
+        return
+    tombstones.update(vector_ids)
     init_index_dir()
+    with open(TOMBSTONES_PATH, "ab") as f:
+        f.write(np.asarray(vector_ids, dtype=np.int64).tobytes())
+
+
+def _indexed_count(snapshot: Optional[IndexSnapshot]) -> int:
+    if snapshot is None:
+        return 0
+    return sum(len(segment) for segment in snapshot.segments.values())
+
+
+def _tombstone_ratio() -> float:
+    indexed = _indexed_count(current_snapshot)
+    return len(tombstones) / indexed if indexed else 0.0
+
+
+def _recover_delta(segments: Dict[str, VectorIndex]):
+    """
+    Load vectors that are in the embedding store but not in the saved index
+    segments into the delta (e.g. documents added before the last restart
+    that were never merged). Runs once per process, with index_lock held.
+    """
+    global delta_recovered
+    if delta_recovered:
+        return
+    delta_recovered = True
+    
+    try:
+        from app.services.embedding_store import get_embedding_store
+        
+        indexed = set()
+        for segment in segments.values():
+            indexed.update(np.asarray(segment.vector_ids()).tolist())
+        
+        store = get_embedding_store()
+        ids, vectors = store.live()
+        recovered = 0
+        for row, doc_id in enumerate(ids.tolist()):
+            if doc_id not in indexed:
+                delta_vectors.setdefault(doc_id, np.array(vectors[row]))
+                recovered += 1
+        
+        if recovered:
+            logger.info(f"Recovered {recovered} unmerged vectors into delta segment")
+    except Exception as e:
+        logger.warning(f"Could not recover delta segment: {e}")
+
+
+def _apply_delta(merging: Dict[int, np.ndarray], compacting: set) -> Optional[Dict[str, VectorIndex]]:
+    """
+    Merge the delta into the current segments in place (adds, plus removes
+    of tombstoned vectors). Returns None when the segments can't take it:
+    backend without adds/removes, a saved index of another backend, or a
+    language with no partition yet; the caller then does a full build.
+    """
+    from app.services.embedding_store import get_embedding_store
+    from app.services.search_filters import document_attributes
+    
+    snapshot = current_snapshot
+    if snapshot is None or not snapshot.segments:
+        return None
+    segments = snapshot.segments
+    for segment in segments.values():
+        if segment.kind != VECTOR_INDEX_BACKEND or not segment.supports_add:
+            return None
+        if compacting and not segment.supports_remove:
+            return None
+    
+    store = get_embedding_store()
+    by_language = {}  # language -> [vector ids]
+    owned = [(vector_id, store.owner_of(vector_id)) for vector_id in merging]
+    # Owner None: deleted since, nothing to add
+    owned = [(vector_id, owner) for vector_id, owner in owned if owner is not None]
+    languages = document_attributes.languages_of(owner for _, owner in owned)
+    for (vector_id, _), language in zip(owned, languages):
+        by_language.setdefault(language, []).append(vector_id)
+    if any(language not in segments for language in by_language):
+        return None
+    
+    for segment in segments.values():
+        if compacting:
+            segment.remove(np.fromiter(compacting, dtype=np.int64, count=len(compacting)))
+    for language, vector_ids in by_language.items():
+        segment = segments[language]
+        ids = np.asarray(vector_ids, dtype=np.int64)
+        if segment.supports_remove:
+            segment.remove(ids)  # Older copies of re-merged vectors
+        segment.add(ids, np.stack([merging[vector_id] for vector_id in vector_ids]))
+    return dict(segments)
+
+
+def _rebuild_segment(full: bool = True, backend: Optional[str] = None) -> int:
+    """
+    Build fresh index segments from the store off the search path (or,
+    with full=False, merge the delta into the current ones in place when
+    the backend allows) and publish them. Delta vectors that the new
+    segments cover are dropped from the delta; ones replaced meanwhile
+    stay. Returns the vector count.
+    """
+    backend = backend or VECTOR_INDEX_BACKEND
+    with build_lock:
+        # Everything in the delta right now is already in the embedding
+        # store, so the build below is guaranteed to include it.
+        with index_lock:
+            merging = dict(delta_vectors)
+            # Vectors tombstoned by now are no longer in the store, so the
+            # build drops them
+            compacting = set(tombstones)
+        
+        segments = None
+        if not full and backend == VECTOR_INDEX_BACKEND:
+            segments = _apply_delta(merging, compacting)
+        if segments is None:
+            segments = _build_segments(backend)
+        total = sum(len(segment) for segment in segments.values())
+        if total == 0 and _indexed_count(current_snapshot) == 0:
+            return 0
+        # An empty build still replaces (compacts) segments of deleted documents
+        marker = _save_index(segments, backend)
+        
+        with index_lock:
+            for doc_id, vector in merging.items():
+                if delta_vectors.get(doc_id) is vector:
+                    del delta_vectors[doc_id]
+            _publish(segments, marker)
+            if compacting:
+                tombstones.difference_update(compacting)
+                _write_atomic(TOMBSTONES_PATH, np.fromiter(tombstones, dtype=np.int64, count=len(tombstones)).tobytes())
+            bump_index_generation()
+        return total
+
+
+def _merge_delta():
+    """Background job: fold the delta segment into the index and drop tombstoned vectors"""
+    global merge_thread
     
     try:
-        if INDEX_PATH.exists():
-            logger.info(f"Loading Annoy index from {INDEX_PATH}")
-            annoy_index = annoy.AnnoyIndex(embedding_dim, metric='euclidean')
-            annoy_index.load(str(INDEX_PATH))
-            logger.info(f"✓ Index loaded: {annoy_index.get_n_items()} vectors")
-            return annoy_index
+        total = _rebuild_segment(full=False)
+        logger.info(f"✓ Delta merged, index total {total}")
     except Exception as e:
-        logger.error(f"Error loading index: {e}")
+        logger.error(f"Error merging delta segment: {e}")
+    finally:
+        merge_thread = None
+
+
+def _maybe_schedule_merge():
+    """
+    Start a background merge once the delta is large enough or the
+    tombstone ratio passes TOMBSTONE_COMPACT_RATIO (call with index_lock held)
+    """
+    global merge_thread
     
-    # Create new index
-    logger.info(f"Creating new Annoy index (dim={embedding_dim}, metric=euclidean)")
-    annoy_index = annoy.AnnoyIndex(embedding_dim, metric='euclidean')
-    logger.info("✓ New index created")
-    return annoy_index
+    if merge_thread is not None:
+        return
+    if len(delta_vectors) < DELTA_MERGE_THRESHOLD and _tombstone_ratio() <= TOMBSTONE_COMPACT_RATIO:
+        return
+    merge_thread = threading.Thread(target=_merge_delta, name="index-delta-merge", daemon=True)
+    merge_thread.start()
 
 
-def add_to_index(doc_id: int, embedding: np.ndarray) -> bool:
-    """Add embedding to Annoy index with thread safety"""
+def add_to_index(doc_id: int, chunk_ids: List[int], embeddings: np.ndarray) -> bool:
+    """
+    Index the passage vectors of a document, replacing its previous ones.
+    Vectors go into the delta segment immediately; it is merged into the
+    index segments in the background once it passes DELTA_MERGE_THRESHOLD.
+    """
     if not EMBEDDINGS_AVAILABLE:
         return False
     
     try:
-        from app.utils.embedding_utils import deserialize_embedding
+        from app.services.embedding_store import get_embedding_store, normalize
+        
+        embeddings = normalize(embeddings)
+        store = get_embedding_store()
+        removed = store.delete_owner(doc_id)
+        store.put_many(chunk_ids, embeddings, owner=doc_id)
+        get_snapshot(embeddings.shape[1])
         
         with index_lock:
-            embedding_dim = len(embedding)
-            
-            # Always rebuild index from DB (Annoy can't add to built index)
-            index = annoy.AnnoyIndex(embedding_dim, metric='euclidean')
-            doc_ids = []
-            
-            try:
-                from sqlalchemy import create_engine, text
-                DB_FILE = os.environ.get("APP_DB", "documents.db")
-                db_url = f"sqlite:///{DB_FILE}"
-                engine = create_engine(db_url, connect_args={"check_same_thread": False})
-                
-                with engine.begin() as conn:
-                    result = conn.execute(
-                        text("SELECT id, embedding FROM document WHERE embedding IS NOT NULL ORDER BY id")
-                    )
-                    rows = result.fetchall()
-                    for vector_idx, (db_doc_id, embedding_bytes) in enumerate(rows):
-                        existing_emb = deserialize_embedding(embedding_bytes)
-                        if existing_emb is not None:
-                            index.add_item(vector_idx, existing_emb)
-                            doc_ids.append(db_doc_id)
-            except Exception as e:
-                logger.warning(f"Could not reload embeddings from DB: {e}")
-                return False
-            
-            # Build index
-            if index.get_n_items() > 0:
-                index.build(10)
-            
-                # Save
-                init_index_dir()
-                with open(MAPPING_PATH, "w") as f:
-                    json.dump(doc_ids, f)
-                index.save(str(INDEX_PATH))
-                
-                # Reset global cache
-                global annoy_index
-                annoy_index = None
-            
-            logger.info(f"+ Added doc_id={doc_id} to index (total: {len(doc_ids)})")
-            return True
+            # Replaced passages: ones that were only in the delta just go
+            # away, the rest may be in a built segment
+            _add_tombstones([vector_id for vector_id in removed if delta_vectors.pop(vector_id, None) is None])
+            for chunk_id, embedding in zip(chunk_ids, embeddings):
+                delta_vectors[int(chunk_id)] = embedding
+            _republish_delta()
+            bump_index_generation()
+            _maybe_schedule_merge()
+            logger.info(f"+ Added doc_id={doc_id} ({len(chunk_ids)} passages) to delta segment (delta size: {len(delta_vectors)})")
+        return True
     except Exception as e:
         logger.error(f"Error adding to index: {e}")
         return False
 
 
-def search_index(query_embedding: np.ndarray, top_k: int = 5) -> List[Tuple[int, float]]:
+def add_many_to_store(entries: List[Tuple[int, List[int], np.ndarray]]) -> int:
     """
-    Search Annoy index
-    Returns list of (doc_id, similarity_score) tuples
+    Bulk ingest: write the passage vectors of new documents straight into
+    the embedding store, bypassing the delta segment. The exact engine sees
+    them immediately; call rebuild_index_from_db once at the end of the load
+    so the index segments include them. Returns the number of vectors stored.
     """
-    if not EMBEDDINGS_AVAILABLE or not MAPPING_PATH.exists():
-        return []
+    if not EMBEDDINGS_AVAILABLE:
+        return 0
+    
+    from app.services.embedding_store import get_embedding_store, normalize
+    
+    entries = [entry for entry in entries if len(entry[1])]
+    if not entries:
+        return 0
+    
+    vector_ids = [chunk_id for _, chunk_ids, _ in entries for chunk_id in chunk_ids]
+    owners = [doc_id for doc_id, chunk_ids, _ in entries for _ in chunk_ids]
+    vectors = normalize(np.concatenate([embeddings for _, _, embeddings in entries]))
+    get_embedding_store().put_many(vector_ids, vectors, owners=owners)
+    return len(vector_ids)
+
+
+def remove_from_index(doc_id: int) -> bool:
+    """
+    Drop the passage vectors of a deleted document: freed in the store,
+    removed from the delta segment and tombstoned in the index segments.
+    Cost depends on the document's passage count, not the corpus size.
+    """
+    return remove_many_from_index([doc_id])
+
+
+def remove_many_from_index(doc_ids: List[int]) -> bool:
+    """remove_from_index for several documents, with one generation bump"""
+    if not EMBEDDINGS_AVAILABLE:
+        return False
     
     try:
+        from app.services.embedding_store import get_embedding_store
+        
+        store = get_embedding_store()
+        removed = [vector_id for doc_id in doc_ids for vector_id in store.delete_owner(doc_id)]
+        get_snapshot()
         with index_lock:
-            index = load_or_create_index(len(query_embedding))
-            if index is None:
-                return []
-            
-            n_items = index.get_n_items()
-            if n_items == 0:
-                return []
-            
-            # Search - Annoy returns (indices_list, distances_list)
-            result = index.get_nns_by_vector(
-                query_embedding,
-                min(top_k, n_items),
-                include_distances=True
-            )
-            
-            indices, distances = result
-            
-            # Load mapping
-            with open(MAPPING_PATH, "r") as f:
-                doc_ids = json.load(f)
-            
-            # Convert distances to similarity scores
-            results = []
-            for idx, distance in zip(indices, distances):
-                if idx < len(doc_ids):
-                    doc_id = doc_ids[int(idx)]
-                    # Convert euclidean distance to similarity (inverse)
-                    similarity = 1.0 / (1.0 + float(distance))
-                    results.append((doc_id, similarity))
-            
-            return results
+            in_delta = {vector_id for vector_id in removed if delta_vectors.pop(vector_id, None) is not None}
+            _add_tombstones([vector_id for vector_id in removed if vector_id not in in_delta])
+            if in_delta:
+                _republish_delta()
+            bump_index_generation()
+            _maybe_schedule_merge()
+        return True
+    except Exception as e:
+        logger.error(f"Error removing doc_ids={list(doc_ids)} from index: {e}")
+        return False
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (argpartition + small sort)"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _search_exact(query_embedding: np.ndarray, top_k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+    """
+    Exact cosine search: one mat-vec over the normalized store matrix.
+    With an allowed-doc bitmap only the rows of allowed documents are scored.
+    
+    On a quantized store the mat-vec runs over the compact codes and the best
+    top_k * QUANT_RESCORE_FACTOR rows are rescored with their float32 vectors.
+    """
+    from app.services.embedding_store import get_embedding_store, FREE_ROW
+    from app.services.search_filters import lookup
+    
+    store = get_embedding_store()
+    ids, vectors = store.matrix()
+    mask = ids != FREE_ROW
+    rows = None
+    if allowed is not None:
+        mask &= lookup(allowed, store.owner_rows()[:len(ids)])
+        if mask.sum() * 2 < len(ids):
+            # Selective filter: gather and score only the allowed rows
+            rows = np.flatnonzero(mask)
+            ids, mask = ids[rows], mask[rows]
+    k = min(top_k, int(mask.sum()))
+    if k == 0:
+        return []
+    
+    scores = store.approximate_scores(query_embedding, rows=rows, count=len(mask))
+    scores[~mask] = -np.inf
+    if not store.quantized:
+        return [(int(ids[i]), float(scores[i])) for i in _top_k_indices(scores, k) if scores[i] > -np.inf]
+    
+    candidates = _top_k_indices(scores, min(len(scores), k * max(1, QUANT_RESCORE_FACTOR)))
+    candidates = candidates[scores[candidates] > -np.inf]
+    exact = np.asarray(vectors[candidates if rows is None else rows[candidates]] @ query_embedding, dtype=np.float32)
+    return [(int(ids[candidates[i]]), float(exact[i])) for i in _top_k_indices(exact, min(k, len(exact)))]
+
+
+def _search_delta(
+    snapshot: IndexSnapshot,
+    query_embedding: np.ndarray,
+    top_k: int,
+    allowed: Optional[np.ndarray] = None
+) -> List[Tuple[int, float]]:
+    """Brute-force cosine search over the delta segment"""
+    from app.services.search_filters import lookup
+    
+    if len(snapshot.delta_ids) == 0:
+        return []
+    
+    scores = snapshot.delta_matrix @ query_embedding
+    if allowed is not None:
+        scores = np.where(lookup(allowed, snapshot.delta_owners), scores, -np.inf)
+    top = _top_k_indices(scores, min(top_k, len(scores)))
+    return [(int(snapshot.delta_ids[i]), float(scores[i])) for i in top if scores[i] > -np.inf]
+
+
+def _rescore(hits: List[Tuple[int, float]], query_embedding: np.ndarray) -> List[Tuple[int, float]]:
+    """Replace approximate scores (IVF-PQ) with exact cosines from the store"""
+    from app.services.embedding_store import get_embedding_store
+    
+    if not hits:
+        return hits
+    vector_ids, vectors = get_embedding_store().take([vector_id for vector_id, _ in hits])
+    scores = np.asarray(vectors @ query_embedding, dtype=np.float32) if len(vector_ids) else []
+    return list(zip(vector_ids.tolist(), (float(score) for score in scores)))
+
+
+def _search_ann(
+    query_embedding: np.ndarray,
+    top_k: int,
+    language: Optional[str] = None,
+    allowed: Optional[np.ndarray] = None
+) -> List[Tuple[int, float]]:
+    """
+    Search the index partitions and the delta segment, merging the top-k.
+    A language filter routes the query to that language's partition only.
+    """
+    snapshot = get_snapshot(len(query_embedding))
+    candidates = _search_delta(snapshot, query_embedding, top_k, allowed)
+    
+    if language is not None:
+        segments = [snapshot.segments[language]] if language in snapshot.segments else []
+    else:
+        segments = list(snapshot.segments.values())
+    
+    # Over-fetch so tombstoned vectors and ones shadowed by a newer delta
+    # version don't eat into the top-k; fetch more if that wasn't enough
+    ratio = min(_tombstone_ratio(), 0.9)
+    for segment in segments:
+        n_items = len(segment)
+        if n_items == 0:
+            continue
+        n_fetch = min(top_k + len(snapshot.delta_set) + int(top_k * ratio / (1.0 - ratio)) + 1, n_items)
+        while True:
+            vector_ids, scores = segment.search(query_embedding, n_fetch)
+            hits = [
+                (vector_id, float(score))
+                for vector_id, score in zip(vector_ids.tolist(), scores.tolist())
+                if vector_id not in snapshot.delta_set and vector_id not in tombstones
+            ]
+            if len(hits) >= top_k or n_fetch >= n_items:
+                break
+            n_fetch = min(2 * n_fetch, n_items)
+        if not segment.exact_scores:
+            hits = _rescore(hits, query_embedding)
+        candidates.extend(hits)
+    
+    candidates.sort(key=lambda item: item[1], reverse=True)
+    return candidates[:top_k]
+
+
+def _aggregate_passages(
+    hits: List[Tuple[int, float]],
+    top_k: int,
+    allowed: Optional[np.ndarray] = None
+) -> List[Tuple[int, float, int]]:
+    """
+    Group passage hits by owning document. Passages whose vector is no
+    longer in the store (deleted or re-chunked documents) are skipped, as
+    are documents outside the allowed bitmap (e.g. changed language since
+    the partition was built). Returns (doc_id, score, best_chunk_id) best first.
+    """
+    from app.services.embedding_store import get_embedding_store
+    
+    store = get_embedding_store()
+    documents = {}  # doc_id -> [score, best_chunk_id, best_passage_score]
+    for vector_id, score in hits:
+        doc_id = store.owner_of(vector_id)
+        if doc_id is None:
+            continue
+        if allowed is not None and (doc_id >= len(allowed) or not allowed[doc_id]):
+            continue
+        entry = documents.get(doc_id)
+        if entry is None:
+            documents[doc_id] = [score, vector_id, score]
+            continue
+        if CHUNK_AGGREGATION == "sum":
+            entry[0] += score
+        elif score > entry[0]:
+            entry[0] = score
+        if score > entry[2]:
+            entry[1], entry[2] = vector_id, score
+    
+    ranked = sorted(documents.items(), key=lambda item: item[1][0], reverse=True)
+    return [(doc_id, entry[0], entry[1]) for doc_id, entry in ranked[:top_k]]
+
+
+def search_index(
+    query_embedding: np.ndarray,
+    top_k: int = 5,
+    engine: str = "auto",
+    language: Optional[str] = None,
+    allowed: Optional[np.ndarray] = None
+) -> List[Tuple[int, float, int]]:
+    """
+    Search passage vectors and aggregate the hits to documents
+    
+    engine: "exact" (NumPy brute force over the store), "ann" (configured
+    index backend + delta segment; "annoy" is an alias) or "auto" (exact up
+    to EXACT_SEARCH_MAX_VECTORS vectors, ANN above)
+    language: only search documents in this language (ANN: routed to the
+    language partition)
+    allowed: bitmap of doc ids that may be returned (see search_filters);
+    applied before scoring, so a filter never starves the top-k
+    
+    Returns list of (doc_id, score, best_chunk_id) tuples; scores are cosine
+    similarities (summed over passages when CHUNK_AGGREGATION is "sum")
+    """
+    if not EMBEDDINGS_AVAILABLE:
+        return []
+    
+    try:
+        from app.services.embedding_store import get_embedding_store, normalize
+        from app.services.search_filters import document_attributes, intersect
+        
+        query_embedding = normalize(query_embedding)
+        attribute_filtered = allowed is not None
+        if language is not None:
+            allowed = intersect(document_attributes.language_bitmap(language), allowed)
+        
+        if engine == "auto":
+            corpus_size = len(get_embedding_store())
+            engine = "exact" if corpus_size <= EXACT_SEARCH_MAX_VECTORS else "ann"
+        
+        n_passages = top_k * max(1, CHUNK_OVERFETCH)
+        if engine == "exact" or attribute_filtered:
+            # Attribute filters (created_at, metadata) have no ANN partition;
+            # scoring only the allowed rows is exact and cheaper than
+            # over-fetching from the ANN index and post-filtering
+            hits = _search_exact(query_embedding, n_passages, allowed)
+        else:
+            hits = _search_ann(query_embedding, n_passages, language, allowed)
+        return _aggregate_passages(hits, top_k, allowed)
     except Exception as e:
         logger.error(f"Error searching index: {e}")
         return []
 
 
 def rebuild_index_from_db(session):
-    """Rebuild Annoy index from database embeddings"""
+    """
+    Rebuild the vector index from database embeddings. Searches keep using the
+    previous snapshot until the new one is published.
+    """
     if not EMBEDDINGS_AVAILABLE:
         logger.warning("Embeddings not available, skipping index rebuild")
         return
     
     try:
-        from sqlalchemy import text
-        
-        with index_lock:
-            # Get all documents with embeddings
-            result = session.execute(
-                text("SELECT id, embedding FROM document WHERE embedding IS NOT NULL ORDER BY id")
-            )
-            rows = result.fetchall()
-            
-            if not rows:
-                logger.info("No documents with embeddings to rebuild index")
-                return
-            
-            # Create new index
-            embedding_dim = 384  # all-MiniLM-L6-v2 dimension
-            index = annoy.AnnoyIndex(embedding_dim, metric='euclidean')
-            doc_ids = []
-            
-            # Rebuild
-            from app.utils.embedding_utils import deserialize_embedding
-            for vector_idx, (doc_id, embedding_bytes) in enumerate(rows):
-                embedding = deserialize_embedding(embedding_bytes)
-                if embedding is not None:
-                    index.add_item(vector_idx, embedding)
-                    doc_ids.append(doc_id)
-            
-            # Build
-            index.build(10)
-            
-            # Save
-            init_index_dir()
-            index.save(str(INDEX_PATH))
-            with open(MAPPING_PATH, "w") as f:
-                json.dump(doc_ids, f)
-            
-            logger.info(f"✓ Index rebuilt: {index.get_n_items()} vectors from {len(doc_ids)} documents")
+        # Vectors come from the memory-mapped store (migrated from the
+        # document.embedding BLOBs on first use)
+        get_snapshot()
+        total = _rebuild_segment()
+        if total == 0:
+            logger.info("No documents with embeddings to rebuild index")
+            return
+        logger.info(f"✓ Index rebuilt: {total} vectors")
     except Exception as e:
         logger.error(f"Error rebuilding index: {e}")
 
 
+def index_stats() -> dict:
+    """Backend and size of the index partitions, delta segment and tombstone set"""
+    snapshot = current_snapshot
+    return {
+        "backend": VECTOR_INDEX_BACKEND,
+        "partitions": {
+            language: segment.stats()
+            for language, segment in (snapshot.segments.items() if snapshot else ())
+        },
+        "indexed_vectors": _indexed_count(snapshot),
+        "delta_vectors": len(delta_vectors),
+        "tombstones": len(tombstones),
+        "tombstone_ratio": round(_tombstone_ratio(), 4),
+        "compaction_ratio": TOMBSTONE_COMPACT_RATIO,
+        "merge_running": merge_thread is not None
+    }
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return len(np.intersect1d(found, truth)) / max(1, len(truth))
+
+
+def quantization_stats(k: int = 10) -> dict:
+    """
+    Memory / recall tradeoff of the store precision. Recall@k of the code
+    scan alone and after rescoring is measured against the float32 top-k on
+    QUANT_RECALL_SAMPLES stored vectors used as queries; cached until the
+    store changes.
+    """
+    global quantization_report
+    from app.services.embedding_store import get_embedding_store, FREE_ROW
+    
+    store = get_embedding_store()
+    report = store.stats()
+    report = {
+        "dtype": report["dtype"],
+        "bytes_per_vector": report["scan_bytes_per_vector"],
+        "float32_bytes_per_vector": report["dim"] * 4,
+        "scan_bytes": report["scan_bytes"],
+        "compression": report["scan_compression"],
+        "rescore_factor": QUANT_RESCORE_FACTOR
+    }
+    if not store.quantized:
+        return {**report, "recall_at_k": 1.0, "rescored_recall_at_k": 1.0}
+    
+    cached = quantization_report
+    if cached is not None and cached[0] == (store.generation, k):
+        return {**report, **cached[1]}
+    
+    ids, vectors = store.matrix()
+    live = np.flatnonzero(ids != FREE_ROW)
+    if len(live) <= k:
+        return {**report, "recall_at_k": None, "rescored_recall_at_k": None}
+    
+    rng = np.random.default_rng(0)
+    samples = rng.choice(live, size=min(QUANT_RECALL_SAMPLES, len(live)), replace=False)
+    free = ids == FREE_ROW
+    recall, rescored = [], []
+    for row in samples:
+        query = np.array(vectors[row])
+        exact = np.asarray(vectors @ query, dtype=np.float32)
+        exact[free] = -np.inf
+        approx = store.approximate_scores(query, count=len(ids))
+        approx[free] = -np.inf
+        truth = _top_k_indices(exact, k)
+        recall.append(_recall(_top_k_indices(approx, k), truth))
+        candidates = _top_k_indices(approx, k * max(1, QUANT_RESCORE_FACTOR))
+        reranked = candidates[_top_k_indices(exact[candidates], k)]
+        rescored.append(_recall(reranked, truth))
+    
+    measured = {
+        "recall_at_k": round(float(np.mean(recall)), 4),
+        "rescored_recall_at_k": round(float(np.mean(rescored)), 4),
+        "k": k,
+        "samples": len(samples)
+    }
+    quantization_report = ((store.generation, k), measured)
+    return {**report, **measured}
+
+
 def cleanup_index():
     """Remove index files (for testing/cleanup)"""
+    global current_snapshot
     try:
-        global annoy_index
-        if INDEX_PATH.exists():
-            INDEX_PATH.unlink()
-        if MAPPING_PATH.exists():
-            MAPPING_PATH.unlink()
-        annoy_index = None
+        _, partitions = _read_partitions()
+        paths = [path for stem in partitions.values() for path in _partition_paths(stem)]
+        for path in paths + [PARTITIONS_PATH, LEGACY_PARTITIONS_PATH, MARKER_PATH, TOMBSTONES_PATH, *LEGACY_INDEX_PATHS]:
+            if path.exists():
+                path.unlink()
+        with index_lock:
+            delta_vectors.clear()
+            tombstones.clear()
+            current_snapshot = None
         logger.info("✓ Cleaned up index files")
     except Exception as e:
         logger.error(f"Error cleaning up index: {e}")
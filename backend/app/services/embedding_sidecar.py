@@ -0,0 +1,306 @@
+"""
+Shared embedding sidecar over a Unix domain socket
+
+Several uvicorn workers would each load their own copy of the model; with
+EMBEDDING_SIDECAR_SOCKET set they send texts to one sidecar process
+instead, which holds the only copy and micro-batches the requests of all
+workers together. Start it next to the app (from backend/):
+
+    EMBEDDING_SIDECAR_SOCKET=data/embedding.sock python -m app.services.embedding_sidecar
+
+When the sidecar is unreachable the app falls back to the in-process model
+(unless EMBEDDING_SIDECAR_FALLBACK=0) and retries the socket after
+EMBEDDING_SIDECAR_RETRY seconds.
+
+Wire format (network byte order, one frame per message):
+
+    request:  u32 frame length | u32 request id | u16 count | count x (u32 length | UTF-8 text)
+    response: u32 frame length | u32 request id | u8 status | u16 count | u16 dim | count x dim float32 (LE)
+
+A status other than 0 carries a UTF-8 error message instead of vectors.
+The u16 count caps a request at 65535 texts; the client sends larger inputs
+as several requests of at most EMBEDDING_SIDECAR_BATCH texts. Requests are
+multiplexed over one connection per client event loop;
+responses may arrive out of order.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_SIDECAR_SOCKET = os.environ.get("EMBEDDING_SIDECAR_SOCKET", "")
+EMBEDDING_SIDECAR_FALLBACK = os.environ.get("EMBEDDING_SIDECAR_FALLBACK", "1") == "1"
+EMBEDDING_SIDECAR_TIMEOUT = float(os.environ.get("EMBEDDING_SIDECAR_TIMEOUT", "30"))
+EMBEDDING_SIDECAR_RETRY = float(os.environ.get("EMBEDDING_SIDECAR_RETRY", "5"))
+# Texts per request; the timeout applies to each request
+EMBEDDING_SIDECAR_BATCH = int(os.environ.get("EMBEDDING_SIDECAR_BATCH", "256"))
+
+FRAME = struct.Struct("!I")
+REQUEST_HEADER = struct.Struct("!IH")
+TEXT_LENGTH = struct.Struct("!I")
+RESPONSE_HEADER = struct.Struct("!IBHH")
+STATUS_OK = 0
+STATUS_ERROR = 1
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+MAX_REQUEST_TEXTS = 0xFFFF  # u16 count
+
+
+def encode_request(request_id: int, texts: List[str]) -> bytes:
+    if len(texts) > MAX_REQUEST_TEXTS:
+        raise ValueError(f"{len(texts)} texts exceed the {MAX_REQUEST_TEXTS} per sidecar request")
+    parts = [REQUEST_HEADER.pack(request_id, len(texts))]
+    for value in texts:
+        data = value.encode("utf-8")
+        parts.append(TEXT_LENGTH.pack(len(data)))
+        parts.append(data)
+    body = b"".join(parts)
+    return FRAME.pack(len(body)) + body
+
+
+def decode_request(body: bytes):
+    request_id, count = REQUEST_HEADER.unpack_from(body)
+    offset = REQUEST_HEADER.size
+    texts = []
+    for _ in range(count):
+        (length,) = TEXT_LENGTH.unpack_from(body, offset)
+        offset += TEXT_LENGTH.size
+        texts.append(body[offset:offset + length].decode("utf-8"))
+        offset += length
+    return request_id, texts
+
+
+def encode_response(request_id: int, vectors: Optional[np.ndarray], error: str = "") -> bytes:
+    if vectors is None:
+        body = RESPONSE_HEADER.pack(request_id, STATUS_ERROR, 0, 0) + error.encode("utf-8")
+    else:
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        body = RESPONSE_HEADER.pack(request_id, STATUS_OK, vectors.shape[0], vectors.shape[1]) + vectors.tobytes()
+    return FRAME.pack(len(body)) + body
+
+
+def decode_response(body: bytes):
+    request_id, status, count, dim = RESPONSE_HEADER.unpack_from(body)
+    payload = body[RESPONSE_HEADER.size:]
+    if status != STATUS_OK:
+        return request_id, None, payload.decode("utf-8", errors="replace")
+    vectors = np.frombuffer(payload, dtype="<f4", count=count * dim).reshape(count, dim).astype(np.float32)
+    return request_id, vectors, ""
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    (length,) = FRAME.unpack(await reader.readexactly(FRAME.size))
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {length} bytes exceeds the limit")
+    return await reader.readexactly(length)
+
+
+# ----------------------------------------------------------------------
+# Client (app workers)
+# ----------------------------------------------------------------------
+
+class SidecarClient:
+    """Multiplexed connection to the sidecar from one event loop"""
+
+    def __init__(self, path: str = EMBEDDING_SIDECAR_SOCKET):
+        self.path = path
+        self.loop = None
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.request_ids = itertools.count(1)
+        self.connect_lock = None
+        self.retry_at = 0.0
+
+        # Stats
+        self.requests = 0
+        self.texts = 0
+        self.failures = 0
+        self.seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    async def _connect(self) -> bool:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # New event loop (tests, CLI runs): start over
+            self.loop = loop
+            self.writer = None
+            self.connect_lock = asyncio.Lock()
+        async with self.connect_lock:
+            if self.writer is not None and not self.writer.is_closing():
+                return True
+            if time.monotonic() < self.retry_at:
+                return False
+            try:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_unix_connection(self.path), EMBEDDING_SIDECAR_TIMEOUT
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                self.retry_at = time.monotonic() + EMBEDDING_SIDECAR_RETRY
+                logger.warning(f"Embedding sidecar unavailable at {self.path}: {e}")
+                return False
+            self.reader_task = loop.create_task(self._read_responses(self.reader))
+            logger.info(f"✓ Connected to embedding sidecar at {self.path}")
+            return True
+
+    async def _read_responses(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                request_id, vectors, error = decode_response(await read_frame(reader))
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    if vectors is None:
+                        future.set_exception(RuntimeError(f"Sidecar error: {error}"))
+                    else:
+                        future.set_result(vectors)
+        except (asyncio.IncompleteReadError, OSError, ValueError) as e:
+            logger.warning(f"Embedding sidecar connection lost: {e}")
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Embedding sidecar connection lost"))
+            self.pending.clear()
+
+    async def _request(self, texts: List[str]) -> np.ndarray:
+        request_id = next(self.request_ids) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        started = time.perf_counter()
+        try:
+            self.writer.write(encode_request(request_id, texts))
+            await self.writer.drain()
+            vectors = await asyncio.wait_for(future, EMBEDDING_SIDECAR_TIMEOUT)
+        except BaseException:
+            self.pending.pop(request_id, None)
+            raise
+        self.requests += 1
+        self.texts += len(texts)
+        self.seconds += time.perf_counter() - started
+        return vectors
+
+    async def embed_many(self, texts: List[str]) -> Optional[np.ndarray]:
+        """
+        Embeddings from the sidecar, or None when it can't be used. Inputs
+        are split into requests of EMBEDDING_SIDECAR_BATCH texts, sent
+        together over the connection.
+        """
+        if not self.enabled or not texts or not await self._connect():
+            return None
+        size = min(max(1, EMBEDDING_SIDECAR_BATCH), MAX_REQUEST_TEXTS)
+        requests = [
+            asyncio.ensure_future(self._request(texts[start:start + size]))
+            for start in range(0, len(texts), size)
+        ]
+        try:
+            parts = await asyncio.gather(*requests)
+        except Exception as e:
+            for request in requests:
+                request.cancel()  # The result is unusable without every part
+            self.failures += 1
+            logger.warning(f"Embedding sidecar request failed: {e}")
+            return None
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def stats(self) -> dict:
+        return {
+            "socket": self.path,
+            "connected": self.writer is not None and not self.writer.is_closing(),
+            "requests": self.requests,
+            "texts": self.texts,
+            "failures": self.failures,
+            "in_flight": len(self.pending),
+            "avg_request_ms": round(1000 * self.seconds / self.requests, 2) if self.requests else 0.0,
+            "batch_size": EMBEDDING_SIDECAR_BATCH,
+            "fallback": EMBEDDING_SIDECAR_FALLBACK
+        }
+
+
+sidecar_client = SidecarClient()
+
+
+# ----------------------------------------------------------------------
+# Server (sidecar process)
+# ----------------------------------------------------------------------
+
+async def _handle_request(scheduler, writer: asyncio.StreamWriter, body: bytes):
+    try:
+        request_id, texts = decode_request(body)
+    except (struct.error, UnicodeDecodeError) as e:
+        logger.warning(f"Malformed sidecar request: {e}")
+        writer.close()
+        return
+    embeddings = await scheduler.embed_many(texts) if texts else []
+    if any(embedding is None for embedding in embeddings):
+        writer.write(encode_response(request_id, None, "encode failed"))
+    else:
+        vectors = np.stack(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+        writer.write(encode_response(request_id, vectors))
+    await writer.drain()
+
+
+async def _serve_connection(scheduler, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    tasks = set()
+    try:
+        while True:
+            body = await read_frame(reader)
+            # Requests are answered as their batches complete, so one
+            # client's large request doesn't hold up its small ones
+            task = asyncio.create_task(_handle_request(scheduler, writer, body))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+
+
+async def serve(path: str):
+    """Load the model once and serve embedding requests until cancelled"""
+    from app.services.embedding_scheduler import EmbeddingScheduler
+    from app.services.embedding_service import get_embeddings, init_embeddings
+
+    if init_embeddings() is None:
+        raise RuntimeError("Embedding model could not be loaded")
+    # Micro-batches across all connected app workers
+    scheduler = EmbeddingScheduler(get_embeddings)
+
+    socket_path = Path(path)
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        socket_path.unlink()
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: _serve_connection(scheduler, reader, writer), path=str(socket_path)
+    )
+    logger.info(f"✓ Embedding sidecar listening on {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Embedding sidecar shared by the app workers")
+    parser.add_argument("--socket", default=EMBEDDING_SIDECAR_SOCKET or "data/embedding.sock")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,583 @@
+"""
+Contiguous memory-mapped embedding store
+
+All passage vectors live in one float32 matrix file under data/, with
+parallel int64 row tables holding the vector (chunk) id of each row
+(-1 = free row) and the document that owns it. The files are opened with
+np.memmap, so rebuilds and brute-force scans read
+the whole matrix without per-row parsing, and several uvicorn workers share
+the same page cache.
+
+Vectors are stored L2-normalized, so a dot product is a cosine similarity.
+
+With EMBEDDING_STORE_DTYPE=float16 or int8 the store also keeps a compact
+copy of every row (2 or 1 bytes per dimension, int8 with a per-row scale).
+Brute-force scans read only the compact codes and rescore a short candidate
+list against the float32 rows, so the hot working set shrinks 2-4x while
+the float32 file stays on disk for rescoring and index rebuilds.
+
+Writers in different processes are serialized by an flock on
+embeddings.lock; each one reloads the row tables under the lock when
+another process has written since, so rows are never handed out twice.
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = Path("data")
+MATRIX_PATH = STORE_DIR / "embeddings.f32"
+IDS_PATH = STORE_DIR / "embeddings.ids"
+OWNERS_PATH = STORE_DIR / "embeddings.owners"
+META_PATH = STORE_DIR / "embeddings.json"
+CODES_PATH = STORE_DIR / "embeddings.codes"
+SCALES_PATH = STORE_DIR / "embeddings.scales"
+LOCK_PATH = STORE_DIR / "embeddings.lock"
+
+STORE_VERSION = 2  # v2: vectors keyed by chunk id, with owner doc ids
+
+DEFAULT_DIM = 384  # all-MiniLM-L6-v2 dimension
+INITIAL_CAPACITY = 1024
+FREE_ROW = -1
+
+# Scan precision: float32 (no codes), float16 or int8
+STORE_DTYPE = os.environ.get("EMBEDDING_STORE_DTYPE", "float32").lower()
+CODE_DTYPES = {"float16": np.float16, "int8": np.int8}
+# Rows converted to float32 at a time while scanning codes
+SCAN_BLOCK_ROWS = 16384
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize a vector or each row of a matrix (float32)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Compact codes of float32 rows: (codes, None) for float16, (codes, scales)
+    for int8 with symmetric per-row scaling (row ≈ codes * scale).
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class EmbeddingStore:
+    """
+    Append/overwrite store of float32 vectors keyed by vector id, each
+    owned by a document (one vector per passage), optionally with float16
+    or int8 codes for fast approximate scans.
+
+    Updates overwrite the existing row in place, deletes free the row for
+    reuse, and the files grow by doubling. Readers in other processes pick
+    up changes when the meta file's generation moves.
+    """
+
+    def __init__(self, directory: Path = STORE_DIR):
+        self.directory = Path(directory)
+        self.matrix_path = self.directory / MATRIX_PATH.name
+        self.ids_path = self.directory / IDS_PATH.name
+        self.owners_path = self.directory / OWNERS_PATH.name
+        self.meta_path = self.directory / META_PATH.name
+        self.codes_path = self.directory / CODES_PATH.name
+        self.scales_path = self.directory / SCALES_PATH.name
+        self.lock_path = self.directory / LOCK_PATH.name
+
+        self.lock = threading.RLock()
+        self.dim = DEFAULT_DIM
+        self.dtype = "float32"
+        self.count = 0  # High-water mark of used rows
+        self.capacity = 0
+        self.generation = 0
+        self.vectors = None
+        self.ids = None
+        self.owners = None
+        self.codes = None
+        self.scales = None
+        self.row_of: Dict[int, int] = {}
+        self.vectors_of: Dict[int, Set[int]] = {}  # owner doc id -> vector ids
+        self.free_rows: List[int] = []
+        self._meta_mtime = None
+        self._lock_file = None
+        self._lock_depth = 0
+
+    # ------------------------------------------------------------------
+    # File management
+    # ------------------------------------------------------------------
+
+    def exists(self) -> bool:
+        paths = (self.meta_path, self.matrix_path, self.ids_path, self.owners_path)
+        if not all(path.exists() for path in paths):
+            return False
+        with open(self.meta_path, "r") as f:
+            return json.load(f).get("version") == STORE_VERSION
+
+    @contextmanager
+    def _exclusive(self):
+        """
+        Thread lock plus an exclusive flock on the lock file for mutations
+        (reentrant). On first entry the store is reloaded if another
+        process has written since, so free rows and the high-water mark are
+        current before any row is allocated.
+        """
+        with self.lock:
+            if self._lock_depth == 0:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._lock_file = open(self.lock_path, "a+")
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1:
+                    self._reload_if_changed()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _reload_if_changed(self):
+        # Compares the generation, not the mtime, which may not move between
+        # two quick writes
+        if self.vectors is None or not self.meta_path.exists():
+            return
+        with open(self.meta_path, "r") as f:
+            generation = int(json.load(f).get("generation", 0))
+        if generation != self.generation:
+            self._load()
+
+    def _map(self):
+        """(Re)open memory maps over the current files"""
+        self.vectors = np.memmap(self.matrix_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self.ids = np.memmap(self.ids_path, dtype=np.int64, mode="r+", shape=(self.capacity,))
+        self.owners = np.memmap(self.owners_path, dtype=np.int64, mode="r+", shape=(self.capacity,))
+        self.codes = None
+        self.scales = None
+        if self.dtype in CODE_DTYPES:
+            self.codes = np.memmap(self.codes_path, dtype=CODE_DTYPES[self.dtype], mode="r+", shape=(self.capacity, self.dim))
+        if self.dtype == "int8":
+            self.scales = np.memmap(self.scales_path, dtype=np.float32, mode="r+", shape=(self.capacity,))
+
+    def _flush_maps(self):
+        for array in (self.vectors, self.ids, self.owners, self.codes, self.scales):
+            if array is not None:
+                array.flush()
+
+    def _resize_files(self, capacity: int):
+        """Grow the files to hold `capacity` rows (new id slots are marked free)"""
+        old_capacity = self.capacity
+        if self.vectors is not None:
+            self._flush_maps()
+            self.vectors = None
+            self.ids = None
+            self.owners = None
+            self.codes = None
+            self.scales = None
+
+        with open(self.matrix_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        for path in (self.ids_path, self.owners_path):
+            with open(path, "ab") as f:
+                f.truncate(capacity * 8)
+        if self.dtype in CODE_DTYPES:
+            with open(self.codes_path, "ab") as f:
+                f.truncate(capacity * self.dim * np.dtype(CODE_DTYPES[self.dtype]).itemsize)
+        if self.dtype == "int8":
+            with open(self.scales_path, "ab") as f:
+                f.truncate(capacity * 4)
+
+        self.capacity = capacity
+        self._map()
+        self.ids[old_capacity:capacity] = FREE_ROW
+
+    def _write_meta(self):
+        self.generation += 1
+        tmp_path = self.meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "dim": self.dim,
+                "dtype": self.dtype,
+                "count": self.count,
+                "capacity": self.capacity,
+                "generation": self.generation,
+                "version": STORE_VERSION
+            }, f)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_mtime = self.meta_path.stat().st_mtime_ns
+
+    def _load(self):
+        """Open existing files and rebuild the in-memory doc-id -> row table"""
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+        self._meta_mtime = self.meta_path.stat().st_mtime_ns
+
+        self.dim = int(meta["dim"])
+        self.dtype = meta.get("dtype", "float32")
+        self.count = int(meta["count"])
+        self.capacity = int(meta["capacity"])
+        self.generation = int(meta.get("generation", 0))
+        self._map()
+
+        ids = np.asarray(self.ids[:self.count])
+        owners = np.asarray(self.owners[:self.count])
+        live = np.flatnonzero(ids != FREE_ROW)
+        self.row_of = dict(zip(ids[live].tolist(), live.tolist()))
+        self.vectors_of = {}
+        for vector_id, owner in zip(ids[live].tolist(), owners[live].tolist()):
+            self.vectors_of.setdefault(owner, set()).add(vector_id)
+        self.free_rows = np.flatnonzero(ids == FREE_ROW).tolist()
+
+    def create(self, dim: int = DEFAULT_DIM, capacity: int = INITIAL_CAPACITY):
+        """Create an empty store, replacing any existing files"""
+        with self._exclusive():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for path in (self.matrix_path, self.ids_path, self.owners_path, self.codes_path, self.scales_path):
+                if path.exists():
+                    path.unlink()
+            self.vectors = None
+            self.ids = None
+            self.owners = None
+            self.codes = None
+            self.scales = None
+            self.dim = dim
+            self.dtype = STORE_DTYPE if STORE_DTYPE in CODE_DTYPES else "float32"
+            self.count = 0
+            self.capacity = 0
+            self.row_of = {}
+            self.vectors_of = {}
+            self.free_rows = []
+            self._resize_files(capacity)
+            self._write_meta()
+
+    def open(self) -> bool:
+        """Open the store if its files exist"""
+        with self.lock:
+            if not self.exists():
+                return False
+            self._load()
+            if STORE_DTYPE != self.dtype:
+                self.set_dtype(STORE_DTYPE)
+            return True
+
+    def set_dtype(self, dtype: str):
+        """Switch the scan precision, (re)encoding the codes from the float32 rows"""
+        if dtype not in CODE_DTYPES and dtype != "float32":
+            raise ValueError(f"Unsupported store dtype: {dtype}")
+        with self._exclusive():
+            self._flush_maps()
+            self.codes = None
+            self.scales = None
+            for path in (self.codes_path, self.scales_path):
+                if path.exists():
+                    path.unlink()
+            old_dtype, self.dtype = self.dtype, dtype
+            self._resize_files(self.capacity)
+            for start in range(0, self.count, SCAN_BLOCK_ROWS):
+                self._encode_rows(start, min(start + SCAN_BLOCK_ROWS, self.count))
+            self.flush()
+            logger.info(f"✓ Embedding store precision {old_dtype} -> {dtype} ({self.count} rows)")
+
+    def _encode_rows(self, start: int, end: int):
+        if self.codes is None:
+            return
+        codes, scales = quantize(self.vectors[start:end], self.dtype)
+        self.codes[start:end] = codes
+        if scales is not None:
+            self.scales[start:end] = scales
+
+    def refresh(self):
+        """Reload if another process has written since we last looked"""
+        with self.lock:
+            if self.vectors is None or not self.meta_path.exists():
+                return
+            if self.meta_path.stat().st_mtime_ns != self._meta_mtime:
+                self._load()
+
+    def flush(self):
+        with self._exclusive():
+            if self.vectors is not None:
+                self._flush_maps()
+                self._write_meta()
+
+    # ------------------------------------------------------------------
+    # Mutations
+    # ------------------------------------------------------------------
+
+    def _put(self, vector_id: int, vector: np.ndarray, owner: int):
+        row = self.row_of.get(vector_id)
+        if row is None:
+            if self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                if self.count >= self.capacity:
+                    self._resize_files(max(INITIAL_CAPACITY, self.capacity * 2))
+                row = self.count
+                self.count += 1
+            self.row_of[vector_id] = row
+        else:
+            self._unlink_owner(vector_id, int(self.owners[row]))
+        self.vectors[row] = normalize(vector)
+        self._encode_rows(row, row + 1)
+        self.owners[row] = owner
+        self.ids[row] = vector_id
+        self.vectors_of.setdefault(owner, set()).add(vector_id)
+
+    def _unlink_owner(self, vector_id: int, owner: int):
+        vector_ids = self.vectors_of.get(owner)
+        if vector_ids is not None:
+            vector_ids.discard(vector_id)
+            if not vector_ids:
+                del self.vectors_of[owner]
+
+    def _delete(self, vector_id: int) -> bool:
+        row = self.row_of.pop(vector_id, None)
+        if row is None:
+            return False
+        self._unlink_owner(vector_id, int(self.owners[row]))
+        self.ids[row] = FREE_ROW
+        self.free_rows.append(row)
+        return True
+
+    def put(self, vector_id: int, vector: np.ndarray, owner: Optional[int] = None):
+        """Insert or overwrite a vector (owner defaults to the vector id)"""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        with self._exclusive():
+            if vector.shape[0] != self.dim:
+                raise ValueError(f"Embedding dim {vector.shape[0]} does not match store dim {self.dim}")
+            vector_id = int(vector_id)
+            self._put(vector_id, vector, vector_id if owner is None else int(owner))
+            self.flush()
+
+    def put_many(
+        self,
+        vector_ids: List[int],
+        vectors: np.ndarray,
+        owner: Optional[int] = None,
+        owners: Optional[List[int]] = None
+    ):
+        """Insert or overwrite many vectors with a single flush (owners: one per vector)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if owners is None:
+            owners = [owner] * len(vector_ids)
+        with self._exclusive():
+            for vector_id, vector, vector_owner in zip(vector_ids, vectors, owners):
+                vector_id = int(vector_id)
+                self._put(vector_id, vector, vector_id if vector_owner is None else int(vector_owner))
+            self.flush()
+
+    def delete(self, vector_id: int) -> bool:
+        """Free the row of one vector. O(1)."""
+        with self._exclusive():
+            deleted = self._delete(int(vector_id))
+            if deleted:
+                self.flush()
+            return deleted
+
+    def delete_owner(self, owner: int) -> List[int]:
+        """Free all vectors owned by a document; returns their ids"""
+        with self._exclusive():
+            vector_ids = list(self.vectors_of.get(int(owner), ()))
+            for vector_id in vector_ids:
+                self._delete(vector_id)
+            if vector_ids:
+                self.flush()
+            return vector_ids
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.row_of)
+
+    def __contains__(self, vector_id: int) -> bool:
+        return int(vector_id) in self.row_of
+
+    def get(self, vector_id: int) -> Optional[np.ndarray]:
+        with self.lock:
+            row = self.row_of.get(int(vector_id))
+            if row is None:
+                return None
+            return np.array(self.vectors[row])
+
+    def take(self, vector_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, vectors) of the given ids that are still in the store, in order"""
+        with self.lock:
+            found = [(vector_id, self.row_of[vector_id]) for vector_id in map(int, vector_ids) if vector_id in self.row_of]
+            if not found:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+            ids, rows = zip(*found)
+            return np.array(ids, dtype=np.int64), np.array(self.vectors[list(rows)])
+
+    def owner_of(self, vector_id: int) -> Optional[int]:
+        """Owning doc id of a live vector, None if it was deleted"""
+        row = self.row_of.get(int(vector_id))
+        if row is None:
+            return None
+        return int(self.owners[row])
+
+    def vector_ids_of(self, owner: int) -> List[int]:
+        return sorted(self.vectors_of.get(int(owner), ()))
+
+    def owner_rows(self) -> np.ndarray:
+        """Zero-copy view of the owner doc id of every used row"""
+        with self.lock:
+            if self.owners is None:
+                return np.empty(0, dtype=np.int64)
+            return self.owners[:self.count]
+
+    def matrix(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Zero-copy views (ids, vectors) over the used rows.
+        Free rows have id == FREE_ROW and must be skipped by the caller.
+        """
+        with self.lock:
+            if self.vectors is None:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+            return self.ids[:self.count], self.vectors[:self.count]
+
+    @property
+    def quantized(self) -> bool:
+        return self.codes is not None
+
+    def approximate_scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None, count: Optional[int] = None) -> np.ndarray:
+        """
+        Dot products of a normalized query with the first `count` used rows
+        (or the given rows), computed from the compact codes in blocks so the
+        float32 matrix is never read. Exact when the store has no codes.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        with self.lock:
+            count = self.count if count is None else count
+            vectors, codes, scales = self.vectors, self.codes, self.scales
+        if vectors is None:
+            return np.empty(0, dtype=np.float32)
+        if codes is None:
+            source = vectors[:count] if rows is None else vectors[rows]
+            return np.asarray(source @ query, dtype=np.float32)
+
+        n = count if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, n)
+            block = codes[start:end] if rows is None else codes[rows[start:end]]
+            scores[start:end] = np.asarray(block, dtype=np.float32) @ query
+        if scales is not None:
+            scores *= scales[:count] if rows is None else scales[rows]
+        return scores
+
+    def live(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, vectors) of live rows only, compacted (copies when there are holes)"""
+        with self.lock:
+            ids, vectors = self.matrix()
+            if not self.free_rows:
+                return np.array(ids), vectors
+            mask = ids != FREE_ROW
+            return np.asarray(ids[mask]), vectors[mask]
+
+    def code_bytes_per_vector(self) -> int:
+        """Bytes read per row by a scan"""
+        if self.dtype not in CODE_DTYPES:
+            return self.dim * 4
+        return self.dim * np.dtype(CODE_DTYPES[self.dtype]).itemsize + (4 if self.dtype == "int8" else 0)
+
+    def stats(self) -> dict:
+        scan_bytes = self.capacity * self.code_bytes_per_vector()
+        float32_bytes = self.capacity * self.dim * 4
+        return {
+            "vectors": len(self.row_of),
+            "documents": len(self.vectors_of),
+            "rows": self.count,
+            "capacity": self.capacity,
+            "free_rows": len(self.free_rows),
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "bytes": float32_bytes + self.capacity * 16 + (scan_bytes if self.quantized else 0),
+            "scan_bytes": scan_bytes,
+            "scan_bytes_per_vector": self.code_bytes_per_vector(),
+            "scan_compression": round(float32_bytes / scan_bytes, 2) if scan_bytes else 1.0
+        }
+
+    # ------------------------------------------------------------------
+    # Migration
+    # ------------------------------------------------------------------
+
+    def migrate_from_db(self, conn, batch_size: int = 1000) -> int:
+        """
+        Import the per-row np.save BLOBs in document_chunk.embedding (legacy
+        document.embedding BLOBs are copied into single-passage chunks by
+        init_db). Returns the number of vectors imported.
+        """
+        from sqlalchemy import text
+        from app.utils.embedding_utils import deserialize_embedding
+
+        with self._exclusive():
+            if self.vectors is None and self.exists():
+                # Another worker migrated while we waited for the lock
+                self._load()
+                return 0
+            imported = 0
+            result = conn.execute(
+                text("SELECT id, document_id, embedding FROM document_chunk WHERE embedding IS NOT NULL ORDER BY id")
+            )
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for chunk_id, doc_id, embedding_bytes in rows:
+                    embedding = deserialize_embedding(embedding_bytes)
+                    if embedding is None:
+                        continue
+                    if self.vectors is None:
+                        self.create(dim=len(embedding))
+                    self._put(int(chunk_id), embedding, int(doc_id))
+                    imported += 1
+
+            if self.vectors is None:
+                self.create()
+            self.flush()
+            logger.info(f"✓ Migrated {imported} embeddings from document_chunk.embedding to {self.matrix_path}")
+            return imported
+
+
+# Process-wide store (lazy open / migrate)
+embedding_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """Open the shared store, migrating from the DB BLOB columns the first time"""
+    global embedding_store
+
+    with _store_lock:
+        if embedding_store is None:
+            store = EmbeddingStore()
+            if not store.open():
+                from app.database import engine
+                with engine.connect() as conn:
+                    store.migrate_from_db(conn)
+            embedding_store = store
+        else:
+            embedding_store.refresh()
+        return embedding_store
@@ -0,0 +1,178 @@
+"""
+Shared async HTTP client for upstream services (Google Translate,
+DuckDuckGo)
+
+One httpx.AsyncClient per event loop keeps connections alive between
+requests, so repeated calls skip the TCP and TLS handshakes, and no call
+blocks the event loop. HTTP/2 is negotiated when the h2 package is
+installed (HTTP2=0 turns it off). Besides the pool-wide limits
+(HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE) each host gets at most
+HTTP_MAX_PER_HOST concurrent requests; a request that waits longer than
+HTTP_POOL_TIMEOUT for a slot fails with httpx.PoolTimeout.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from importlib.util import find_spec
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_MAX_PER_HOST = int(os.environ.get("HTTP_MAX_PER_HOST", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", "5"))
+HTTP2_ENABLED = os.environ.get("HTTP2", "1") == "1" and find_spec("h2") is not None
+
+
+class HostStats:
+    """Request counters for one upstream host"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.connects = 0  # New TCP connections (the rest reused a pooled one)
+        self.seconds = 0.0
+        self.http_versions: Dict[str, int] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "new_connections": self.connects,
+            "connection_reuse_rate": round(1 - self.connects / self.requests, 3) if self.requests else 0.0,
+            "avg_request_ms": round(1000 * self.seconds / self.requests, 2) if self.requests else 0.0,
+            "http_versions": dict(self.http_versions)
+        }
+
+
+class HttpClient:
+    """Pooled AsyncClient with per-host concurrency limits and metrics"""
+
+    def __init__(self):
+        self.loop = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self.host_slots: Dict[str, asyncio.Semaphore] = {}
+        self.hosts: Dict[str, HostStats] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # New event loop (tests, CLI runs): connections of the old one
+            # can't be reused
+            self.loop = loop
+            self.host_slots = {}
+            self.client = httpx.AsyncClient(
+                http2=HTTP2_ENABLED,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(
+                    HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT
+                )
+            )
+            logger.info(f"✓ HTTP client ready (http2={HTTP2_ENABLED}, {HTTP_MAX_PER_HOST} per host)")
+        return self.client
+
+    async def get(self, url: str, *, params: Optional[dict] = None, headers: Optional[dict] = None,
+                  timeout: Optional[float] = None) -> httpx.Response:
+        """
+        GET through the shared pool. timeout overrides the read timeout;
+        httpx exceptions (TimeoutException, ConnectError, ...) propagate.
+        """
+        client = self._get_client()
+        host = urlsplit(url).netloc
+        stats = self.hosts.setdefault(host, HostStats())
+        slots = self.host_slots.get(host)
+        if slots is None:
+            slots = self.host_slots[host] = asyncio.Semaphore(max(1, HTTP_MAX_PER_HOST))
+
+        async def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.complete":
+                stats.connects += 1
+
+        request_timeout = httpx.USE_CLIENT_DEFAULT
+        if timeout is not None:
+            request_timeout = httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+        stats.waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), HTTP_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise httpx.PoolTimeout(f"No free connection slot for {host}")
+        finally:
+            stats.waiting -= 1
+
+        stats.in_flight += 1
+        started = time.perf_counter()
+        try:
+            response = await client.get(
+                url, params=params, headers=headers, timeout=request_timeout, extensions={"trace": trace}
+            )
+        except httpx.TimeoutException:
+            stats.timeouts += 1
+            raise
+        except httpx.HTTPError:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+            stats.requests += 1
+            stats.seconds += time.perf_counter() - started
+            slots.release()
+        stats.http_versions[response.http_version] = stats.http_versions.get(response.http_version, 0) + 1
+        return response
+
+    def _pool_connections(self) -> dict:
+        # httpx keeps its connection pool private; read it best-effort
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        idle = 0
+        for connection in connections:
+            try:
+                idle += connection.is_idle()
+            except Exception:
+                pass
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    async def aclose(self):
+        if self.client is not None and self.loop is asyncio.get_running_loop():
+            await self.client.aclose()
+        self.client = None
+        self.loop = None
+
+    def stats(self) -> dict:
+        return {
+            "connections": self._pool_connections() if self.client is not None else None,
+            "hosts": {host: stats.to_dict() for host, stats in self.hosts.items()},
+            "config": {
+                "http2": HTTP2_ENABLED,
+                "max_connections": HTTP_MAX_CONNECTIONS,
+                "max_keepalive": HTTP_MAX_KEEPALIVE,
+                "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+                "max_per_host": HTTP_MAX_PER_HOST,
+                "connect_timeout": HTTP_CONNECT_TIMEOUT,
+                "read_timeout": HTTP_READ_TIMEOUT,
+                "pool_timeout": HTTP_POOL_TIMEOUT
+            }
+        }
+
+
+http_client = HttpClient()
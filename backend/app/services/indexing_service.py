@@ -0,0 +1,154 @@
+"""
+Document ingest pipeline: split into passages, batch-embed, store and index
+"""
+
+import asyncio
+import logging
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.services.embedding_cache import IndexResult, document_hash, embed_cached
+from app.services.search_cache import bump_index_generation
+from app.utils.text_chunking import chunk_text
+
+logger = logging.getLogger(__name__)
+
+
+async def embed_passages(texts: List[str]) -> Optional[np.ndarray]:
+    """Batch-embed passages through the shared embedding scheduler"""
+    from app.services.embedding_service import get_embeddings_async
+
+    if not texts:
+        return None
+    return await get_embeddings_async(texts)
+
+
+def _unchanged_passages(session: Session, doc_id: int, content_hash: str) -> Optional[int]:
+    """Embedded passage count when the document was last indexed from the same inputs, else None"""
+    current = session.execute(
+        text("SELECT content_hash FROM document WHERE id = :id"),
+        {"id": doc_id}
+    ).fetchone()
+    if current is None or current[0] != content_hash:
+        return None
+    passages = session.execute(
+        text("SELECT COUNT(*) FROM document_chunk WHERE document_id = :id AND embedding IS NOT NULL"),
+        {"id": doc_id}
+    ).scalar()
+    # Title / metadata may have changed
+    bump_index_generation()
+    return passages
+
+
+def _store_passages(
+    session: Session,
+    doc_id: int,
+    content: str,
+    language: Optional[str],
+    content_hash: str,
+    passages: list,
+    embeddings: Optional[np.ndarray]
+) -> Optional[List[int]]:
+    """
+    Replace the stored passages and update the search index (blocking).
+    Returns the new passage ids, or None when the document was deleted
+    meanwhile.
+    """
+    from app.database import PREVIEW_LENGTH
+    from app.utils.embedding_utils import serialize_embedding
+    from app.services.embedding_service import EMBEDDINGS_AVAILABLE, add_to_index, remove_from_index
+    from app.services.search_filters import document_attributes
+
+    # The document may have been deleted while embedding (background jobs)
+    if session.execute(text("SELECT 1 FROM document WHERE id = :id"), {"id": doc_id}).fetchone() is None:
+        logger.info(f"doc_id={doc_id} was deleted before indexing finished")
+        session.commit()  # Keep the new cache entries
+        return None
+
+    if embeddings is None and passages and EMBEDDINGS_AVAILABLE:
+        # Fail before the stored passages are touched, so they still match
+        # the vectors in the index, and the job queue retries with backoff
+        session.commit()  # Keep the new cache entries
+        raise RuntimeError(f"Could not generate embeddings for doc_id={doc_id}")
+
+    session.execute(text("DELETE FROM document_chunk WHERE document_id = :id"), {"id": doc_id})
+    chunk_ids = []
+    for i, passage in enumerate(passages):
+        result = session.execute(
+            text("""
+                INSERT INTO document_chunk (document_id, chunk_index, content, start_char, embedding)
+                VALUES (:document_id, :chunk_index, :content, :start_char, :embedding)
+            """),
+            {
+                "document_id": doc_id,
+                "chunk_index": passage.index,
+                "content": passage.text,
+                "start_char": passage.start_char,
+                "embedding": serialize_embedding(embeddings[i]) if embeddings is not None else None
+            }
+        )
+        chunk_ids.append(result.lastrowid)
+    # Whole-document vectors are superseded by the passages. The hash is
+    # only recorded once the passages are embedded, so failures are retried.
+    session.execute(
+        text("UPDATE document SET embedding = NULL, preview = :preview, content_hash = :content_hash WHERE id = :id"),
+        {
+            "id": doc_id,
+            "preview": content[:PREVIEW_LENGTH],
+            "content_hash": content_hash if embeddings is not None or not passages else None
+        }
+    )
+    session.commit()
+    if language is not None:
+        document_attributes.set_language(doc_id, language)
+    # Document text changed (lexical index too), even if embedding fails
+    bump_index_generation()
+
+    if embeddings is None:
+        if not passages:
+            remove_from_index(doc_id)  # Nothing left to embed
+        else:
+            logger.warning(f"Embeddings not available, doc_id={doc_id} stored without vectors")
+        return []
+
+    add_to_index(doc_id, chunk_ids, embeddings)
+    return chunk_ids
+
+
+async def index_document(session: Session, doc_id: int, content: str, language: Optional[str] = None) -> IndexResult:
+    """
+    Replace the passages of a document and index their embeddings.
+    
+    Nothing is rewritten when the content (and language) is unchanged since
+    the last successful run; otherwise only passages missing from the
+    embedding cache are encoded. Database and index writes run in a worker
+    thread, so the event loop keeps serving requests meanwhile.
+    """
+    from app.services.embedding_service import EMBEDDING_CACHE_KEY
+
+    content_hash = document_hash(content, language, EMBEDDING_CACHE_KEY)
+    unchanged = await asyncio.to_thread(_unchanged_passages, session, doc_id, content_hash)
+    if unchanged is not None:
+        logger.info(f"doc_id={doc_id} content unchanged, {unchanged} passages kept")
+        return IndexResult(passages=unchanged, reused=unchanged, computed=0, skipped=True)
+
+    passages = chunk_text(content)
+    embeddings, reused, computed = await embed_cached(
+        session, [passage.text for passage in passages], embed_passages, EMBEDDING_CACHE_KEY
+    )
+
+    chunk_ids = await asyncio.to_thread(
+        _store_passages, session, doc_id, content, language, content_hash, passages, embeddings
+    )
+    if not chunk_ids:
+        return IndexResult(passages=0, reused=0, computed=0)
+    logger.info(f"✓ {len(chunk_ids)} passages indexed for doc_id={doc_id} ({computed} encoded, {reused} reused)")
+    return IndexResult(passages=len(chunk_ids), reused=reused, computed=computed)
+
+
+def delete_document_chunks(session: Session, doc_id: int):
+    """Remove the passages of a document (SQLite doesn't enforce the FK cascade by default)"""
+    session.execute(text("DELETE FROM document_chunk WHERE document_id = :id"), {"id": doc_id})
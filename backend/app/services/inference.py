@@ -0,0 +1,139 @@
+"""
+Dedicated executor for model inference, and startup warmup
+
+All CPU-bound encode calls run on one bounded thread pool
+(INFERENCE_WORKERS threads), so the event loop keeps serving health checks,
+TTS and cached requests while a batch encodes, and inference never competes
+with the default executor used for database and file work.
+
+With EMBEDDING_PRELOAD=1 the app loads the embedding model and the vector
+index and encodes a dummy batch at startup; /api/ready reports 503 until
+that warmup has finished.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "1"))
+EMBEDDING_PRELOAD = os.environ.get("EMBEDDING_PRELOAD", "0") == "1"
+WARMUP_TEXTS = [
+    "warmup",
+    "A slightly longer warmup sentence so that a second sequence length is compiled.",
+]
+
+
+class InferenceExecutor:
+    """Bounded thread pool for model calls, with queue / latency counters"""
+
+    def __init__(self, workers: int = INFERENCE_WORKERS):
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+
+        # Stats
+        self.submitted = 0
+        self.completed = 0
+        self.running = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def _call(self, fn: Callable, args: tuple, queued_at: float):
+        started = time.perf_counter()
+        self.wait_seconds += started - queued_at
+        self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - started
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run fn(*args) on an inference thread and await the result"""
+        self.submitted += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._call, fn, args, time.perf_counter())
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.submitted - self.completed - self.running,
+            "completed": self.completed,
+            "avg_wait_ms": round(1000 * self.wait_seconds / self.completed, 2) if self.completed else 0.0,
+            "avg_run_ms": round(1000 * self.busy_seconds / self.completed, 2) if self.completed else 0.0
+        }
+
+
+inference_executor = InferenceExecutor()
+
+
+class Readiness:
+    """Startup state reported by /api/ready"""
+
+    def __init__(self):
+        self.state = "starting"  # starting -> warming -> ready
+        self.error: Optional[str] = None
+        self.warmup_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.state,
+            "preload": EMBEDDING_PRELOAD,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error
+        }
+
+
+readiness = Readiness()
+
+
+def _warmup():
+    """Load the model and the index, then encode a dummy batch (inference thread)"""
+    from app.services.embedding_service import get_embeddings, get_snapshot, init_embeddings
+
+    if init_embeddings() is None:
+        raise RuntimeError("embedding model could not be loaded")
+    get_snapshot()
+    if get_embeddings(WARMUP_TEXTS) is None:
+        raise RuntimeError("warmup encode failed")
+
+
+async def warmup():
+    """
+    Preload and warm the embedding model when EMBEDDING_PRELOAD=1, then mark
+    the app ready. A failed warmup is logged and the app still becomes ready
+    (the model loads lazily on first use, and lexical search works without it).
+    """
+    from app.services.embedding_service import EMBEDDINGS_AVAILABLE, get_snapshot
+    from app.services.embedding_sidecar import EMBEDDING_SIDECAR_FALLBACK, sidecar_client
+
+    if not EMBEDDING_PRELOAD or not EMBEDDINGS_AVAILABLE:
+        readiness.state = "ready"
+        return
+
+    readiness.state = "warming"
+    started = time.perf_counter()
+    try:
+        if sidecar_client.enabled and await sidecar_client.embed_many(WARMUP_TEXTS) is not None:
+            # The sidecar holds the model; only the index is loaded here
+            await asyncio.to_thread(get_snapshot)
+        elif sidecar_client.enabled and not EMBEDDING_SIDECAR_FALLBACK:
+            raise RuntimeError(f"embedding sidecar unavailable at {sidecar_client.path}")
+        else:
+            await inference_executor.run(_warmup)
+        logger.info(f"✓ Embedding model warmed up in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        readiness.error = str(e)
+        logger.error(f"Embedding warmup failed: {e}")
+    readiness.warmup_seconds = round(time.perf_counter() - started, 3)
+    readiness.state = "ready"
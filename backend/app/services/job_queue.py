@@ -0,0 +1,379 @@
+"""
+Durable background job queue for document ingestion
+
+Jobs are rows of the ingest_job table, so queued work survives restarts.
+A pool of worker tasks on the app's event loop claims the oldest runnable
+job; failed jobs are retried with a growing delay up to JOB_MAX_ATTEMPTS.
+A claimed job holds a lease of JOB_LEASE_SECONDS that its worker renews
+while it runs; jobs whose lease ran out (their worker process died) are
+requeued, without disturbing jobs other workers are still running.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_MAX_DEPTH = int(os.environ.get("JOB_QUEUE_MAX_DEPTH", "1000"))  # queued + running
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", "5"))  # seconds, times the attempt number
+# Idle workers also poll, to pick up jobs enqueued by other processes
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "2"))
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))  # renewed every third of it
+
+JOB_COLUMNS = (
+    "id, kind, document_id, status, attempts, error, result, created_at, run_after, "
+    "started_at, finished_at, lease_owner, lease_until"
+)
+
+# Identifies the jobs leased by this process
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class QueueFullError(Exception):
+    """The queue already holds JOB_QUEUE_MAX_DEPTH pending jobs"""
+
+
+async def _run_index_document(document_id: int) -> dict:
+    """Chunk, embed and index a stored document"""
+    from app.database import SessionLocal
+    from app.services.indexing_service import index_document
+
+    with SessionLocal() as session:
+        row = await asyncio.to_thread(
+            lambda: session.execute(
+                text("SELECT content, language FROM document WHERE id = :id"),
+                {"id": document_id}
+            ).fetchone()
+        )
+        if row is None:
+            return {"skipped": "document deleted"}
+        result = await index_document(session, document_id, row[0], row[1])
+        return result._asdict()
+
+
+def job_to_dict(row) -> dict:
+    job = dict(row._mapping)
+    if job.get("result"):
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+class JobQueue:
+    """SQLite-backed job queue with an asyncio worker pool"""
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        max_depth: int = JOB_QUEUE_MAX_DEPTH,
+        max_attempts: int = JOB_MAX_ATTEMPTS
+    ):
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.max_attempts = max(1, max_attempts)
+        self.handlers: Dict[str, Callable[[int], Awaitable[dict]]] = {
+            "index_document": _run_index_document
+        }
+        self.tasks = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.last_requeue = 0.0
+
+        # Stats (this process)
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    # ------------------------------------------------------------------
+    # Producer side (called from routes, in the caller's transaction)
+    # ------------------------------------------------------------------
+
+    def depth(self, session) -> int:
+        return session.execute(
+            text("SELECT COUNT(*) FROM ingest_job WHERE status IN ('queued', 'running')")
+        ).scalar() or 0
+
+    def check_capacity(self, session):
+        if self.max_depth > 0 and self.depth(session) >= self.max_depth:
+            raise QueueFullError(f"Ingest queue is full ({self.max_depth} pending jobs)")
+
+    def enqueue(self, session, kind: str, document_id: int) -> int:
+        """
+        Add a job without committing, so it lands atomically with the
+        document row. A job of the same kind already queued for the
+        document is reused. Call notify() after the commit.
+        """
+        existing = session.execute(
+            text("""
+                SELECT id FROM ingest_job
+                WHERE kind = :kind AND document_id = :document_id AND status = 'queued'
+                ORDER BY id LIMIT 1
+            """),
+            {"kind": kind, "document_id": document_id}
+        ).scalar()
+        if existing is not None:
+            return existing
+        result = session.execute(
+            text("INSERT INTO ingest_job (kind, document_id, status) VALUES (:kind, :document_id, 'queued')"),
+            {"kind": kind, "document_id": document_id}
+        )
+        return result.lastrowid
+
+    def notify(self):
+        """Wake idle workers (call on the event loop after committing a job)"""
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def get_job(self, session, job_id: int) -> Optional[dict]:
+        row = session.execute(
+            text(f"SELECT {JOB_COLUMNS} FROM ingest_job WHERE id = :id"),
+            {"id": job_id}
+        ).fetchone()
+        if row is None:
+            return None
+        job = job_to_dict(row)
+        if job["status"] == "queued":
+            job["queue_position"] = session.execute(
+                text("SELECT COUNT(*) FROM ingest_job WHERE status = 'queued' AND id < :id"),
+                {"id": job_id}
+            ).scalar() + 1
+        return job
+
+    def list_jobs(self, session, status: Optional[str] = None, limit: int = 50) -> list:
+        where = "WHERE status = :status" if status else ""
+        rows = session.execute(
+            text(f"SELECT {JOB_COLUMNS} FROM ingest_job {where} ORDER BY id DESC LIMIT :limit"),
+            {"status": status, "limit": limit}
+        ).fetchall()
+        return [job_to_dict(row) for row in rows]
+
+    def stats(self, session) -> dict:
+        counts = dict(session.execute(
+            text("SELECT status, COUNT(*) FROM ingest_job GROUP BY status")
+        ).fetchall())
+        return {
+            "counts": counts,
+            "depth": counts.get("queued", 0) + counts.get("running", 0),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "config": {
+                "workers": self.workers,
+                "max_depth": self.max_depth,
+                "max_attempts": self.max_attempts,
+                "retry_delay_seconds": JOB_RETRY_DELAY
+            }
+        }
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+
+    def _lease_params(self) -> dict:
+        return {"owner": LEASE_OWNER, "lease": f"+{int(JOB_LEASE_SECONDS)} seconds"}
+
+    def _requeue_expired(self):
+        """Requeue running jobs whose lease ran out (jobs of rows from before leases included)"""
+        from app.database import engine
+
+        self.last_requeue = time.monotonic()
+        with engine.begin() as conn:
+            requeued = conn.execute(
+                text("""
+                    UPDATE ingest_job
+                    SET status = 'queued', started_at = NULL, lease_owner = NULL, lease_until = NULL
+                    WHERE status = 'running' AND (lease_until IS NULL OR lease_until <= CURRENT_TIMESTAMP)
+                """)
+            ).rowcount
+        if requeued:
+            logger.info(f"Requeued {requeued} ingest jobs with an expired lease")
+
+    async def start(self):
+        """Requeue jobs of dead workers and start the worker pool"""
+        await asyncio.to_thread(self._requeue_expired)
+
+        self.wakeup = asyncio.Event()
+        self.tasks = [
+            asyncio.create_task(self._worker(), name=f"ingest-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"✓ Ingest queue started with {self.workers} workers")
+
+    async def stop(self):
+        """Cancel the workers and hand the jobs they were running back to the queue"""
+        from app.database import engine
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+        def release():
+            with engine.begin() as conn:
+                return conn.execute(
+                    text("""
+                        UPDATE ingest_job
+                        SET status = 'queued', started_at = NULL, lease_owner = NULL, lease_until = NULL
+                        WHERE status = 'running' AND lease_owner = :owner
+                    """),
+                    {"owner": LEASE_OWNER}
+                ).rowcount
+
+        try:
+            released = await asyncio.to_thread(release)
+        except Exception as e:
+            logger.warning(f"Could not requeue running ingest jobs, they wait for their lease to expire: {e}")
+            return
+        if released:
+            logger.info(f"Requeued {released} interrupted ingest jobs")
+
+    def _claim(self):
+        """
+        Mark the oldest runnable job as running, leased to this process.
+        Documents with a job already running are skipped, so jobs for one
+        document never overlap.
+        """
+        from app.database import engine
+
+        with engine.begin() as conn:
+            while True:
+                row = conn.execute(
+                    text("""
+                        SELECT id, kind, document_id, attempts FROM ingest_job
+                        WHERE status = 'queued'
+                          AND (run_after IS NULL OR run_after <= CURRENT_TIMESTAMP)
+                          AND (document_id IS NULL OR document_id NOT IN (
+                              SELECT document_id FROM ingest_job
+                              WHERE status = 'running' AND document_id IS NOT NULL
+                          ))
+                        ORDER BY id LIMIT 1
+                    """)
+                ).fetchone()
+                if row is None:
+                    return None
+                claimed = conn.execute(
+                    text("""
+                        UPDATE ingest_job
+                        SET status = 'running', attempts = attempts + 1, started_at = CURRENT_TIMESTAMP,
+                            lease_owner = :owner, lease_until = datetime('now', :lease)
+                        WHERE id = :id AND status = 'queued'
+                    """),
+                    {"id": row[0], **self._lease_params()}
+                ).rowcount
+                if claimed:
+                    return row
+
+    def _renew(self, job_id: int) -> bool:
+        """Extend the lease of a running job; False once it was lost"""
+        from app.database import engine
+
+        with engine.begin() as conn:
+            return conn.execute(
+                text("""
+                    UPDATE ingest_job SET lease_until = datetime('now', :lease)
+                    WHERE id = :id AND status = 'running' AND lease_owner = :owner
+                """),
+                {"id": job_id, **self._lease_params()}
+            ).rowcount > 0
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                if not await asyncio.to_thread(self._renew, job_id):
+                    logger.warning(f"Job {job_id} lost its lease")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of job {job_id}: {e}")
+
+    def _finish(self, job_id: int, status: str, result: Optional[dict] = None, error: Optional[str] = None, retry_in: float = 0.0):
+        """Record the outcome, unless the lease was lost and the job handed to another worker"""
+        from app.database import engine
+
+        with engine.begin() as conn:
+            if status == "queued":
+                conn.execute(
+                    text("""
+                        UPDATE ingest_job
+                        SET status = 'queued', error = :error, started_at = NULL,
+                            run_after = datetime('now', :delay), lease_owner = NULL, lease_until = NULL
+                        WHERE id = :id AND lease_owner = :owner
+                    """),
+                    {"id": job_id, "error": error, "delay": f"+{int(retry_in)} seconds", "owner": LEASE_OWNER}
+                )
+            else:
+                conn.execute(
+                    text("""
+                        UPDATE ingest_job
+                        SET status = :status, error = :error, result = :result, finished_at = CURRENT_TIMESTAMP,
+                            lease_owner = NULL, lease_until = NULL
+                        WHERE id = :id AND lease_owner = :owner
+                    """),
+                    {
+                        "id": job_id, "status": status, "error": error, "owner": LEASE_OWNER,
+                        "result": json.dumps(result) if result is not None else None
+                    }
+                )
+
+    async def _run(self, job):
+        job_id, kind, document_id, attempts = job
+        attempts += 1
+        handler = self.handlers.get(kind)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id), name=f"ingest-lease-{job_id}")
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {kind}")
+            result = await handler(document_id)
+            await asyncio.to_thread(self._finish, job_id, "done", result=result)
+            self.completed += 1
+            logger.info(f"✓ Job {job_id} ({kind}, doc_id={document_id}) done")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempts < self.max_attempts:
+                await asyncio.to_thread(self._finish, job_id, "queued", error=str(e), retry_in=JOB_RETRY_DELAY * attempts)
+                self.retried += 1
+                logger.warning(f"Job {job_id} failed (attempt {attempts}/{self.max_attempts}), retrying: {e}")
+            else:
+                await asyncio.to_thread(self._finish, job_id, "failed", error=str(e))
+                self.failed += 1
+                logger.error(f"Job {job_id} failed after {attempts} attempts: {e}")
+        finally:
+            heartbeat.cancel()
+
+    async def _worker(self):
+        while True:
+            # Cleared before the claim: a notify() while the claim runs in a
+            # thread sets it again, so the wakeup isn't lost
+            self.wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error(f"Could not claim ingest job: {e}")
+                job = None
+            if job is None:
+                if time.monotonic() - self.last_requeue >= JOB_LEASE_SECONDS:
+                    try:
+                        await asyncio.to_thread(self._requeue_expired)
+                    except Exception as e:
+                        logger.error(f"Could not requeue expired ingest jobs: {e}")
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,100 @@
+"""
+BM25 lexical retrieval over the SQLite FTS5 index, and rank fusion with
+vector search results
+"""
+
+import logging
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Standard RRF damping constant (Cormack et al.)
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class SearchHit(NamedTuple):
+    """One ranked document from any retriever"""
+    doc_id: int
+    score: float
+    chunk_id: Optional[int] = None  # Best passage (vector retriever)
+    snippet: Optional[str] = None  # Highlighted excerpt (lexical retriever)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 MATCH expression: every term is quoted (so
+    FTS operators in user input are inert) and terms are OR-ed, leaving
+    ranking to BM25.
+    """
+    terms = _TOKEN_RE.findall(query)
+    if not terms:
+        return None
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_lexical(query: str, top_k: int = 5, language: Optional[str] = None, filters=None) -> List[SearchHit]:
+    """
+    BM25 search over document title + content. Uses its own connection so
+    it can run on a worker thread next to the vector search. Language and
+    SearchFilters are applied in the same query, before the LIMIT.
+    """
+    from app.database import engine, FTS_AVAILABLE
+    from app.services.search_filters import filter_sql
+
+    match = build_match_query(query)
+    if not FTS_AVAILABLE or match is None:
+        return []
+
+    clauses, params = filter_sql(filters, alias="d")
+    if language is not None:
+        clauses.append("d.language = :language")
+        params["language"] = language
+    join = "JOIN document d ON d.id = document_fts.rowid" if clauses else ""
+    where = "".join(f" AND {clause}" for clause in clauses)
+
+    try:
+        with engine.connect() as conn:
+            # bm25() is lower-is-better; title matches weigh double
+            rows = conn.execute(
+                text(f"""
+                    SELECT document_fts.rowid, -bm25(document_fts, 2.0, 1.0) AS score,
+                           snippet(document_fts, 1, '', '', '...', 32)
+                    FROM document_fts {join}
+                    WHERE document_fts MATCH :match{where}
+                    ORDER BY bm25(document_fts, 2.0, 1.0)
+                    LIMIT :limit
+                """),
+                {"match": match, "limit": top_k, **params}
+            ).fetchall()
+        return [SearchHit(doc_id=row[0], score=float(row[1]), snippet=row[2]) for row in rows]
+    except Exception as e:
+        logger.error(f"Lexical search error: {e}")
+        return []
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[SearchHit]], top_k: int, k: int = RRF_K) -> List[SearchHit]:
+    """
+    Fuse ranked lists with reciprocal rank fusion: score = sum 1 / (k + rank).
+    The fused hit keeps the passage of the vector hit and the snippet of the
+    lexical hit when a document appears in both.
+    """
+    fused: Dict[int, SearchHit] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            contribution = 1.0 / (k + rank)
+            current = fused.get(hit.doc_id)
+            if current is None:
+                fused[hit.doc_id] = hit._replace(score=contribution)
+            else:
+                fused[hit.doc_id] = current._replace(
+                    score=current.score + contribution,
+                    chunk_id=current.chunk_id if current.chunk_id is not None else hit.chunk_id,
+                    snippet=current.snippet if current.snippet is not None else hit.snippet
+                )
+
+    return sorted(fused.values(), key=lambda hit: hit.score, reverse=True)[:top_k]
@@ -0,0 +1,225 @@
+"""
+Caches for the /api/search hot path
+"""
+
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "0"))  # seconds, 0 = no expiry
+
+
+# Bumped on every corpus change (vector index or documents); search result
+# cache entries from an older generation are never served. The counter
+# lives in the corpus_generation table, so a change made by one worker (or
+# a CLI run) invalidates the caches of all of them; index_generation is
+# this process's last reading of it.
+index_generation = 0
+
+
+def bump_index_generation() -> int:
+    """Mark the searchable corpus as changed (in every worker)"""
+    global index_generation
+    from app.database import engine
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE corpus_generation SET generation = generation + 1 WHERE id = 1"))
+            index_generation = conn.execute(text("SELECT generation FROM corpus_generation WHERE id = 1")).scalar()
+    except Exception as e:
+        # Other workers miss this change, this one still drops its entries
+        logger.warning(f"Could not bump the shared index generation: {e}")
+        index_generation += 1
+    return index_generation
+
+
+def current_index_generation() -> int:
+    """The shared corpus generation, read when a cache entry is looked up or stored"""
+    global index_generation
+    from app.database import engine
+
+    try:
+        with engine.connect() as conn:
+            generation = conn.execute(text("SELECT generation FROM corpus_generation WHERE id = 1")).scalar()
+    except Exception as e:
+        logger.warning(f"Could not read the shared index generation: {e}")
+        return index_generation
+    if generation is not None:
+        index_generation = generation
+    return index_generation
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form used as cache key (NFC, collapsed whitespace, lowercase)"""
+    return " ".join(unicodedata.normalize("NFC", text).split()).lower()
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of query embeddings keyed by (normalized query, model name).
+    Entries are dropped wholesale when the embedding model changes.
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.model_name = None
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _check_model(self, model_name: str):
+        if model_name != self.model_name:
+            if self.entries:
+                logger.info(f"Embedding model changed to {model_name}, clearing query cache")
+            self.entries.clear()
+            self.model_name = model_name
+
+    def get(self, query: str, model_name: str) -> Optional[np.ndarray]:
+        if self.max_size <= 0:
+            return None
+
+        key = (normalize_query(query), model_name)
+        with self.lock:
+            self._check_model(model_name)
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry[1] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query: str, model_name: str, embedding: np.ndarray):
+        if self.max_size <= 0 or embedding is None:
+            return
+
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)  # Shared between requests
+        key = (normalize_query(query), model_name)
+        with self.lock:
+            self._check_model(model_name)
+            self.entries[key] = (embedding, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl or None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+query_embedding_cache = QueryEmbeddingCache()
+
+
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+class SearchResultCache:
+    """
+    LRU of full search responses keyed by (query, top_k, language).
+
+    Every entry is tagged with the index generation it was computed at; an
+    entry from an older generation is never served, so no TTL is needed.
+    Evicts by entry count and by approximate serialized size.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[tuple, Tuple[int, object, int]]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query: str, *parts) -> tuple:
+        return (normalize_query(query),) + tuple(parts)
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def get(self, key: tuple, generation: int):
+        if self.max_entries <= 0:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != generation:
+                self._remove(key)
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, generation: int, value, size: int):
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (generation, value, size)
+            self.total_bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_dropped": self.stale,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+search_result_cache = SearchResultCache()
@@ -0,0 +1,240 @@
+"""
+Search pre-filters: per-document attributes and allowed-id bitmaps
+
+A bitmap is a bool array indexed by doc id. Language bitmaps are kept up to
+date by the ingest path of this process and reloaded from the document
+table when another worker has changed documents;
+created_at / doc_metadata bitmaps are computed with one SQL query and cached
+until the corpus changes. The vector search uses
+them to restrict the candidate rows before scoring instead of over-fetching
+and post-filtering.
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_LANGUAGE = "unknown"
+FILTER_CACHE_SIZE = 64
+
+_METADATA_KEY_RE = re.compile(r"^[\w\-. ]+$", re.UNICODE)
+
+
+def _timestamp(value: datetime) -> str:
+    """Format like SQLite CURRENT_TIMESTAMP (UTC) so text comparison works"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def filter_sql(filters, alias: str = "") -> Tuple[List[str], dict]:
+    """
+    WHERE clauses and parameters for the created_at / doc_metadata part of
+    a SearchFilters model, on the document table (optionally aliased).
+    Raises ValueError for metadata keys that can't be used as a JSON path.
+    """
+    prefix = f"{alias}." if alias else ""
+    clauses, params = [], {}
+    if filters is None:
+        return clauses, params
+    if filters.created_after is not None:
+        clauses.append(f"{prefix}created_at >= :created_after")
+        params["created_after"] = _timestamp(filters.created_after)
+    if filters.created_before is not None:
+        clauses.append(f"{prefix}created_at < :created_before")
+        params["created_before"] = _timestamp(filters.created_before)
+    for i, (key, value) in enumerate(sorted((filters.metadata or {}).items())):
+        if not _METADATA_KEY_RE.match(key):
+            raise ValueError(f"Invalid metadata filter key: {key!r}")
+        clauses.append(f"json_extract({prefix}doc_metadata, :meta_path{i}) = :meta_value{i}")
+        params[f"meta_path{i}"] = f'$."{key}"'
+        params[f"meta_value{i}"] = value
+    return clauses, params
+
+
+def _set_bit(bitmap: np.ndarray, doc_id: int, value: bool) -> np.ndarray:
+    """Set one bit, growing the bitmap (by doubling) when needed"""
+    if doc_id >= len(bitmap):
+        if not value:
+            return bitmap
+        grown = np.zeros(max(doc_id + 1, 2 * len(bitmap), 1024), dtype=bool)
+        grown[:len(bitmap)] = bitmap
+        bitmap = grown
+    bitmap[doc_id] = value
+    return bitmap
+
+
+def bitmap_from_ids(doc_ids) -> np.ndarray:
+    doc_ids = np.fromiter(doc_ids, dtype=np.int64)
+    bitmap = np.zeros(int(doc_ids.max()) + 1 if len(doc_ids) else 0, dtype=bool)
+    bitmap[doc_ids] = True
+    return bitmap
+
+
+def intersect(a: Optional[np.ndarray], b: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """AND two bitmaps of possibly different lengths (None = no restriction)"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    n = min(len(a), len(b))
+    return a[:n] & b[:n]
+
+
+def lookup(bitmap: np.ndarray, doc_ids: np.ndarray) -> np.ndarray:
+    """Vectorized membership test of doc ids in a bitmap"""
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    inside = (doc_ids >= 0) & (doc_ids < len(bitmap))
+    result = np.zeros(len(doc_ids), dtype=bool)
+    result[inside] = bitmap[doc_ids[inside]]
+    return result
+
+
+def _shared_generation(conn) -> int:
+    """Document attribute change counter shared by all workers"""
+    return conn.execute(text("SELECT attributes FROM corpus_generation WHERE id = 1")).scalar() or 0
+
+
+class DocumentAttributes:
+    """
+    doc id -> language table with one bitmap per language. Loaded from the
+    document table on first use and kept current by ingest and delete in
+    this process. Every change bumps a counter shared by the workers; when
+    it moved by more than this process's own bumps, another worker changed
+    documents and the table is reloaded.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.generation = None
+        self.languages: Dict[int, str] = {}
+        self.language_bitmaps: Dict[str, np.ndarray] = {}
+        self.filter_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def _ensure_loaded(self):
+        from app.database import engine
+
+        with engine.connect() as conn:
+            # Read before the SELECT, so a change landing in between is
+            # picked up next time rather than missed
+            generation = _shared_generation(conn)
+            if self.loaded and generation == self.generation:
+                return
+            rows = conn.execute(text("SELECT language, id FROM document")).fetchall()
+        self.languages = {}
+        self.language_bitmaps = {}
+        for language, doc_id in rows:
+            self._set(doc_id, language)
+        self.loaded = True
+        self.generation = generation
+
+    def _bump(self):
+        # Caller holds the lock and has applied its change locally
+        from app.database import engine
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE corpus_generation SET attributes = attributes + 1 WHERE id = 1"))
+                generation = _shared_generation(conn)
+        except Exception as e:
+            logger.warning(f"Could not bump the shared attribute generation: {e}")
+            self.loaded = False
+            return
+        if generation == self.generation + 1:
+            # Only our own change since the last load: no reload needed
+            self.generation = generation
+        # Otherwise another worker changed documents too; the next access
+        # reloads
+
+    def _set(self, doc_id: int, language: Optional[str]):
+        language = language or UNKNOWN_LANGUAGE
+        previous = self.languages.get(doc_id)
+        if previous is not None and previous != language:
+            self.language_bitmaps[previous] = _set_bit(self.language_bitmaps[previous], doc_id, False)
+        self.languages[doc_id] = language
+        bitmap = self.language_bitmaps.get(language, np.zeros(0, dtype=bool))
+        self.language_bitmaps[language] = _set_bit(bitmap, doc_id, True)
+
+    def set_language(self, doc_id: int, language: Optional[str]):
+        self.set_languages([(doc_id, language)])
+
+    def set_languages(self, pairs):
+        """Record the language of each (doc id, language) pair"""
+        with self.lock:
+            self._ensure_loaded()
+            for doc_id, language in pairs:
+                self._set(int(doc_id), language)
+            self._bump()
+
+    def remove(self, doc_id: int):
+        with self.lock:
+            self._ensure_loaded()
+            language = self.languages.pop(int(doc_id), None)
+            if language is not None:
+                self.language_bitmaps[language] = _set_bit(self.language_bitmaps[language], int(doc_id), False)
+            self._bump()
+
+    def languages_of(self, doc_ids) -> List[str]:
+        with self.lock:
+            self._ensure_loaded()
+            return [self.languages.get(int(doc_id), UNKNOWN_LANGUAGE) for doc_id in doc_ids]
+
+    def language_bitmap(self, language: str) -> np.ndarray:
+        with self.lock:
+            self._ensure_loaded()
+            # A copy: ingest grows and flips the live bitmaps in place
+            return self.language_bitmaps.get(language, np.zeros(0, dtype=bool)).copy()
+
+    def attribute_bitmap(self, filters) -> Optional[np.ndarray]:
+        """
+        Bitmap of documents matching the created_at range and doc_metadata
+        equality filters of a SearchFilters model (None when there is
+        nothing to filter on). Cached per filter until the corpus changes.
+        """
+        from app.services import search_cache
+
+        clauses, params = filter_sql(filters)
+        if not clauses:
+            return None
+
+        key = tuple(sorted(params.items()))
+        generation = search_cache.current_index_generation()
+        with self.lock:
+            cached = self.filter_cache.get(key)
+            if cached is not None and cached[0] == generation:
+                self.filter_cache.move_to_end(key)
+                return cached[1]
+
+        from app.database import engine
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT id FROM document WHERE {' AND '.join(clauses)}"),
+                params
+            ).fetchall()
+        bitmap = bitmap_from_ids(row[0] for row in rows)
+
+        with self.lock:
+            self.filter_cache[key] = (generation, bitmap)
+            self.filter_cache.move_to_end(key)
+            while len(self.filter_cache) > FILTER_CACHE_SIZE:
+                self.filter_cache.popitem(last=False)
+        return bitmap
+
+
+document_attributes = DocumentAttributes()
+
+
+def build_allowed_bitmap(filters) -> Optional[np.ndarray]:
+    """Allowed-document bitmap for a SearchFilters model (None = no restriction)"""
+    if filters is None:
+        return None
+    return document_attributes.attribute_bitmap(filters)
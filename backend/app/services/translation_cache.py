@@ -0,0 +1,295 @@
+"""
+Two-tier cache of translations
+
+Translations are keyed by (source_lang, target_lang, normalized text). A
+bounded in-process LRU (TRANSLATION_CACHE_SIZE entries) sits in front of
+the translation_cache table, which survives restarts and is shared by all
+workers. At startup the TRANSLATION_CACHE_WARM most used rows are loaded
+into the LRU. With TRANSLATION_CACHE_TTL set, entries older than that many
+seconds are neither served nor kept.
+
+Hits of both tiers are counted in memory and added to the hits column in
+one write every TRANSLATION_CACHE_HIT_FLUSH hits or
+TRANSLATION_CACHE_HIT_FLUSH_SECONDS, and at shutdown.
+"""
+
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import bindparam, text
+
+from app.database import SessionLocal
+from app.services.embedding_cache import text_hash
+
+logger = logging.getLogger(__name__)
+
+TRANSLATION_CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", "10000"))
+TRANSLATION_CACHE_TTL = float(os.environ.get("TRANSLATION_CACHE_TTL", "0"))  # seconds, 0 = no expiry
+TRANSLATION_CACHE_WARM = int(os.environ.get("TRANSLATION_CACHE_WARM", str(TRANSLATION_CACHE_SIZE)))
+TRANSLATION_CACHE_PERSIST = os.environ.get("TRANSLATION_CACHE_PERSIST", "1") == "1"
+TRANSLATION_CACHE_HIT_FLUSH = int(os.environ.get("TRANSLATION_CACHE_HIT_FLUSH", "1000"))
+TRANSLATION_CACHE_HIT_FLUSH_SECONDS = float(os.environ.get("TRANSLATION_CACHE_HIT_FLUSH_SECONDS", "60"))
+
+
+def normalize_text(value: str) -> str:
+    """
+    Cache key form of a text: NFC, outer whitespace stripped and runs of
+    spaces/tabs collapsed. Case and line breaks are kept, since they change
+    the translation.
+    """
+    value = unicodedata.normalize("NFC", value).strip()
+    return "\n".join(" ".join(line.split()) for line in value.split("\n"))
+
+
+class TranslationCache:
+    """In-process LRU backed by the translation_cache table"""
+
+    def __init__(self, max_size: int = TRANSLATION_CACHE_SIZE, ttl: float = TRANSLATION_CACHE_TTL,
+                 persist: bool = TRANSLATION_CACHE_PERSIST):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+        # (source_lang, target_lang, normalized text) -> (translation, stored at)
+        self.entries: "OrderedDict[Tuple[str, str, str], Tuple[str, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+        # Hits not yet added to the table's usage counts
+        self.pending_hits: Dict[Tuple[str, str, str], int] = {}
+        self.pending_hit_count = 0
+        self.last_flush = time.monotonic()
+
+        # Stats
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stores = 0
+        self.warmed = 0
+        self.hit_flushes = 0
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def _remember(self, key: Tuple[str, str, str], translation: str, stored_at: float):
+        # Caller holds the lock
+        if self.max_size <= 0:
+            return
+        self.entries[key] = (translation, stored_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _count_hit(self, key: Tuple[str, str, str]):
+        # Caller holds the lock
+        if self.persist:
+            self.pending_hits[key] = self.pending_hits.get(key, 0) + 1
+            self.pending_hit_count += 1
+
+    def _flush_due(self) -> bool:
+        return self.pending_hit_count > 0 and (
+            self.pending_hit_count >= TRANSLATION_CACHE_HIT_FLUSH
+            or time.monotonic() - self.last_flush >= TRANSLATION_CACHE_HIT_FLUSH_SECONDS
+        )
+
+    def _ttl_clause(self) -> str:
+        return " AND created_at > datetime('now', :age)" if self.ttl > 0 else ""
+
+    def _ttl_params(self) -> dict:
+        return {"age": f"-{int(self.ttl)} seconds"} if self.ttl > 0 else {}
+
+    def lookup_many(self, source_lang: str, target_lang: str, texts: Iterable[str]) -> Dict[str, str]:
+        """
+        Cached translations of the given normalized texts, from memory first
+        and then from the table (blocking; call it off the event loop).
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            for value in dict.fromkeys(texts):
+                key = (source_lang, target_lang, value)
+                entry = self.entries.get(key)
+                if entry is not None and self._expired(entry[1]):
+                    del self.entries[key]
+                    entry = None
+                if entry is None:
+                    missing.append(value)
+                    continue
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                self._count_hit(key)
+                found[value] = entry[0]
+
+        if missing and self.persist:
+            try:
+                rows = self._select(source_lang, target_lang, missing)
+            except Exception as e:
+                # The table is only a cache; translate upstream instead
+                logger.warning(f"Translation cache lookup failed: {e}")
+                rows = []
+            with self.lock:
+                for value, translation, age in rows:
+                    key = (source_lang, target_lang, value)
+                    self._remember(key, translation, time.time() - age)
+                    self._count_hit(key)
+                    found[value] = translation
+                self.db_hits += len(rows)
+
+        with self.lock:
+            self.misses += sum(1 for value in missing if value not in found)
+            flush = self._flush_due()
+        if flush:
+            self.flush_hits()
+        return found
+
+    def _select(self, source_lang: str, target_lang: str, values: List[str]) -> List[Tuple[str, str, float]]:
+        hashes = {text_hash(value): value for value in values}
+        with SessionLocal() as session:
+            rows = session.execute(
+                text(f"""
+                    SELECT text_hash, translated_text,
+                           (julianday('now') - julianday(created_at)) * 86400
+                    FROM translation_cache
+                    WHERE source_lang = :source_lang AND target_lang = :target_lang
+                      AND text_hash IN :hashes{self._ttl_clause()}
+                """).bindparams(bindparam("hashes", expanding=True)),
+                {"source_lang": source_lang, "target_lang": target_lang, "hashes": list(hashes), **self._ttl_params()}
+            ).fetchall()
+        return [(hashes[row[0]], row[1], row[2] or 0.0) for row in rows]
+
+    def flush_hits(self) -> int:
+        """
+        Add the pending hit counts to the table in one transaction
+        (blocking). The usage count decides what the next startup warms.
+        """
+        with self.lock:
+            pending, self.pending_hits = self.pending_hits, {}
+            self.pending_hit_count = 0
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            with SessionLocal() as session:
+                session.execute(
+                    text("""
+                        UPDATE translation_cache SET hits = hits + :count
+                        WHERE source_lang = :source_lang AND target_lang = :target_lang AND text_hash = :text_hash
+                    """),
+                    [
+                        {"source_lang": source_lang, "target_lang": target_lang, "text_hash": text_hash(value), "count": count}
+                        for (source_lang, target_lang, value), count in pending.items()
+                    ]
+                )
+                session.commit()
+        except Exception as e:
+            # Counts only steer warm-up; losing a few is harmless
+            logger.warning(f"Could not record {len(pending)} translation cache hit counts: {e}")
+            return 0
+        self.hit_flushes += 1
+        return len(pending)
+
+    def store_many(self, source_lang: str, target_lang: str, translations: Dict[str, str]):
+        """Cache translations of normalized texts in both tiers (blocking)"""
+        if not translations:
+            return
+        now = time.time()
+        with self.lock:
+            for value, translation in translations.items():
+                self._remember((source_lang, target_lang, value), translation, now)
+            self.stores += len(translations)
+
+        if not self.persist:
+            return
+        try:
+            with SessionLocal() as session:
+                session.execute(
+                    # An upsert, not INSERT OR REPLACE, so a re-stored
+                    # translation keeps its usage count for warm-up
+                    text("""
+                        INSERT INTO translation_cache
+                            (source_lang, target_lang, text_hash, source_text, translated_text)
+                        VALUES (:source_lang, :target_lang, :text_hash, :source_text, :translated_text)
+                        ON CONFLICT (source_lang, target_lang, text_hash) DO UPDATE SET
+                            translated_text = excluded.translated_text,
+                            created_at = CURRENT_TIMESTAMP
+                    """),
+                    [
+                        {
+                            "source_lang": source_lang,
+                            "target_lang": target_lang,
+                            "text_hash": text_hash(value),
+                            "source_text": value,
+                            "translated_text": translation
+                        }
+                        for value, translation in translations.items()
+                    ]
+                )
+                session.commit()
+        except Exception as e:
+            logger.warning(f"Could not persist {len(translations)} translations: {e}")
+
+    def warm(self, limit: int = TRANSLATION_CACHE_WARM) -> int:
+        """Drop expired rows and load the most used ones into memory (blocking)"""
+        if not self.persist or self.max_size <= 0 or limit <= 0:
+            return 0
+        try:
+            with SessionLocal() as session:
+                if self.ttl > 0:
+                    session.execute(
+                        text("DELETE FROM translation_cache WHERE created_at <= datetime('now', :age)"),
+                        self._ttl_params()
+                    )
+                    session.commit()
+                rows = session.execute(
+                    text("""
+                        SELECT source_lang, target_lang, source_text, translated_text,
+                               (julianday('now') - julianday(created_at)) * 86400
+                        FROM translation_cache
+                        ORDER BY hits DESC, created_at DESC
+                        LIMIT :limit
+                    """),
+                    {"limit": min(limit, self.max_size)}
+                ).fetchall()
+        except Exception as e:
+            logger.warning(f"Translation cache warm-up failed: {e}")
+            return 0
+
+        now = time.time()
+        with self.lock:
+            # Least used first, so the most used end up most recent
+            for source_lang, target_lang, value, translation, age in reversed(rows):
+                self._remember((source_lang, target_lang, value), translation, now - (age or 0.0))
+            self.warmed = len(rows)
+        logger.info(f"✓ Translation cache warmed with {len(rows)} entries")
+        return len(rows)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl or None,
+            "persistent": self.persist,
+            "warmed": self.warmed,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "pending_hit_counts": self.pending_hit_count,
+            "hit_flushes": self.hit_flushes,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "memory_hit_rate": round(self.memory_hits / total, 3) if total else 0.0
+        }
+
+
+translation_cache = TranslationCache()
@@ -0,0 +1,407 @@
+"""
+Pluggable approximate/exact vector index backends
+
+Every backend implements the VectorIndex interface over L2-normalized
+passage vectors keyed by vector (chunk) id, with cosine similarity scores:
+
+- annoy: Annoy forest (build only; no adds or removes after build)
+- faiss_flat: FAISS exact inner-product index (add / remove)
+- faiss_ivfpq: FAISS IVF with product quantization (add / remove; trained
+  at build time, approximate scores)
+- faiss_hnsw: FAISS HNSW graph (add; no removes)
+- numpy: in-memory NumPy matrix scanned by one mat-vec (add / remove)
+
+VECTOR_INDEX_BACKEND selects the backend used for new builds. Partitions
+saved by another backend stay searchable until the next build (or until
+`python -m app.services.vector_index migrate` converts them).
+"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Type
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import annoy
+except ImportError:
+    annoy = None
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+VECTOR_INDEX_BACKEND = os.environ.get("VECTOR_INDEX_BACKEND", "annoy").lower()
+
+ANNOY_TREES = int(os.environ.get("ANNOY_TREES", "10"))
+# IVF-PQ: number of inverted lists (capped by the partition size), lists
+# probed per query and PQ sub-quantizers (must divide the dimension)
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "1024"))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "16"))
+PQ_M = int(os.environ.get("PQ_M", "48"))
+# HNSW: graph degree and search beam width
+HNSW_M = int(os.environ.get("HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "128"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "200"))
+# Smaller IVF-PQ partitions use a flat index (too few points to train on)
+IVFPQ_MIN_VECTORS = int(os.environ.get("IVFPQ_MIN_VECTORS", "1000"))
+
+
+class VectorIndex:
+    """
+    Interface of a vector index partition. Instances are shared by
+    concurrent searches and the background merge; implementations that
+    mutate in place guard search/add/remove with self.lock.
+    """
+
+    kind = ""
+    supports_add = False
+    supports_remove = False
+    exact_scores = True  # False when search() scores are approximate (rescore them)
+    suffixes: Tuple[str, ...] = (".index",)  # Files written by save(), after the stem
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.lock = threading.RLock()
+
+    def build(self, vector_ids: np.ndarray, vectors: np.ndarray):
+        """Build from scratch (replaces any content)"""
+        raise NotImplementedError
+
+    def add(self, vector_ids: np.ndarray, vectors: np.ndarray):
+        raise NotImplementedError(f"{self.kind} index does not support adds")
+
+    def remove(self, vector_ids: np.ndarray) -> int:
+        raise NotImplementedError(f"{self.kind} index does not support removes")
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(vector ids, cosine scores) of the k nearest vectors, best first"""
+        raise NotImplementedError
+
+    def vector_ids(self) -> np.ndarray:
+        """Ids of the indexed vectors"""
+        raise NotImplementedError
+
+    def save(self, stem: Path):
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, stem: Path, dim: int) -> "VectorIndex":
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return len(self.vector_ids())
+
+    def stats(self) -> dict:
+        return {"backend": self.kind, "vectors": len(self)}
+
+
+def _write_replace(stem: Path, suffix: str, write):
+    """Write `<stem><suffix>` through a temp file and an atomic rename"""
+    path = stem.with_name(stem.name + suffix)
+    tmp_path = stem.with_name(stem.name + ".tmp" + suffix)
+    write(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+class AnnoyVectorIndex(VectorIndex):
+    """Annoy forest on euclidean distance; items are positions in vector_ids"""
+
+    kind = "annoy"
+    suffixes = (".index", ".mapping.npy")
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.index = annoy.AnnoyIndex(dim, metric='euclidean')
+        self.ids = np.empty(0, dtype=np.int64)
+
+    def build(self, vector_ids: np.ndarray, vectors: np.ndarray):
+        self.index = annoy.AnnoyIndex(self.dim, metric='euclidean')
+        for item, vector in enumerate(vectors):
+            self.index.add_item(item, vector)
+        self.index.build(ANNOY_TREES)
+        self.ids = np.array(vector_ids, dtype=np.int64)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, self.index.get_n_items())
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        items, distances = self.index.get_nns_by_vector(query, k, include_distances=True)
+        items = np.asarray(items, dtype=np.int64)
+        keep = items < len(self.ids)
+        # Vectors are unit length, so euclidean distance d maps to cosine
+        # similarity 1 - d^2 / 2
+        distances = np.asarray(distances, dtype=np.float32)[keep]
+        return self.ids[items[keep]], 1.0 - distances ** 2 / 2.0
+
+    def vector_ids(self) -> np.ndarray:
+        return self.ids
+
+    def save(self, stem: Path):
+        # Annoy reloads the saved file after save(), so the in-memory index
+        # is backed by the renamed file afterwards
+        _write_replace(stem, ".index", lambda path: self.index.save(str(path)))
+        _write_replace(stem, ".mapping.npy", lambda path: np.save(path, self.ids))
+
+    @classmethod
+    def load(cls, stem: Path, dim: int) -> "AnnoyVectorIndex":
+        instance = cls(dim)
+        instance.index.load(str(stem.with_name(stem.name + ".index")))
+        instance.ids = np.load(stem.with_name(stem.name + ".mapping.npy"), mmap_mode='r')
+        return instance
+
+
+class FaissVectorIndex(VectorIndex):
+    """FAISS index wrapped in an IndexIDMap2, so faiss ids are vector ids"""
+
+    kind = "faiss_flat"
+    supports_add = True
+    supports_remove = True
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.index = faiss.IndexIDMap2(self._new_index(0))
+
+    def _new_index(self, n_vectors: int):
+        return faiss.IndexFlatIP(self.dim)
+
+    def _train(self, index, vectors: np.ndarray):
+        pass
+
+    def build(self, vector_ids: np.ndarray, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        inner = self._new_index(len(vectors))
+        self._train(inner, vectors)
+        index = faiss.IndexIDMap2(inner)
+        if len(vectors):
+            index.add_with_ids(vectors, np.asarray(vector_ids, dtype=np.int64))
+        with self.lock:
+            self.index = index
+
+    def add(self, vector_ids: np.ndarray, vectors: np.ndarray):
+        with self.lock:
+            self.index.add_with_ids(
+                np.ascontiguousarray(vectors, dtype=np.float32),
+                np.asarray(vector_ids, dtype=np.int64)
+            )
+
+    def remove(self, vector_ids: np.ndarray) -> int:
+        with self.lock:
+            return int(self.index.remove_ids(np.asarray(vector_ids, dtype=np.int64)))
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        with self.lock:
+            k = min(k, self.index.ntotal)
+            if k <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            scores, labels = self.index.search(np.asarray(query, dtype=np.float32).reshape(1, -1), k)
+        keep = labels[0] >= 0
+        return labels[0][keep], scores[0][keep]
+
+    def vector_ids(self) -> np.ndarray:
+        with self.lock:
+            return faiss.vector_to_array(self.index.id_map).astype(np.int64)
+
+    def __len__(self) -> int:
+        return int(self.index.ntotal)
+
+    def save(self, stem: Path):
+        with self.lock:
+            _write_replace(stem, ".index", lambda path: faiss.write_index(self.index, str(path)))
+
+    @classmethod
+    def load(cls, stem: Path, dim: int) -> "FaissVectorIndex":
+        instance = cls(dim)
+        instance.index = faiss.read_index(str(stem.with_name(stem.name + ".index")))
+        instance._configure()
+        return instance
+
+    def _configure(self, index=None):
+        """Apply search-time parameters after a load"""
+
+
+class FaissIVFPQIndex(FaissVectorIndex):
+    """Inverted lists over PQ codes: ~PQ_M bytes per vector, trained on the build set"""
+
+    kind = "faiss_ivfpq"
+    exact_scores = False
+
+    def _new_index(self, n_vectors: int):
+        if n_vectors < IVFPQ_MIN_VECTORS:
+            return faiss.IndexFlatIP(self.dim)
+        # k-means wants ~39 points per centroid, PQ 2^nbits points per sub-quantizer
+        nlist = max(1, min(IVF_NLIST, n_vectors // 39))
+        nbits = int(min(8, np.log2(n_vectors)))
+        m = PQ_M if self.dim % PQ_M == 0 else 1
+        quantizer = faiss.IndexFlatIP(self.dim)
+        return faiss.IndexIVFPQ(quantizer, self.dim, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)
+
+    def _train(self, index, vectors: np.ndarray):
+        if not index.is_trained:
+            index.train(vectors)
+        self._configure(index)
+
+    def _configure(self, index=None):
+        ivf = faiss.try_extract_index_ivf(index if index is not None else self.index)
+        if ivf is not None:
+            ivf.nprobe = IVF_NPROBE
+
+    def stats(self) -> dict:
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is None:
+            return {**super().stats(), "nlist": 0}
+        return {**super().stats(), "nlist": int(ivf.nlist), "nprobe": int(ivf.nprobe)}
+
+
+class FaissHNSWIndex(FaissVectorIndex):
+    """HNSW graph over full vectors; deleted vectors stay in the graph until the next build"""
+
+    kind = "faiss_hnsw"
+    supports_remove = False
+
+    def _new_index(self, n_vectors: int):
+        index = faiss.IndexHNSWFlat(self.dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    def _configure(self, index=None):
+        faiss.downcast_index(self.index.index).hnsw.efSearch = HNSW_EF_SEARCH
+
+    def remove(self, vector_ids: np.ndarray) -> int:
+        raise NotImplementedError("faiss_hnsw index does not support removes")
+
+
+class NumpyVectorIndex(VectorIndex):
+    """Exact search over an in-memory float32 matrix (copy-on-write updates)"""
+
+    kind = "numpy"
+    supports_add = True
+    supports_remove = True
+    suffixes = (".vectors.npy", ".mapping.npy")
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+
+    def build(self, vector_ids: np.ndarray, vectors: np.ndarray):
+        ids = np.array(vector_ids, dtype=np.int64)
+        matrix = np.array(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        with self.lock:
+            self.ids, self.matrix = ids, matrix
+
+    def add(self, vector_ids: np.ndarray, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self.lock:
+            self.ids = np.concatenate([self.ids, np.asarray(vector_ids, dtype=np.int64)])
+            self.matrix = np.concatenate([self.matrix, vectors])
+
+    def remove(self, vector_ids: np.ndarray) -> int:
+        with self.lock:
+            keep = ~np.isin(self.ids, np.asarray(vector_ids, dtype=np.int64))
+            removed = len(self.ids) - int(keep.sum())
+            if removed:
+                self.ids, self.matrix = self.ids[keep], self.matrix[keep]
+            return removed
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        with self.lock:
+            ids, matrix = self.ids, self.matrix
+        k = min(k, len(ids))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = np.asarray(matrix @ query, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return ids[top], scores[top]
+
+    def vector_ids(self) -> np.ndarray:
+        return self.ids
+
+    def save(self, stem: Path):
+        with self.lock:
+            ids, matrix = self.ids, self.matrix
+        _write_replace(stem, ".vectors.npy", lambda path: np.save(path, matrix))
+        _write_replace(stem, ".mapping.npy", lambda path: np.save(path, ids))
+
+    @classmethod
+    def load(cls, stem: Path, dim: int) -> "NumpyVectorIndex":
+        instance = cls(dim)
+        instance.build(
+            np.load(stem.with_name(stem.name + ".mapping.npy")),
+            np.load(stem.with_name(stem.name + ".vectors.npy"))
+        )
+        return instance
+
+
+BACKENDS: Dict[str, Type[VectorIndex]] = {
+    backend.kind: backend
+    for backend in (AnnoyVectorIndex, FaissVectorIndex, FaissIVFPQIndex, FaissHNSWIndex, NumpyVectorIndex)
+}
+
+
+def backend_available(kind: str) -> bool:
+    if kind == "annoy":
+        return annoy is not None
+    if kind.startswith("faiss_"):
+        return faiss is not None
+    return kind in BACKENDS
+
+
+def _backend(kind: str) -> Type[VectorIndex]:
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown vector index backend: {kind} (choose from {', '.join(BACKENDS)})")
+    if not backend_available(kind):
+        raise RuntimeError(f"Vector index backend {kind} is not installed")
+    return BACKENDS[kind]
+
+
+def create_index(dim: int, kind: Optional[str] = None) -> VectorIndex:
+    """Empty index of the given (default: configured) backend"""
+    return _backend(kind or VECTOR_INDEX_BACKEND)(dim)
+
+
+def load_index(stem: Path, dim: int, kind: str) -> VectorIndex:
+    return _backend(kind).load(stem, dim)
+
+
+def index_files(stem: Path) -> List[Path]:
+    """Every file any backend may have written for a partition stem"""
+    suffixes = {suffix for backend in BACKENDS.values() for suffix in backend.suffixes}
+    return [stem.with_name(stem.name + suffix) for suffix in sorted(suffixes)]
+
+
+def migrate(kind: str) -> int:
+    """
+    Rebuild every partition with another backend from the vectors in the
+    embedding store (no document is re-encoded). Returns the vector count.
+    """
+    from app.services import embedding_service
+
+    _backend(kind)
+    embedding_service.get_snapshot()
+    return embedding_service._rebuild_segment(backend=kind)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Vector index maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="Convert the saved index to another backend")
+    migrate_parser.add_argument("--to", default=VECTOR_INDEX_BACKEND, choices=sorted(BACKENDS))
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        total = migrate(args.to)
+        print(f"Migrated {total} vectors to {args.to}")
+        if args.to != VECTOR_INDEX_BACKEND:
+            print(f"Set VECTOR_INDEX_BACKEND={args.to} for the server, or its next build converts the index back")
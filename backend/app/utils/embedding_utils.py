@@ -15,11 +15,15 @@ logger = logging.getLogger(__name__)
 INDEX_DIR = Path("data")
 INDEX_PATH = INDEX_DIR / "faiss.index"
 MAPPING_PATH = INDEX_DIR / "doc_mapping.json"
+NPY_MAGIC = b"\x93NUMPY"  # Legacy np.save BLOBs
 
 
 def serialize_embedding(vec: np.ndarray) -> bytes:
     """
-    Serialize numpy array to bytes using .npy format.
+    Serialize numpy array to raw little-endian float32 bytes.
+    
+    (Older rows hold .npy files with a ~128 byte header per vector;
+    deserialize_embedding reads both.)
     
     Args:
         vec: numpy array (float32)
@@ -31,10 +35,7 @@ def serialize_embedding(vec: np.ndarray) -> bytes:
         return None
     
     try:
-        buf = io.BytesIO()
-        np.save(buf, vec.astype(np.float32), allow_pickle=False)
-        buf.seek(0)
-        return buf.read()
+        return np.asarray(vec, dtype="<f4").reshape(-1).tobytes()
     except Exception as e:
         logger.error(f"Embedding serialization error: {e}")
         return None
@@ -45,7 +46,7 @@ def deserialize_embedding(data: bytes) -> Optional[np.ndarray]:
     Deserialize bytes back to numpy array.
     
     Args:
-        data: bytes from database
+        data: bytes from database (raw float32 or legacy .npy)
     
     Returns:
         numpy array or None if invalid
@@ -54,10 +55,11 @@ def deserialize_embedding(data: bytes) -> Optional[np.ndarray]:
         return None
     
     try:
-        buf = io.BytesIO(data)
-        buf.seek(0)
-        arr = np.load(buf, allow_pickle=False)
-        return arr.astype(np.float32)
+        if bytes(data[:6]) == NPY_MAGIC:
+            buf = io.BytesIO(data)
+            arr = np.load(buf, allow_pickle=False)
+            return arr.astype(np.float32)
+        return np.frombuffer(data, dtype="<f4").astype(np.float32)
     except Exception as e:
         logger.error(f"Embedding deserialization error: {e}")
         return None
@@ -0,0 +1,36 @@
+"""
+Extract plain text from uploaded document files (TXT, PDF, DOCX)
+"""
+
+import io
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {'.txt', '.pdf', '.docx'}
+
+
+def extract_text(filename: str, content: bytes) -> str:
+    """Text of an uploaded file; falls back to a placeholder when a parser is missing"""
+    file_ext = Path(filename).suffix.lower()
+
+    if file_ext == '.pdf':
+        # Simple PDF extraction (install pypdf)
+        try:
+            import pypdf
+            pdf_reader = pypdf.PdfReader(io.BytesIO(content))
+            return "\n".join([page.extract_text() for page in pdf_reader.pages])
+        except Exception:
+            logger.warning("pypdf not installed, saving raw file")
+            return f"[PDF content - {len(content)} bytes]"
+    if file_ext == '.docx':
+        # Simple DOCX extraction (install python-docx)
+        try:
+            from docx import Document
+            doc = Document(io.BytesIO(content))
+            return "\n".join([para.text for para in doc.paragraphs])
+        except Exception:
+            logger.warning("python-docx not installed, saving raw file")
+            return f"[DOCX content - {len(content)} bytes]"
+    return content.decode('utf-8', errors='ignore')
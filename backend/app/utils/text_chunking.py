@@ -0,0 +1,45 @@
+"""
+Split documents into overlapping passages for embedding
+"""
+
+import os
+import re
+from typing import List, NamedTuple
+
+# Sizes are in words: all-MiniLM-L6-v2 truncates at 256 word pieces, so
+# ~180 words keeps most passages inside the model window
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "180"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "40"))
+
+_WORD_RE = re.compile(r"\S+")
+
+
+class Passage(NamedTuple):
+    """A passage of a document and where it starts"""
+    index: int
+    text: str
+    start_char: int
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Passage]:
+    """
+    Split text into passages of `chunk_size` words, each sharing `overlap`
+    words with the previous one. Passages are cut from the original string,
+    so whitespace and line breaks inside a passage are preserved.
+    """
+    chunk_size = max(1, chunk_size)
+    overlap = min(max(0, overlap), chunk_size - 1)
+    step = chunk_size - overlap
+
+    words = [match.span() for match in _WORD_RE.finditer(text or "")]
+    if not words:
+        return []
+
+    passages = []
+    for start in range(0, len(words), step):
+        end = min(start + chunk_size, len(words))
+        start_char = words[start][0]
+        passages.append(Passage(len(passages), text[start_char:words[end - 1][1]], start_char))
+        if end == len(words):
+            break
+    return passages
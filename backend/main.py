@@ -4,12 +4,13 @@ FastAPI application for Machine Translation and Document Search
 
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from pathlib import Path
+import asyncio
 import logging
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.routes import translation_routes, search_routes, document_routes, search_web_routes, tts_routes
+from app.routes import translation_routes, search_routes, document_routes, search_web_routes, tts_routes, job_routes
 from app.database import init_db
 
 # Configure logging
@@ -37,9 +38,35 @@ app.include_router(translation_routes.router, prefix="/api", tags=["translation"
 app.include_router(search_routes.router, prefix="/api", tags=["search"])
 app.include_router(search_web_routes.router, prefix="/api/search", tags=["web-search"])
 app.include_router(document_routes.router, prefix="/api", tags=["documents"])
+app.include_router(job_routes.router, prefix="/api", tags=["jobs"])
 app.include_router(tts_routes.router, tags=["text-to-speech"])
 
-# Mount static files
+
+@app.get("/api/health")
+async def health_check():
+    """Health check endpoint"""
+    return {
+        "status": "healthy",
+        "service": "Machine Translation & Document Search"
+    }
+
+
+@app.get("/api/ready")
+async def readiness_check():
+    """Readiness: 200 once startup (and the optional model warmup) has finished, 503 before"""
+    from app.services.inference import readiness
+    return JSONResponse(readiness.to_dict(), status_code=200 if readiness.ready else 503)
+
+
+@app.get("/api/http/stats")
+async def http_client_stats():
+    """Connection pool and per-host request metrics of the upstream HTTP client"""
+    from app.services.http_client import http_client
+    return http_client.stats()
+
+
+# Mount static files (after every API route: the mount at "/" matches any
+# path, so routes declared below it are never reached)
 frontend_path = Path(__file__).parent.parent / "frontend"
 if frontend_path.exists():
     # Mount static files at root for direct access
@@ -55,15 +82,6 @@ async def root():
     return {"message": "Welcome to Haystack Translation"}
 
 
-@app.get("/api/health")
-async def health_check():
-    """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "service": "Machine Translation & Document Search"
-    }
-
-
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
@@ -74,9 +92,21 @@ async def startup_event():
         init_db()
         logger.info("✓ Database initialized")
         
+        # Background embedding/indexing of uploads
+        from app.services.job_queue import job_queue
+        await job_queue.start()
+        
         logger.info("Loading translation models...")
-        # Models load on-demand in routes, no need to pre-load
+        # Models load on-demand in routes, no need to pre-load; the most
+        # used cached translations are loaded into memory
+        from app.services.translation_cache import translation_cache
+        await asyncio.to_thread(translation_cache.warm)
         logger.info("Loading search models...")
+        # Opt-in (EMBEDDING_PRELOAD=1) model/index load and warmup; runs in
+        # the background so /api/health answers meanwhile, /api/ready flips
+        # when it is done
+        from app.services.inference import warmup
+        app.state.warmup_task = asyncio.create_task(warmup())
         logger.info("✓ Services initialized successfully")
     except Exception as e:
         logger.error(f"✗ Error initializing services: {e}", exc_info=True)
@@ -87,6 +117,14 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("Shutting down Machine Translation & Document Search API")
+    from app.services.job_queue import job_queue
+    from app.services.embedding_pool import shutdown_embedding_pool
+    from app.services.http_client import http_client
+    from app.services.translation_cache import translation_cache
+    await job_queue.stop()
+    shutdown_embedding_pool()
+    await http_client.aclose()
+    await asyncio.to_thread(translation_cache.flush_hits)
 
 
 if __name__ == "__main__":